@@ -16,6 +16,13 @@ class CustomUserAdmin(BaseUserAdmin):
         ('Role & Preferences', {
             'fields': ('role', 'phone_number', 'avatar', 'email_notifications', 'push_notifications')
         }),
+        ('Response Statistics', {
+            'fields': (
+                'inquiry_count', 'response_count', 'median_response_seconds', 'p90_response_seconds',
+                'fastest_response_seconds', 'slowest_response_seconds'
+            ),
+            'classes': ('collapse',)
+        }),
     )
     
     add_fieldsets = BaseUserAdmin.add_fieldsets + (
@@ -24,7 +31,11 @@ class CustomUserAdmin(BaseUserAdmin):
         }),
     )
     
-    readonly_fields = ['created_at', 'updated_at']
+    readonly_fields = [
+        'created_at', 'updated_at',
+        'inquiry_count', 'response_count', 'median_response_seconds', 'p90_response_seconds',
+        'fastest_response_seconds', 'slowest_response_seconds'
+    ]
     
     def get_readonly_fields(self, request, obj=None):
         """Make role readonly for existing users"""
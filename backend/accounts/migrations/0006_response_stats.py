@@ -0,0 +1,38 @@
+# Generated by Django 5.0.14 on 2026-10-18 23:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_follow'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='inquiry_count',
+            field=models.PositiveIntegerField(default=0, help_text='Conversations started by a tenant'),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='median_response_seconds',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='p90_response_seconds',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='response_count',
+            field=models.PositiveIntegerField(default=0, help_text='Conversations started by a tenant that the landlord replied to'),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='response_time_histogram',
+            field=models.JSONField(blank=True, default=list, help_text='First-response times counted per chat.response_stats bucket'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.14 on 2026-10-19 00:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_response_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='fastest_response_seconds',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='slowest_response_seconds',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
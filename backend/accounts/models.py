@@ -32,6 +32,27 @@ class CustomUser(AbstractUser):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    # Landlord first-response statistics, maintained incrementally by
+    # chat.response_stats so profiles and listing cards can show them as is
+    inquiry_count = models.PositiveIntegerField(
+        default=0,
+        help_text="Conversations started by a tenant"
+    )
+    response_count = models.PositiveIntegerField(
+        default=0,
+        help_text="Conversations started by a tenant that the landlord replied to"
+    )
+    response_time_histogram = models.JSONField(
+        default=list,
+        blank=True,
+        help_text="First-response times counted per chat.response_stats bucket"
+    )
+    # Bounds of the observed times, which the histogram estimates are clamped to
+    fastest_response_seconds = models.PositiveIntegerField(null=True, blank=True)
+    slowest_response_seconds = models.PositiveIntegerField(null=True, blank=True)
+    median_response_seconds = models.PositiveIntegerField(null=True, blank=True)
+    p90_response_seconds = models.PositiveIntegerField(null=True, blank=True)
+    
     # Override email to be required
     email = models.EmailField(unique=True)
     
@@ -47,6 +68,17 @@ class CustomUser(AbstractUser):
         """Check if user is a tenant"""
         return self.role == self.UserRole.TENANT
     
+    def response_stats(self):
+        """Public first-response statistics of a landlord (None for tenants)"""
+        if not self.is_landlord():
+            return None
+        return {
+            'median_response_seconds': self.median_response_seconds,
+            'p90_response_seconds': self.p90_response_seconds,
+            'response_rate': round(self.response_count / self.inquiry_count, 2) if self.inquiry_count else None,
+            'inquiry_count': self.inquiry_count,
+        }
+    
     def save(self, *args, **kwargs):
         """Override save to prevent role changes after creation"""
         if self.pk is not None:
@@ -0,0 +1,45 @@
+"""
+Cached user principals for token-authenticated WebSocket connects.
+
+A principal is the handful of user fields a chat socket needs (id, role
+and names). It is cached for PRINCIPAL_CACHE_TTL seconds and dropped
+whenever the user is saved or deleted (see accounts.signals), so a burst of
+reconnects after a deploy does not turn into one users-table query per
+socket. Changes made with queryset.update() skip the signals and show up
+once the entry expires.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+
+User = get_user_model()
+
+PRINCIPAL_CACHE_TTL = getattr(settings, 'PRINCIPAL_CACHE_TTL', 60)
+
+PRINCIPAL_FIELDS = ('id', 'email', 'username', 'first_name', 'last_name', 'role', 'is_active')
+
+
+def principal_cache_key(user_id):
+    return f'accounts:principal:{user_id}'
+
+
+def load_principal(user_id):
+    """Principal fields for a user from the database, or None if there is no such user"""
+    values = User.objects.filter(pk=user_id).values_list(*PRINCIPAL_FIELDS).first()
+    return list(values) if values is not None else None
+
+
+def build_user(values):
+    """
+    A CustomUser with only the principal fields loaded. Every other field
+    is deferred, so the full row is fetched from the database the first
+    time one of them is accessed.
+    """
+    by_name = dict(zip(PRINCIPAL_FIELDS, values))
+    # from_db takes the loaded values in model field order
+    field_names = [f.attname for f in User._meta.concrete_fields if f.attname in by_name]
+    return User.from_db(User.objects.db, field_names, [by_name[name] for name in field_names])
+
+
+def invalidate_principal(user_id):
+    cache.delete(principal_cache_key(user_id))
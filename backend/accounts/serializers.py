@@ -56,6 +56,7 @@ class UserSerializer(serializers.ModelSerializer):
     cover_file = serializers.ImageField(write_only=True, required=False)
     
     followers_count = serializers.SerializerMethodField()
+    response_stats = serializers.SerializerMethodField()
     
     class Meta:
         model = User
@@ -63,13 +64,16 @@ class UserSerializer(serializers.ModelSerializer):
             'id', 'email', 'username', 'role', 'first_name', 'last_name',
             'phone_number', 'avatar', 'cover_photo', 'bio', 'email_notifications', 'push_notifications',
             'created_at', 'updated_at', 'properties', 'avatar_file', 'cover_file',
-            'followers_count'
+            'followers_count', 'response_stats'
         ]
-        read_only_fields = ['id', 'email', 'role', 'created_at', 'updated_at', 'followers_count']
+        read_only_fields = ['id', 'email', 'role', 'created_at', 'updated_at', 'followers_count', 'response_stats']
 
     def get_followers_count(self, obj):
         return obj.followers.count()
 
+    def get_response_stats(self, obj):
+        return obj.response_stats()
+
     def get_properties(self, obj):
         if obj.role != User.UserRole.LANDLORD:
             return []
@@ -6,7 +6,7 @@ class MessageInline(admin.TabularInline):
     """Inline admin for messages"""
     model = Message
     extra = 0
-    fields = ['sender', 'content', 'is_read', 'timestamp']
+    fields = ['sender', 'content', 'timestamp']
     readonly_fields = ['timestamp']
     can_delete = False
 
@@ -15,7 +15,7 @@ class MessageInline(admin.TabularInline):
 class ChatRoomAdmin(admin.ModelAdmin):
     """Admin interface for ChatRoom"""
     
-    list_display = ['id', 'landlord', 'tenant', 'property', 'created_at', 'updated_at']
+    list_display = ['id', 'landlord', 'tenant', 'property', 'last_message_at', 'created_at', 'updated_at']
     list_filter = ['created_at', 'updated_at']
     search_fields = ['landlord__email', 'tenant__email', 'property__title']
     ordering = ['-updated_at']
@@ -29,8 +29,8 @@ class ChatRoomAdmin(admin.ModelAdmin):
 class MessageAdmin(admin.ModelAdmin):
     """Admin interface for Message"""
     
-    list_display = ['id', 'room', 'sender', 'content_preview', 'is_read', 'timestamp']
-    list_filter = ['is_read', 'timestamp']
+    list_display = ['id', 'room', 'sender', 'content_preview', 'timestamp']
+    list_filter = ['timestamp']
     search_fields = ['sender__email', 'content']
     ordering = ['-timestamp']
     
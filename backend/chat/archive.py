@@ -0,0 +1,301 @@
+"""
+Cold archival of old chat messages.
+
+archive_chat_messages moves each room's messages older than
+CHAT_ARCHIVE_AFTER_DAYS out of the Message table into gzip-compressed JSONL
+segments of up to CHAT_ARCHIVE_SEGMENT_SIZE messages, leaving one
+MessageSegment row per file. Segments are written to the storage backend
+new uploads use (properties.storage): a private Supabase bucket
+(CHAT_ARCHIVE_BUCKET) in production, CHAT_ARCHIVE_ROOT locally. Neither is
+publicly served.
+
+A room is archived up to a boundary that keeps every message newer than the
+boundary in the table, so segments always hold a room's oldest messages:
+- the room's latest message (the inbox summary points at it) stays;
+- so does every message a remaining message replies to.
+
+Archived messages are read-only history. MessageKeysetPagination pages
+through them after the table runs out, and cursors may point into them;
+they no longer appear in search, replays or the message detail endpoint.
+"""
+import gzip
+import json
+import os
+import uuid
+from datetime import datetime
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Min
+
+from properties.models import Property
+from properties.storage import LOCAL_BACKEND, get_default_backend, get_supabase_client
+
+from .models import Message, MessageSegment
+from .sharding import shard_for_room
+
+User = get_user_model()
+
+ARCHIVE_AFTER_DAYS = getattr(settings, 'CHAT_ARCHIVE_AFTER_DAYS', 90)
+SEGMENT_SIZE = getattr(settings, 'CHAT_ARCHIVE_SEGMENT_SIZE', 1000)
+ARCHIVE_BUCKET = getattr(settings, 'CHAT_ARCHIVE_BUCKET', 'chat-archive')
+ARCHIVE_ROOT = getattr(settings, 'CHAT_ARCHIVE_ROOT', os.path.join(settings.BASE_DIR, 'chat_archive'))
+# Segments never change once written, so cached copies never go stale
+SEGMENT_CACHE_TIMEOUT = 60 * 60
+
+
+def segment_cache_key(segment):
+    # Keyed by file, as segment ids are only unique per database (chat.sharding)
+    return f'chat:segment:{segment.backend}:{segment.key}'
+
+
+# Storage
+
+def write_segment_file(backend, key, content):
+    if backend == LOCAL_BACKEND:
+        path = os.path.join(ARCHIVE_ROOT, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as destination:
+            destination.write(content)
+    else:
+        get_supabase_client().storage.from_(ARCHIVE_BUCKET).upload(
+            key, content, file_options={'content-type': 'application/gzip'}
+        )
+
+
+def read_segment_file(backend, key):
+    if backend == LOCAL_BACKEND:
+        with open(os.path.join(ARCHIVE_ROOT, key), 'rb') as source:
+            return source.read()
+    return get_supabase_client().storage.from_(ARCHIVE_BUCKET).download(key)
+
+
+def delete_segment_file(backend, key):
+    if backend == LOCAL_BACKEND:
+        path = os.path.join(ARCHIVE_ROOT, key)
+        if os.path.exists(path):
+            os.remove(path)
+    else:
+        get_supabase_client().storage.from_(ARCHIVE_BUCKET).remove([key])
+
+
+# Segment format: one JSON object per message, oldest first
+
+def message_record(message):
+    """What a segment keeps of a message"""
+    reply_to = message.reply_to
+    return {
+        'id': message.id,
+        'sender': message.sender_id,
+        'content': message.content,
+        'timestamp': message.timestamp,
+        'edited_at': message.edited_at.isoformat() if message.edited_at else None,
+        # Replies are archived with (or after) the message they quote, so keep a copy
+        'reply_to': {
+            'id': reply_to.id,
+            'sender': reply_to.sender_id,
+            'content': reply_to.content,
+        } if reply_to else None,
+        'attachment': message.attachment.name or '',
+        'property': message.property_id,
+    }
+
+
+def encode_segment(records):
+    lines = (
+        json.dumps({**record, 'timestamp': record['timestamp'].isoformat()}, ensure_ascii=False, separators=(',', ':'))
+        for record in records
+    )
+    return gzip.compress('\n'.join(lines).encode('utf-8'))
+
+
+def decode_segment(content):
+    records = [json.loads(line) for line in gzip.decompress(content).decode('utf-8').splitlines()]
+    for record in records:
+        record['timestamp'] = datetime.fromisoformat(record['timestamp'])
+    return records
+
+
+def load_segment(segment):
+    """A segment's records, oldest first"""
+    cache_key = segment_cache_key(segment)
+    content = cache.get(cache_key)
+    if content is None:
+        content = read_segment_file(segment.backend, segment.key)
+        cache.set(cache_key, content, SEGMENT_CACHE_TIMEOUT)
+    return decode_segment(content)
+
+
+def record_key(record):
+    return record['timestamp'], record['id']
+
+
+# Reading
+
+def archived_cursor(room, pk):
+    """(timestamp, id) of archived message `pk` in `room`, or None"""
+    segments = room.message_segments.filter(min_message_id__lte=pk, max_message_id__gte=pk)
+    for segment in segments:
+        for record in load_segment(segment):
+            if record['id'] == pk:
+                return record_key(record)
+    return None
+
+
+def archived_before(room, cursor, limit):
+    """Up to `limit` archived records older than `cursor` (or the newest if None), newest first"""
+    segments = room.message_segments.order_by('-first_timestamp', '-first_message_id')
+    if cursor is not None:
+        segments = segments.filter(first_timestamp__lte=cursor[0])
+
+    records = []
+    for segment in segments.iterator():
+        older = [r for r in load_segment(segment) if cursor is None or record_key(r) < cursor]
+        records.extend(reversed(older))
+        if len(records) >= limit:
+            break
+    return records[:limit]
+
+
+def archived_after(room, cursor, limit):
+    """Up to `limit` archived records newer than `cursor`, oldest first"""
+    segments = room.message_segments.filter(
+        last_timestamp__gte=cursor[0]
+    ).order_by('first_timestamp', 'first_message_id')
+
+    records = []
+    for segment in segments.iterator():
+        records.extend(r for r in load_segment(segment) if record_key(r) > cursor)
+        if len(records) >= limit:
+            break
+    return records[:limit]
+
+
+def messages_from_records(room, records):
+    """
+    Unsaved Message instances for archived records, with the related
+    objects MessageSerializer reads already attached. Records from users
+    deleted since archival are dropped, as their messages would have been.
+    """
+    user_ids = {record['sender'] for record in records}
+    user_ids.update(record['reply_to']['sender'] for record in records if record['reply_to'])
+    users = User.objects.in_bulk(user_ids)
+    property_ids = {record['property'] for record in records if record['property']}
+    properties = Property.objects.with_cover_image().in_bulk(property_ids) if property_ids else {}
+
+    messages = []
+    for record in records:
+        sender = users.get(record['sender'])
+        if sender is None:
+            continue
+        message = Message(
+            id=record['id'],
+            room=room,
+            sender=sender,
+            content=record['content'],
+            timestamp=record['timestamp'],
+            attachment=record['attachment'],
+        )
+        message.edited_at = datetime.fromisoformat(record['edited_at']) if record['edited_at'] else None
+        message.property = properties.get(record['property'])
+        reply = record['reply_to']
+        if reply and reply['sender'] in users:
+            message.reply_to = Message(id=reply['id'], room=room, sender=users[reply['sender']], content=reply['content'])
+        message._state.adding = False
+        messages.append(message)
+    return messages
+
+
+# Archiving
+
+def archive_boundary(room, cutoff):
+    """
+    The timestamp before which `room`'s messages can be archived: at most
+    `cutoff`, and early enough to keep the latest message and every
+    message still replied to in the table.
+    """
+    messages = Message.objects.in_room(room)
+    latest = messages.order_by('-timestamp', '-id').values_list('timestamp', flat=True).first()
+    if latest is None:
+        return None
+    boundary = min(cutoff, latest)
+    if room.last_message_id is not None:
+        last = messages.filter(pk=room.last_message_id).values_list('timestamp', flat=True).first()
+        if last is not None:
+            boundary = min(boundary, last)
+
+    while True:
+        quoted = messages.filter(
+            timestamp__gte=boundary, reply_to__timestamp__lt=boundary
+        ).aggregate(oldest=Min('reply_to__timestamp'))['oldest']
+        if quoted is None:
+            return boundary
+        boundary = quoted
+
+
+def save_segment(room, records, message_ids, replaces=None):
+    """
+    Write `records` to a new segment and remove the messages they came
+    from, replacing the not yet full segment `replaces` if given.
+    """
+    backend = get_default_backend()
+    using = shard_for_room(room)
+    key = f"room_{room.id}/{records[0]['id']}-{records[-1]['id']}-{uuid.uuid4().hex[:8]}.jsonl.gz"
+    write_segment_file(backend, key, encode_segment(records))
+
+    ids = [record['id'] for record in records]
+    try:
+        with transaction.atomic(using=using):
+            segment = MessageSegment.objects.using(using).create(
+                room=room,
+                backend=backend,
+                key=key,
+                message_count=len(records),
+                first_timestamp=records[0]['timestamp'],
+                first_message_id=records[0]['id'],
+                last_timestamp=records[-1]['timestamp'],
+                last_message_id=records[-1]['id'],
+                min_message_id=min(ids),
+                max_message_id=max(ids),
+            )
+            if replaces is not None:
+                # Its file is removed once this commits (chat.signals)
+                replaces.delete()
+            # To clients the messages still exist (see delete_moved)
+            Message.objects.using(using).filter(pk__in=message_ids).delete_moved()
+    except Exception:
+        delete_segment_file(backend, key)
+        raise
+    return segment
+
+
+def archive_room(room, cutoff, segment_size=SEGMENT_SIZE):
+    """
+    Archive `room`'s messages older than `cutoff` (within the limits of
+    archive_boundary). Returns the number of messages archived.
+    """
+    boundary = archive_boundary(room, cutoff)
+    if boundary is None:
+        return 0
+    old = Message.objects.in_room(room).filter(
+        timestamp__lt=boundary
+    ).select_related('reply_to').order_by('timestamp', 'id')
+
+    # Top up the room's newest segment if an earlier run left it part full
+    tail = room.message_segments.order_by('-first_timestamp', '-first_message_id').first()
+    if tail is not None and tail.message_count < segment_size:
+        carried = load_segment(tail)
+    else:
+        carried, tail = [], None
+
+    archived = 0
+    while True:
+        chunk = list(old[:segment_size - len(carried)])
+        if not chunk:
+            return archived
+        records = carried + [message_record(message) for message in chunk]
+        save_segment(room, records, [message.id for message in chunk], replaces=tail)
+        archived += len(chunk)
+        carried, tail = [], None
@@ -0,0 +1,347 @@
+"""
+Write-behind persistence for chat messages sent over WebSockets.
+
+When CHAT_WRITE_BEHIND is enabled, consumers give each message its id and
+timestamp up front (the ordering key is (timestamp, id), as everywhere
+else), acknowledge and broadcast it straight away, and queue it on the
+process-wide MessageBatcher. The batcher inserts queued messages with one
+bulk_create per flush, applies each room's summary with a single UPDATE
+and runs the remaining post_save receivers (notifications) in the same
+transaction.
+
+Durability:
+- the sender's socket gets a "persisted" event once the batch holding its
+  message has committed, and a "failed" event if it could not be stored,
+  so clients keep unconfirmed messages pending and can resend them;
+- failing batches are retried, then stored message by message so one bad
+  row does not take the rest of the batch with it;
+- a socket drains the queue when it disconnects (including on graceful
+  server shutdown), and producers wait once CHAT_WRITE_BEHIND_MAX_PENDING
+  messages are queued.
+
+Messages sent with a client id are claimed in the cache before they are
+queued (claim_client_id), so a retry arriving while the original is still
+pending is recognised as well as one arriving after it was stored.
+"""
+import asyncio
+import logging
+import threading
+import weakref
+from collections import Counter, deque
+from contextlib import ExitStack
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.signals import post_save
+
+from .models import PREVIEW_LENGTH, ChatRoom, Message
+from .sharding import shard_for_room
+
+logger = logging.getLogger(__name__)
+
+FLUSH_RETRIES = 3
+RETRY_BACKOFF = 0.05
+# Outlasts any wait in the queue; stored messages are found in the table
+CLIENT_ID_CLAIM_TIMEOUT = 10 * 60
+
+
+def write_behind_enabled():
+    return getattr(settings, 'CHAT_WRITE_BEHIND', False)
+
+
+def reserve_message_ids(count):
+    """
+    Reserve `count` message ids from the id sequence of the message table
+    on 'default', so rows inserted later by the batcher, or on a shard
+    (chat.sharding), never collide with regular inserts.
+    """
+    table = Message._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+                [table, count]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+        if connection.vendor == 'sqlite':
+            # AUTOINCREMENT tables never hand out ids at or below sqlite_sequence.seq
+            with transaction.atomic():
+                cursor.execute(
+                    "UPDATE sqlite_sequence SET seq = seq + %s WHERE name = %s RETURNING seq",
+                    [count, table]
+                )
+                row = cursor.fetchone()
+                if row is None:
+                    # No row has been inserted into the table yet
+                    cursor.execute(f'SELECT COALESCE(MAX(id), 0) + %s FROM "{table}"', [count])
+                    row = cursor.fetchone()
+                    cursor.execute(
+                        "INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)",
+                        [table, row[0]]
+                    )
+            last = row[0]
+            return list(range(last - count + 1, last + 1))
+
+    raise ImproperlyConfigured(
+        f"CHAT_WRITE_BEHIND and CHAT_SHARDS are not supported on the '{connection.vendor}' database backend"
+    )
+
+
+class MessageIdAllocator:
+    """
+    Hands out reserved message ids, reserving CHAT_WRITE_BEHIND_ID_BLOCK_SIZE
+    at a time. Blocks larger than 1 save a query per message, but ids are
+    then only increasing within a process, and read watermarks (which
+    compare ids) can briefly cover messages from another process.
+    """
+
+    def __init__(self, block_size):
+        self.block_size = max(block_size, 1)
+        self._ids = deque()
+        self._lock = threading.Lock()
+
+    def next_id(self):
+        with self._lock:
+            if not self._ids:
+                self._ids.extend(reserve_message_ids(self.block_size))
+            return self._ids.popleft()
+
+
+_allocator = None
+_allocator_lock = threading.Lock()
+
+
+def allocate_message_id():
+    """Next reserved message id. Must be called from sync code."""
+    global _allocator
+    with _allocator_lock:
+        if _allocator is None:
+            _allocator = MessageIdAllocator(getattr(settings, 'CHAT_WRITE_BEHIND_ID_BLOCK_SIZE', 1))
+    return _allocator.next_id()
+
+
+def client_id_key(room_id, sender_id, client_id):
+    return f'chat:client-id:{room_id}:{sender_id}:{client_id}'
+
+
+def claim_client_id(message):
+    """
+    Claim an accepted message's client id for it. Returns None if the
+    client id is new, otherwise the (id, timestamp) of the message that
+    already has it, queued or stored. Must be called from sync code.
+    """
+    key = client_id_key(message.room_id, message.sender_id, message.client_id)
+    claim = (message.id, message.timestamp)
+    if not cache.add(key, claim, CLIENT_ID_CLAIM_TIMEOUT):
+        original = cache.get(key)
+        if original is not None:
+            return original
+        # The claim expired in between
+        cache.set(key, claim, CLIENT_ID_CLAIM_TIMEOUT)
+
+    stored = Message.objects.in_room(message.room_id).filter(
+        sender_id=message.sender_id, client_id=message.client_id
+    ).values_list('id', 'timestamp').first()
+    if stored is not None:
+        cache.set(key, stored, CLIENT_ID_CLAIM_TIMEOUT)
+    return stored
+
+
+async def release_client_ids(messages):
+    """Drop the claims of messages that could not be stored, so they can be resent"""
+    keys = [client_id_key(m.room_id, m.sender_id, m.client_id) for m in messages if m.client_id]
+    if keys:
+        await cache.adelete_many(keys)
+
+
+def _newest(is_newer, value, field_name):
+    """Take `value` only if this batch holds the room's newest message"""
+    field = ChatRoom._meta.get_field(field_name)
+    return Case(When(is_newer, then=Value(value)), default=F(field.attname), output_field=field)
+
+
+def _apply_room_summaries(messages):
+    """One UPDATE per room for the last-message summary and unread counters"""
+    by_room = {}
+    for message in messages:
+        by_room.setdefault(message.room_id, []).append(message)
+
+    for room_id, room_messages in by_room.items():
+        room = room_messages[0].room
+        latest = max(room_messages, key=lambda m: (m.timestamp, m.id))
+        unread = Counter(
+            room.unread_field_for(room.other_participant_id(m.sender_id))
+            for m in room_messages
+        )
+        # A regular insert may have committed a newer message in the meantime
+        is_newer = Q(last_message_at__isnull=True) | Q(last_message_at__lte=latest.timestamp)
+
+        ChatRoom.objects.filter(pk=room_id).update(
+            last_message_id=_newest(is_newer, latest.id, 'last_message'),
+            last_message_preview=_newest(is_newer, latest.content[:PREVIEW_LENGTH], 'last_message_preview'),
+            last_message_at=_newest(is_newer, latest.timestamp, 'last_message_at'),
+            updated_at=_newest(is_newer, latest.timestamp, 'updated_at'),
+            **{field: F(field) + count for field, count in unread.items()}
+        )
+
+
+def persist_messages(messages):
+    """
+    Insert a batch of accepted messages in one transaction.
+
+    The room summaries are applied here in aggregate and the messages were
+    broadcast when they were accepted (see the flags set by
+    chat.consumers.prepare_message), so the corresponding post_save
+    receivers skip them; every other receiver runs as usual.
+
+    With sharded messages (chat.sharding) each shard's rows are inserted in
+    a transaction of its own, committed just before the one on 'default'.
+    """
+    by_database = {}
+    for message in messages:
+        by_database.setdefault(shard_for_room(message.room_id), []).append(message)
+
+    with ExitStack() as transactions:
+        transactions.enter_context(transaction.atomic())
+        for using, batch in by_database.items():
+            transactions.enter_context(transaction.atomic(using=using))
+            Message.objects.using(using).bulk_create(batch)
+        _apply_room_summaries(messages)
+        for message in messages:
+            post_save.send(
+                sender=Message,
+                instance=message,
+                created=True,
+                update_fields=None,
+                raw=False,
+                using=message._state.db
+            )
+
+
+class MessageBatcher:
+    """
+    Per-process queue of accepted messages, flushed every `flush_interval`
+    seconds or as soon as `flush_size` messages are waiting.
+    """
+
+    def __init__(self, flush_size, flush_interval, max_pending):
+        self.flush_size = max(flush_size, 1)
+        self.flush_interval = flush_interval
+        self.max_pending = max(max_pending, self.flush_size)
+        self._pending = []
+        self._has_pending = asyncio.Event()
+        self._batch_full = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    async def add(self, message, channel_name=None):
+        """
+        Queue an accepted message. `channel_name` is the sender's channel,
+        which is told when the message has been persisted or has failed.
+        """
+        while len(self._pending) >= self.max_pending:
+            # Back-pressure: the database is not keeping up
+            await self.flush()
+
+        self._pending.append((message, channel_name))
+        self._has_pending.set()
+        if len(self._pending) >= self.flush_size:
+            self._batch_full.set()
+        self._ensure_running()
+
+    async def flush(self):
+        """Persist everything queued so far"""
+        async with self._flush_lock:
+            while self._pending:
+                batch = self._pending[:self.flush_size]
+                del self._pending[:self.flush_size]
+                await self._persist(batch)
+            self._has_pending.clear()
+            self._batch_full.clear()
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while True:
+            await self._has_pending.wait()
+            # Let the batch fill for up to one interval
+            try:
+                await asyncio.wait_for(self._batch_full.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception('Chat write-behind flush failed')
+
+    async def _persist(self, batch):
+        messages = [message for message, _ in batch]
+        for attempt in range(FLUSH_RETRIES):
+            try:
+                await database_sync_to_async(persist_messages)(messages)
+            except Exception:
+                logger.warning(
+                    'Chat write-behind batch of %d failed (attempt %d)',
+                    len(messages), attempt + 1, exc_info=True
+                )
+                await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+            else:
+                await self._notify(batch, 'chat_persisted')
+                return
+
+        # Store what can be stored; whatever still fails is reported to its sender
+        failed = []
+        for message, channel_name in batch:
+            try:
+                await database_sync_to_async(persist_messages)([message])
+            except Exception:
+                logger.exception('Dropping chat message %s after write-behind failures', message.id)
+                failed.append((message, channel_name))
+            else:
+                await self._notify([(message, channel_name)], 'chat_persisted')
+        if failed:
+            await release_client_ids([message for message, _ in failed])
+            await self._notify(failed, 'chat_failed')
+
+    async def _notify(self, batch, event_type):
+        """Tell each sender's socket which of its messages were stored or lost"""
+        channel_layer = get_channel_layer()
+        if channel_layer is None:
+            return
+        by_channel = {}
+        for message, channel_name in batch:
+            if channel_name:
+                by_channel.setdefault(channel_name, []).append(message)
+        for channel_name, messages in by_channel.items():
+            await channel_layer.send(channel_name, {
+                'type': event_type,
+                'messages': [{'room_id': m.room_id, 'id': m.id} for m in messages]
+            })
+
+
+_batchers = weakref.WeakKeyDictionary()
+
+
+def get_batcher():
+    """The batcher for the running event loop (one per daphne process)"""
+    loop = asyncio.get_running_loop()
+    batcher = _batchers.get(loop)
+    if batcher is None:
+        batcher = MessageBatcher(
+            flush_size=getattr(settings, 'CHAT_WRITE_BEHIND_FLUSH_SIZE', 200),
+            flush_interval=getattr(settings, 'CHAT_WRITE_BEHIND_FLUSH_INTERVAL_MS', 10) / 1000,
+            max_pending=getattr(settings, 'CHAT_WRITE_BEHIND_MAX_PENDING', 5000),
+        )
+        _batchers[loop] = batcher
+    return batcher
@@ -0,0 +1,154 @@
+"""
+Canonical publish pipeline for chat events.
+Every new message, whether it came from REST or the WebSocket consumer,
+is serialized and encoded once (see chat.events) and published once,
+after the surrounding transaction commits. Events go to the room group (per-room sockets) and to each
+participant's user group (the multiplexed per-user socket).
+With write-behind batching (chat.batcher) WebSocket messages are instead
+published by the consumer as soon as they are accepted.
+
+Messages, edits and deletes are also appended to the room's replay buffer
+(chat.replay) so reconnecting sockets can catch up.
+"""
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from .events import (
+    DeleteEvent,
+    EditEvent,
+    MessageEvent,
+    MessagePayload,
+    ReadEvent,
+    RoomEvent,
+    encoded,
+)
+from .replay import DELETE_EVENT, EDIT_EVENT, MESSAGE_EVENT, get_replay_buffer, replay_entry
+
+
+def room_group_name(room_id):
+    """Channel layer group for a chat room"""
+    return f'chat_{room_id}'
+
+
+def user_group_name(user_id):
+    """Channel layer group for all of a user's chat sockets"""
+    return f'chat_user_{user_id}'
+
+
+def publish_message(message):
+    """
+    Schedule a broadcast of a newly created message.
+    
+    The message is serialized and sent only when the transaction commits,
+    so clients never see messages that were rolled back: the transaction
+    of the database the message was saved on, which with sharding
+    (chat.sharding) may not be 'default'. Calling this more than once for
+    the same instance is a no-op.
+    """
+    if getattr(message, '_publish_scheduled', False):
+        return
+    message._publish_scheduled = True
+    transaction.on_commit(lambda: _send_message(message), using=message._state.db)
+
+
+def publish_edit(message):
+    """Schedule an edited-message event once the message's transaction commits"""
+    transaction.on_commit(lambda: _send_edit(message), using=message._state.db)
+
+
+def publish_delete(room, message_id, using=None):
+    """Schedule a deleted-message event once the transaction on `using` commits"""
+    transaction.on_commit(lambda: _send_delete(room, message_id), using=using)
+
+
+def publish_read(room, reader, last_read_id):
+    """Schedule a read-receipt event once the transaction commits"""
+    transaction.on_commit(lambda: _send_read(room, reader, last_read_id))
+
+
+def publish_room(room):
+    """Schedule a room event (new or reordered conversation) for both participants"""
+    transaction.on_commit(lambda: _send_room(room))
+
+
+def _group_send_events(events):
+    """Send (group, event) pairs with a single hop into async code"""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    
+    async def send():
+        for group, event in events:
+            await channel_layer.group_send(group, event)
+    
+    async_to_sync(send)()
+
+
+def _participant_groups(room):
+    return [user_group_name(room.landlord_id), user_group_name(room.tenant_id)]
+
+
+def _room_and_user_events(room, event, room_handler, user_handler):
+    """
+    (group, message) pairs delivering one event, encoded once, to the room
+    group and to both participants' user groups.
+    """
+    room_message = encoded(room_handler, event)
+    user_message = {**room_message, 'type': user_handler}
+    events = [(room_group_name(room.id), room_message)]
+    events.extend((group, user_message) for group in _participant_groups(room))
+    return events
+
+
+def _message_events(room, payload):
+    # Conversations are ordered by their latest message
+    event = MessageEvent(room.id, payload.timestamp, payload)
+    return _room_and_user_events(room, event, 'chat_message', 'user_message')
+
+
+def _send_message(message):
+    payload = MessagePayload.from_message(message)
+    get_replay_buffer().append(message.room_id, replay_entry(MESSAGE_EVENT, message.id, payload.to_dict()))
+    _group_send_events(_message_events(message.room, payload))
+
+
+async def broadcast_message(room, payload):
+    """
+    Publish a MessagePayload from async code, without waiting for a
+    transaction. Used by write-behind batching, where messages are
+    announced before their rows are inserted.
+    """
+    await get_replay_buffer().aappend(room.id, replay_entry(MESSAGE_EVENT, payload.id, payload.to_dict()))
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    for group, event in _message_events(room, payload):
+        await channel_layer.group_send(group, event)
+
+
+def _send_edit(message):
+    room = message.room
+    payload = MessagePayload.from_message(message)
+    get_replay_buffer().append(room.id, replay_entry(EDIT_EVENT, message.id, payload.to_dict()))
+    _group_send_events(_room_and_user_events(
+        room, EditEvent(room.id, payload), 'chat_message_edited', 'user_message_edited'
+    ))
+
+
+def _send_delete(room, message_id):
+    get_replay_buffer().append(room.id, replay_entry(DELETE_EVENT, message_id))
+    _group_send_events(_room_and_user_events(
+        room, DeleteEvent(room.id, message_id), 'chat_message_deleted', 'user_message_deleted'
+    ))
+
+
+def _send_read(room, reader, last_read_id):
+    _group_send_events(_room_and_user_events(
+        room, ReadEvent(room.id, reader.id, last_read_id), 'chat_read', 'user_read'
+    ))
+
+
+def _send_room(room):
+    updated_at = room.updated_at.isoformat() if room.updated_at else None
+    message = encoded('user_room', RoomEvent(room.id, updated_at))
+    _group_send_events([(group, message) for group in _participant_groups(room)])
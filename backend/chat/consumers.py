@@ -1,22 +1,481 @@
-import json
+import asyncio
+import time
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
-from .models import ChatRoom, Message
+from django.db.models import Q
+from django.utils import timezone
+from .batcher import allocate_message_id, claim_client_id, get_batcher, write_behind_enabled
+from .broadcast import broadcast_message, room_group_name, user_group_name
+from .events import (
+    JSON_PROTOCOL,
+    MSGPACK_PROTOCOL,
+    MessagePayload,
+    PresenceEvent,
+    TypingEvent,
+    decode_frame,
+    encode_json,
+    encode_msgpack,
+    encoded,
+    format_datetime,
+)
+from .models import CLIENT_ID_MAX_LENGTH, ChatRoom, Message, parse_client_id
+from .metrics import (
+    DROPPED_FRAMES,
+    FLOODING_CLOSED,
+    IDLE_CLOSED,
+    OVER_SOCKET_LIMIT,
+    SLOW_CONSUMERS_CLOSED,
+    THROTTLED_FRAMES,
+    THROTTLED_MESSAGES,
+    UNRESPONSIVE_CLOSED,
+    incr,
+    room_joined,
+    room_left,
+    socket_closed,
+    socket_opened,
+)
+from .presence import (
+    HEARTBEAT_INTERVAL,
+    HEARTBEAT_TIMEOUT,
+    IDLE_TIMEOUT,
+    MAX_SOCKETS_PER_USER,
+    PRESENCE_TTL,
+    format_last_seen,
+    get_presence_store,
+)
+from .replay import (
+    DELETE_EVENT,
+    EDIT_EVENT,
+    events_after,
+    get_replay_buffer,
+    load_missed_events,
+)
+from .throttling import (
+    CLOSE_IDLE,
+    CLOSE_POLICY_VIOLATION,
+    CLOSE_SLOW_CONSUMER,
+    CLOSE_TOO_MANY_SOCKETS,
+    CLOSE_UNRESPONSIVE,
+    FRAME_BURST,
+    FRAME_RATE,
+    SEND_QUEUE_SIZE,
+    THROTTLE_CLOSE_AFTER,
+    TokenBucket,
+    take_user_message,
+)
 
 User = get_user_model()
 
+# How long a socket remembers that a room id is not one of the user's, and
+# how many such ids it remembers
+DENIED_ROOM_TTL = 10
+MAX_DENIED_ROOMS = 100
 
-class ChatConsumer(AsyncWebsocketConsumer):
+
+class ChatSocketConsumer(AsyncWebsocketConsumer):
+    """
+    Base for chat sockets: negotiates the wire encoding, rate limits client
+    frames and queues outbound frames (see chat.throttling).
+    
+    Clients offering the "chat.msgpack" subprotocol (or connecting with
+    ?encoding=msgpack) get binary MessagePack frames; everyone else gets
+    compact JSON text frames. Client frames are accepted in either encoding.
+    Group events arrive pre-encoded (see chat.events) and are forwarded as-is.
+    
+    Throttled frames are answered with {"type": "throttled", "retry_after"}.
+    
+    Heartbeats (see chat.presence): the server sends {"type": "ping"} every
+    HEARTBEAT_INTERVAL seconds and clients answer {"action": "pong"}; a
+    client may also send {"action": "ping"} and gets {"type": "pong"}.
+    Unresponsive sockets are closed with 4001, idle ones with 4002.
+    """
+    
+    binary = False
+    closing = False
+    sender_task = None
+    heartbeat_task = None
+    throttle_strikes = 0
+    
+    async def websocket_connect(self, message):
+        self.frame_bucket = TokenBucket(FRAME_RATE, FRAME_BURST)
+        # Frames from groups joined before accept() wait here until then
+        self.send_queue = asyncio.Queue(SEND_QUEUE_SIZE)
+        await super().websocket_connect(message)
+    
+    async def accept(self, subprotocol=None):
+        offered = self.scope.get('subprotocols') or []
+        if MSGPACK_PROTOCOL in offered:
+            subprotocol = MSGPACK_PROTOCOL
+        elif JSON_PROTOCOL in offered:
+            subprotocol = JSON_PROTOCOL
+        
+        if subprotocol is not None:
+            self.binary = subprotocol == MSGPACK_PROTOCOL
+        else:
+            query_params = parse_qs(self.scope.get('query_string', b'').decode())
+            self.binary = query_params.get('encoding', [None])[0] == 'msgpack'
+        await super().accept(subprotocol)
+        self.last_frame_at = self.last_activity_at = time.monotonic()
+        self.sender_task = asyncio.ensure_future(self.drain_send_queue())
+        self.heartbeat_task = asyncio.ensure_future(self.heartbeat())
+        socket_opened()
+    
+    async def websocket_disconnect(self, message):
+        if self.sender_task is not None:
+            self.sender_task.cancel()
+            self.heartbeat_task.cancel()
+            socket_closed()
+        await super().websocket_disconnect(message)
+    
+    async def receive(self, text_data=None, bytes_data=None):
+        if self.closing:
+            return
+        self.last_frame_at = time.monotonic()
+        retry_after = self.frame_bucket.take()
+        if retry_after:
+            await self.throttled(retry_after, THROTTLED_FRAMES)
+            return
+        self.throttle_strikes = 0
+        data = decode_frame(text_data, bytes_data)
+        if data is None:
+            return
+        action = data.get('action')
+        if action == 'pong':
+            return
+        if action == 'ping':
+            await self.send_event({'type': 'pong'})
+            return
+        self.last_activity_at = self.last_frame_at
+        await self.receive_frame(data)
+    
+    async def receive_frame(self, data):
+        """Handle a decoded client frame"""
+    
+    async def throttled(self, retry_after, metric, **fields):
+        """Tell the client to slow down, or close the socket if it keeps flooding"""
+        incr(metric)
+        self.throttle_strikes += 1
+        if self.throttle_strikes >= THROTTLE_CLOSE_AFTER:
+            incr(FLOODING_CLOSED)
+            await self.shut(CLOSE_POLICY_VIOLATION)
+            return
+        await self.send_event({'type': 'throttled', 'retry_after': round(retry_after, 3), **fields})
+    
+    async def send_event(self, event):
+        """Encode and send a frame (an Event or a dict) built for this socket only"""
+        if self.binary:
+            await self.enqueue(bytes_data=encode_msgpack(event))
+        else:
+            await self.enqueue(text_data=encode_json(event))
+    
+    async def forward(self, event):
+        """
+        Send a pre-encoded group event in this socket's encoding. Events
+        marked droppable may be skipped when the socket falls behind.
+        """
+        droppable = event.get('droppable', False)
+        if self.binary:
+            await self.enqueue(bytes_data=event['bytes'], droppable=droppable)
+        else:
+            await self.enqueue(text_data=event['text'], droppable=droppable)
+    
+    async def ignore(self, event):
+        """For group events that reach the socket some other way"""
+    
+    async def enqueue(self, text_data=None, bytes_data=None, droppable=False):
+        if self.closing:
+            return
+        try:
+            self.send_queue.put_nowait((text_data, bytes_data))
+        except asyncio.QueueFull:
+            if droppable:
+                incr(DROPPED_FRAMES)
+                return
+            # Too far behind to catch up frame by frame: the client
+            # reconnects and resyncs instead
+            incr(SLOW_CONSUMERS_CLOSED)
+            await self.shut(CLOSE_SLOW_CONSUMER)
+    
+    async def heartbeat(self):
+        """Ping the client, and close the socket once it goes quiet"""
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            now = time.monotonic()
+            if now - self.last_frame_at > HEARTBEAT_TIMEOUT:
+                # Half-open or stalled: nothing, not even a pong
+                incr(UNRESPONSIVE_CLOSED)
+                await self.shut(CLOSE_UNRESPONSIVE)
+                return
+            if IDLE_TIMEOUT and now - self.last_activity_at > IDLE_TIMEOUT:
+                incr(IDLE_CLOSED)
+                await self.shut(CLOSE_IDLE)
+                return
+            await self.send_event({'type': 'ping'})
+    
+    async def drain_send_queue(self):
+        while True:
+            text_data, bytes_data = await self.send_queue.get()
+            await self.send(text_data=text_data, bytes_data=bytes_data)
+    
+    async def shut(self, code):
+        """
+        Close the socket at once, discarding queued frames. The server drops
+        the connection if the client does not complete the close handshake,
+        and disconnect() then leaves the groups.
+        """
+        self.closing = True
+        if self.sender_task is not None:
+            self.sender_task.cancel()
+        await self.close(code)
+
+
+class MessageWriterMixin:
+    """
+    Sending messages from a consumer. By default each message is inserted
+    right away and broadcast by the post_save hook; with CHAT_WRITE_BEHIND
+    it is acknowledged and broadcast at once and inserted by the batcher.
+    
+    Messages count against the sender's per-user rate limit; a throttled
+    message is dropped and answered with {"type": "throttled", "retry_after",
+    "room_id", "client_id"}.
+    
+    Every accepted message is answered with {"type": "ack", "room_id", "id",
+    "timestamp", "client_id", "duplicate"}. Clients may send a "client_id"
+    (e.g. a UUID) with each message and resend it until acked: a resend of
+    a message the server already has is acked with the original's id and
+    "duplicate": true, and is not stored or broadcast again.
+    
+    Extra server -> client events in write-behind mode:
+    - {"type": "persisted", "messages": [{"room_id", "id"}]}: messages stored
+    - {"type": "failed", "messages": [{"room_id", "id"}]}: messages lost, resend them
+    """
+    
+    wrote_behind = False
+    
+    async def write_message(self, room, content, reply_to_id=None, property_id=None, client_id=None):
+        try:
+            client_id = parse_client_id(client_id)
+        except ValueError:
+            await self.send_event({
+                'type': 'error',
+                'room_id': room.id,
+                'error': f'client_id must be a string of at most {CLIENT_ID_MAX_LENGTH} characters'
+            })
+            return
+        
+        retry_after = await take_user_message(self.user.id)
+        if retry_after:
+            # Across all of the user's sockets; the message is not sent
+            await self.throttled(retry_after, THROTTLED_MESSAGES, room_id=room.id, client_id=client_id)
+            return
+        
+        if not write_behind_enabled():
+            message, created = await database_sync_to_async(create_message)(
+                room, self.user, content, reply_to_id, property_id, client_id
+            )
+            await self.acknowledge(room, message.id, message.timestamp, client_id, duplicate=not created)
+            return
+        
+        message, payload = await database_sync_to_async(prepare_message)(
+            room, self.user, content, reply_to_id, property_id, client_id
+        )
+        if client_id:
+            original = await database_sync_to_async(claim_client_id)(message)
+            if original is not None:
+                await self.acknowledge(room, *original, client_id, duplicate=True)
+                return
+        
+        await get_batcher().add(message, self.channel_name)
+        self.wrote_behind = True
+        
+        await self.acknowledge(room, message.id, message.timestamp, client_id)
+        await broadcast_message(room, payload)
+    
+    async def acknowledge(self, room, message_id, timestamp, client_id, duplicate=False):
+        await self.send_event({
+            'type': 'ack',
+            'room_id': room.id,
+            'id': message_id,
+            'timestamp': format_datetime(timestamp),
+            'client_id': client_id,
+            'duplicate': duplicate
+        })
+    
+    async def flush_written_messages(self):
+        """Persist queued messages before the socket goes away"""
+        if self.wrote_behind:
+            await get_batcher().flush()
+    
+    async def chat_persisted(self, event):
+        await self.send_event({
+            'type': 'persisted',
+            'messages': event['messages']
+        })
+    
+    async def chat_failed(self, event):
+        await self.send_event({
+            'type': 'failed',
+            'messages': event['messages']
+        })
+
+
+def parse_message_id(value):
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return None
+    return value if value > 0 else None
+
+
+class ResyncMixin:
+    """
+    Catching a reconnecting socket up on a room from the last message it has.
+    
+    Missed events are replayed from the room's replay buffer when it still
+    reaches back far enough, otherwise from the database, as the usual
+    "message", "edited" and "deleted" frames, followed by
+    {"type": "resync_complete", "room_id", "source": "buffer"|"database",
+    "count", "truncated"}. When "truncated" is true there were more new
+    messages than chat.replay.RESYNC_LIMIT and the client should reload the
+    history over REST.
+    """
+    
+    async def resync(self, room, since_id):
+        entries = events_after(await get_replay_buffer().aread(room.id), since_id)
+        source = 'buffer'
+        truncated = False
+        if entries is None:
+            entries, truncated = await database_sync_to_async(load_missed_events)(room, since_id)
+            source = 'database'
+        
+        for entry in entries:
+            await self.send_event(replay_frame(room.id, entry))
+        await self.send_event({
+            'type': 'resync_complete',
+            'room_id': room.id,
+            'source': source,
+            'count': len(entries),
+            'truncated': truncated
+        })
+
+
+def replay_frame(room_id, entry):
+    """The socket frame for a replayed message, edit or delete"""
+    if entry['event'] == DELETE_EVENT:
+        return {'type': 'deleted', 'room_id': room_id, 'id': entry['id']}
+    if entry['event'] == EDIT_EVENT:
+        return {'type': 'edited', 'room_id': room_id, 'message': entry['message']}
+    return {
+        'type': 'message',
+        'room_id': room_id,
+        'updated_at': entry['message']['timestamp'],
+        'message': entry['message']
+    }
+
+
+class PresenceMixin:
+    """
+    Online presence and typing indicators (see chat.presence).
+    Nothing here touches the relational database.
+    
+    Presence changes go to the user groups of everyone the user chats with;
+    typing changes go to the room group and to the other participant's
+    user group.
+    """
+    
+    presence_task = None
+    typing_rooms = ()
+    
+    def presence_contacts(self):
+        """
+        Ids of the users who should see this user's presence; none by
+        default. Consumers override it with the participants they know.
+        """
+        return set()
+    
+    async def start_presence(self):
+        """
+        Register the socket. Returns False, leaving it unregistered, if the
+        user already has MAX_SOCKETS_PER_USER sockets open.
+        """
+        store = get_presence_store()
+        count = await store.add_connection(self.user.id, self.channel_name)
+        if count > MAX_SOCKETS_PER_USER:
+            await store.remove_connection(self.user.id, self.channel_name)
+            return False
+        
+        self.typing_rooms = set()
+        if count == 1:
+            await self.announce_presence(online=True)
+        self.presence_task = asyncio.ensure_future(self.keep_presence())
+        return True
+    
+    async def refuse_socket(self):
+        """Close a socket over the per-user limit"""
+        incr(OVER_SOCKET_LIMIT)
+        await self.shut(CLOSE_TOO_MANY_SOCKETS)
+    
+    async def keep_presence(self):
+        store = get_presence_store()
+        while True:
+            await asyncio.sleep(PRESENCE_TTL / 3)
+            await store.refresh_connection(self.user.id, self.channel_name)
+    
+    async def stop_presence(self):
+        if self.presence_task is None:
+            return
+        self.presence_task.cancel()
+        for room in list(self.typing_rooms):
+            await self.set_typing(room, False)
+        if await get_presence_store().remove_connection(self.user.id, self.channel_name):
+            await self.announce_presence(online=False)
+    
+    async def announce_presence(self, online):
+        event = encoded('user_presence', PresenceEvent(
+            self.user.id, online, None if online else format_last_seen(time.time())
+        ), droppable=True)
+        for contact_id in self.presence_contacts():
+            await self.channel_layer.group_send(user_group_name(contact_id), event)
+    
+    async def set_typing(self, room, typing):
+        """Record a typing state and announce it if it changed"""
+        if typing:
+            self.typing_rooms.add(room)
+        else:
+            self.typing_rooms.discard(room)
+        
+        if not await get_presence_store().set_typing(room.id, self.user.id, typing):
+            return
+        # user_id lets the sender's own sockets skip the event without decoding it
+        event = encoded(
+            'chat_typing', TypingEvent(room.id, self.user.id, typing), user_id=self.user.id, droppable=True
+        )
+        await self.channel_layer.group_send(room_group_name(room.id), event)
+        await self.channel_layer.group_send(
+            user_group_name(room.other_participant_id(self.user.id)),
+            {**event, 'type': 'user_typing'}
+        )
+
+
+class ChatConsumer(ResyncMixin, PresenceMixin, MessageWriterMixin, ChatSocketConsumer):
     """
     WebSocket consumer for real-time chat.
-    URL: ws/chat/<room_id>/
+    URL: ws/chat/<room_id>/[?since=<last_message_id>]
+    
+    Connecting with `since` replays what was missed (see ResyncMixin).
+    
+    Client -> server frames:
+    - {"message", "reply_to", "property"}: send a message
+    - {"action": "typing", "typing": true|false}: typing indicator
+    - {"action": "resync", "since"}: replay what was missed after message `since`
     """
     
     async def connect(self):
         """Handle WebSocket connection"""
         self.room_id = self.scope['url_route']['kwargs']['room_id']
-        self.room_group_name = f'chat_{self.room_id}'
+        self.room_group_name = room_group_name(self.room_id)
         self.user = self.scope['user']
         
         # Verify user is authenticated
@@ -24,9 +483,10 @@ class ChatConsumer(AsyncWebsocketConsumer):
             await self.close()
             return
         
-        # Verify user is part of this chat room
-        room_exists = await self.verify_room_access()
-        if not room_exists:
+        # Verify user is part of this chat room; the room's participant ids
+        # are cached for the lifetime of the connection
+        self.room = await self.verify_room_access()
+        if self.room is None:
             await self.close()
             return
         
@@ -35,133 +495,339 @@ class ChatConsumer(AsyncWebsocketConsumer):
             self.room_group_name,
             self.channel_name
         )
+        room_joined(self.room.id)
         
         await self.accept()
+        if not await self.start_presence():
+            await self.refuse_socket()
+            return
+        
+        query_params = parse_qs(self.scope.get('query_string', b'').decode())
+        since_id = parse_message_id(query_params.get('since', [None])[0])
+        if since_id:
+            await self.resync(self.room, since_id)
     
     async def disconnect(self, close_code):
         """Handle WebSocket disconnection"""
+        if getattr(self, 'room', None) is None:
+            return
+        await self.flush_written_messages()
+        await self.stop_presence()
+        
         # Leave room group
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
+        room_left(self.room.id)
     
-    async def receive(self, text_data):
+    async def receive_frame(self, data):
         """Handle incoming messages from WebSocket"""
-        try:
-            data = json.loads(text_data)
-            message_content = data.get('message', '').strip()
-            reply_to_id = data.get('reply_to')
-            property_id = data.get('property')
-            
-            if not message_content:
-                return
-            
-            # Save message to database
-            message = await self.save_message(message_content, reply_to_id, property_id)
-            
-            if message:
-                # Broadcast message to room group
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'chat_message',
-                        'message': message
-                    }
-                )
-        except json.JSONDecodeError:
-            pass
-    
-    async def chat_message(self, event):
-        """Send message to WebSocket"""
-        message = event['message']
+        if data.get('action') == 'typing':
+            await self.set_typing(self.room, bool(data.get('typing')))
+            return
+        if data.get('action') == 'resync':
+            since_id = parse_message_id(data.get('since'))
+            if since_id:
+                await self.resync(self.room, since_id)
+            return
+        
+        message_content = (data.get('message') or '').strip()
+        reply_to_id = data.get('reply_to')
+        property_id = data.get('property')
+        
+        if not message_content:
+            return
         
-        # Send message to WebSocket
-        await self.send(text_data=json.dumps({
-            'type': 'message',
-            'message': message
-        }))
+        # The message reaches the room group (including this socket)
+        # through the post_save hook, or at once in write-behind mode
+        await self.write_message(self.room, message_content, reply_to_id, property_id, data.get('client_id'))
+        if self.room in self.typing_rooms:
+            await self.set_typing(self.room, False)
+    
+    chat_message = ChatSocketConsumer.forward
+    chat_message_edited = ChatSocketConsumer.forward
+    chat_message_deleted = ChatSocketConsumer.forward
+    chat_read = ChatSocketConsumer.forward
+    
+    async def chat_typing(self, event):
+        """Send the other participant's typing indicator"""
+        if event['user_id'] != self.user.id:
+            await self.forward(event)
+    
+    # Typing indicators arrive through the room group
+    user_typing = ChatSocketConsumer.ignore
+    
+    def presence_contacts(self):
+        return [self.room.other_participant_id(self.user.id)]
     
     @database_sync_to_async
     def verify_room_access(self):
-        """Verify user has access to this chat room"""
-        try:
-            room = ChatRoom.objects.get(pk=self.room_id)
-            return self.user == room.landlord or self.user == room.tenant
-        except ChatRoom.DoesNotExist:
-            return False
+        """Return the chat room if the user is a participant, else None"""
+        room = load_room_membership(Q(pk=self.room_id)).first()
+        if room and self.user.id in (room.landlord_id, room.tenant_id):
+            return room
+        return None
+
+
+class UserChatConsumer(ResyncMixin, PresenceMixin, MessageWriterMixin, ChatSocketConsumer):
+    """
+    Multiplexed WebSocket consumer carrying events for all of a user's chat rooms.
+    URL: ws/chat/
     
-    @database_sync_to_async
-    def save_message(self, content, reply_to_id=None, property_id=None):
-        """Save message to database"""
+    Server -> client events:
+    - {"type": "message", "room_id", "updated_at", "message"}: new message in any room
+    - {"type": "read", "room_id", "reader_id", "last_read_id"}: a participant's read watermark moved
+    - {"type": "room", "room_id", "updated_at"}: a conversation was created or reordered
+    - {"type": "typing", "room_id", "user_id", "typing"}: the other participant started/stopped typing
+    - {"type": "presence", "user_id", "online", "last_seen"}: a contact came online or went offline
+    - {"type": "edited", "room_id", "message"}: a message was edited
+    - {"type": "deleted", "room_id", "id"}: a message was deleted
+    - {"type": "resync_complete", ...}: end of a resync (see ResyncMixin)
+    
+    Client -> server frames:
+    - {"action": "subscribe", "room_id", "since"}: mark a room as active (joins its room group);
+      with `since`, also replay what was missed after that message
+    - {"action": "resync", "room_id", "since"}: replay what was missed after message `since`
+    - {"action": "unsubscribe", "room_id"}
+    - {"action": "message", "room_id", "message", "reply_to", "property"}: send a message
+    - {"action": "typing", "room_id", "typing": true|false}: typing indicator, repeated
+      every few seconds while typing (it expires after chat.presence.TYPING_TTL)
+    """
+    
+    async def connect(self):
+        """Handle WebSocket connection"""
+        self.user = self.scope['user']
+        self.active_room_id = None
+        
+        if not self.user.is_authenticated:
+            await self.close()
+            return
+        
+        self.user_group_name = user_group_name(self.user.id)
+        self.rooms = await self.get_rooms()
+        self.denied_rooms = {}
+        
+        await self.channel_layer.group_add(
+            self.user_group_name,
+            self.channel_name
+        )
+        
+        await self.accept()
+        if not await self.start_presence():
+            await self.refuse_socket()
+    
+    async def disconnect(self, close_code):
+        """Handle WebSocket disconnection"""
+        if not hasattr(self, 'user_group_name'):
+            return
+        await self.flush_written_messages()
+        await self.stop_presence()
+        await self.channel_layer.group_discard(
+            self.user_group_name,
+            self.channel_name
+        )
+        await self.set_active_room(None)
+    
+    async def receive_frame(self, data):
+        """Handle incoming frames from WebSocket"""
+        action = data.get('action')
         try:
-            room = ChatRoom.objects.get(pk=self.room_id)
-            
-            reply_to_message = None
-            if reply_to_id:
-                try:
-                    reply_to_message = Message.objects.get(pk=reply_to_id, room=room)
-                except Message.DoesNotExist:
-                    pass
-            
-            property_obj = None
-            if property_id:
-                from properties.models import Property
-                try:
-                    property_obj = Property.objects.get(pk=property_id)
-                except Property.DoesNotExist:
-                    pass
-
-            message = Message.objects.create(
-                room=room,
-                sender=self.user,
-                content=content,
-                reply_to=reply_to_message,
-                property=property_obj
+            room_id = int(data.get('room_id') or self.active_room_id or 0)
+        except (TypeError, ValueError):
+            return
+        
+        if action == 'unsubscribe':
+            if room_id == self.active_room_id:
+                await self.set_active_room(None)
+            return
+        
+        if not await self.has_room_access(room_id):
+            await self.send_event({
+                'type': 'error',
+                'room_id': room_id,
+                'error': 'Access denied'
+            })
+            return
+        
+        if action in ('subscribe', 'resync'):
+            if action == 'subscribe':
+                await self.set_active_room(room_id)
+            since_id = parse_message_id(data.get('since'))
+            if since_id:
+                await self.resync(self.rooms[room_id], since_id)
+        elif action == 'typing':
+            await self.set_typing(self.rooms[room_id], bool(data.get('typing')))
+        elif action == 'message':
+            content = (data.get('message') or '').strip()
+            if content:
+                room = self.rooms[room_id]
+                await self.write_message(
+                    room, content, data.get('reply_to'), data.get('property'), data.get('client_id')
+                )
+                if room in self.typing_rooms:
+                    await self.set_typing(room, False)
+    
+    async def set_active_room(self, room_id):
+        """Switch the room group this socket listens to for room-scoped events"""
+        if self.active_room_id is not None:
+            await self.channel_layer.group_discard(
+                room_group_name(self.active_room_id),
+                self.channel_name
             )
-            
-            # Update room's updated_at
-            room.save()
-            
-            response = {
-                'id': message.id,
-                'content': message.content,
-                'sender': message.sender.id, # consistent with serializer
-                'sender_id': message.sender.id,
-                'sender_email': message.sender.email,
-                'sender_name': f"{message.sender.first_name} {message.sender.last_name}".strip() or message.sender.username,
-                'timestamp': message.timestamp.isoformat(),
-                'is_read': message.is_read,
-                'reply_to': message.reply_to.id if message.reply_to else None,
-                'reply_to_info': None,
-                'property': message.property.id if message.property else None,
-                'property_details': None
-            }
-
-            if message.reply_to:
-                response['reply_to_info'] = {
-                    'id': message.reply_to.id,
-                    'sender_name': f"{message.reply_to.sender.first_name} {message.reply_to.sender.last_name}".strip() or message.reply_to.sender.username,
-                    'content': message.reply_to.content
-                }
-            
-            if message.property:
-                # Use robust cover image lookup logic
-                cover = message.property.images.filter(is_cover=True).first()
-                image_url = None
-                if cover:
-                    image_url = cover.image_url
-                else:
-                    first_img = message.property.images.first()
-                    if first_img:
-                        image_url = first_img.image_url
-                        
-                response['property_details'] = {
-                    'id': message.property.id,
-                    'title': message.property.title,
-                    'cover_image': image_url
+            room_left(self.active_room_id)
+        self.active_room_id = room_id
+        if room_id is not None:
+            await self.channel_layer.group_add(
+                room_group_name(room_id),
+                self.channel_name
+            )
+            room_joined(room_id)
+    
+    async def has_room_access(self, room_id):
+        if not room_id:
+            return False
+        if room_id in self.rooms:
+            return True
+        now = time.monotonic()
+        if self.denied_rooms.get(room_id, 0) > now:
+            return False
+        
+        # The room may have been created after this socket connected
+        room = await self.get_room(room_id)
+        if room is None:
+            if len(self.denied_rooms) >= MAX_DENIED_ROOMS:
+                self.denied_rooms = {
+                    denied: expires for denied, expires in self.denied_rooms.items() if expires > now
                 }
-            
-            return response
-        except ChatRoom.DoesNotExist:
-            return None
+            if len(self.denied_rooms) < MAX_DENIED_ROOMS:
+                self.denied_rooms[room_id] = now + DENIED_ROOM_TTL
+            return False
+        self.rooms[room_id] = room
+        return True
+    
+    # New messages, read receipts, conversation changes, typing, presence,
+    # edits and deletes from any of the user's rooms
+    user_message = ChatSocketConsumer.forward
+    user_read = ChatSocketConsumer.forward
+    user_room = ChatSocketConsumer.forward
+    user_typing = ChatSocketConsumer.forward
+    user_presence = ChatSocketConsumer.forward
+    user_message_edited = ChatSocketConsumer.forward
+    user_message_deleted = ChatSocketConsumer.forward
+    
+    # Room-scoped events already arrive through the user group
+    chat_message = ChatSocketConsumer.ignore
+    chat_read = ChatSocketConsumer.ignore
+    chat_typing = ChatSocketConsumer.ignore
+    chat_message_edited = ChatSocketConsumer.ignore
+    chat_message_deleted = ChatSocketConsumer.ignore
+    
+    def presence_contacts(self):
+        return {room.other_participant_id(self.user.id) for room in self.rooms.values()}
+    
+    @database_sync_to_async
+    def get_rooms(self):
+        """
+        Membership of every room the user takes part in, keyed by id. Also
+        records the user's contacts in the presence store for bulk_presence.
+        """
+        rooms = {
+            room.id: room
+            for room in load_room_membership(Q(landlord=self.user) | Q(tenant=self.user))
+        }
+        get_presence_store().set_contacts(
+            self.user.id, {room.other_participant_id(self.user.id) for room in rooms.values()}
+        )
+        return rooms
+    
+    @database_sync_to_async
+    def get_room(self, room_id):
+        """Membership of room `room_id` if the user takes part in it, else None"""
+        return load_room_membership(
+            Q(pk=room_id) & (Q(landlord=self.user) | Q(tenant=self.user))
+        ).first()
+
+
+def load_room_membership(condition):
+    """
+    Rooms matching `condition`, loading only what a socket needs to
+    authorize and create messages: participant ids and read watermarks.
+    """
+    return ChatRoom.objects.filter(condition).only(
+        'id', 'landlord_id', 'tenant_id', 'landlord_last_read_id', 'tenant_last_read_id'
+    )
+
+
+def resolve_message_relations(room, reply_to_id=None, property_id=None):
+    """
+    The replied-to message and the property referenced by a new message,
+    each resolved with one query.
+    """
+    reply_to_message = None
+    if reply_to_id:
+        reply_to_message = (
+            Message.objects.in_room(room).filter(pk=reply_to_id)
+            .with_related('sender')
+            .only('id', 'content', 'sender__username', 'sender__first_name', 'sender__last_name')
+            .first()
+        )
+    
+    property_obj = None
+    if property_id:
+        from properties.models import Property
+        property_obj = (
+            Property.objects.filter(pk=property_id)
+            .with_cover_image()
+            .only('id', 'title')
+            .first()
+        )
+    
+    return reply_to_message, property_obj
+
+
+def create_message(room, user, content, reply_to_id=None, property_id=None, client_id=None):
+    """
+    Create a message sent over a WebSocket in an already-authorized room.
+    
+    The post_save hooks update the room summary with a single UPDATE and
+    broadcast the message once the transaction commits.
+    
+    Returns:
+        tuple: (message, created); created is False for a resend of a
+        message the sender already sent with `client_id`
+    """
+    reply_to_message, property_obj = resolve_message_relations(room, reply_to_id, property_id)
+    return Message.objects.create_once(
+        client_id=client_id,
+        room=room,
+        sender=user,
+        content=content,
+        reply_to=reply_to_message,
+        property=property_obj
+    )
+
+
+def prepare_message(room, user, content, reply_to_id=None, property_id=None, client_id=None):
+    """
+    Build an unsaved message for write-behind persistence, with its id and
+    timestamp assigned now, and its MessagePayload for broadcasting.
+    
+    Returns:
+        tuple: (message, payload)
+    """
+    reply_to_message, property_obj = resolve_message_relations(room, reply_to_id, property_id)
+    message = Message(
+        id=allocate_message_id(),
+        room=room,
+        sender=user,
+        content=content,
+        reply_to=reply_to_message,
+        property=property_obj,
+        timestamp=timezone.now(),
+        client_id=client_id
+    )
+    # Already announced, and the batcher applies room summaries itself
+    message._publish_scheduled = True
+    message._summary_applied = True
+    return message, MessagePayload.from_message(message)
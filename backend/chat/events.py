@@ -0,0 +1,186 @@
+"""
+Chat socket events and their wire encodings.
+
+Events are small __slots__ DTOs. Anything published to a group is encoded
+once, at publish time, into every wire format the sockets speak - compact
+JSON text and MessagePack bytes - and consumers forward the pre-encoded
+frame that matches their connection instead of re-serializing it for each
+recipient.
+
+Clients pick the encoding with the WebSocket subprotocol ("chat.msgpack"
+or "chat.json"), or with ?encoding=msgpack when they cannot set one.
+"""
+import json
+
+import msgpack
+from rest_framework import serializers
+
+JSON_PROTOCOL = 'chat.json'
+MSGPACK_PROTOCOL = 'chat.msgpack'
+
+# Replies only need enough of the original message to show a quote
+REPLY_PREVIEW_LENGTH = 100
+
+_datetime_field = serializers.DateTimeField()
+
+
+def format_datetime(value):
+    """Datetimes in the same format as the REST API"""
+    return _datetime_field.to_representation(value) if value else None
+
+
+class Payload:
+    """Base for DTOs: the slots are the wire fields"""
+    __slots__ = ()
+
+    def __init__(self, *args, **kwargs):
+        for name, value in zip(self.__slots__, args):
+            setattr(self, name, value)
+        for name in self.__slots__[len(args):]:
+            setattr(self, name, kwargs.pop(name, None))
+        if kwargs:
+            raise TypeError(f"Unexpected fields for {type(self).__name__}: {', '.join(kwargs)}")
+
+    def to_dict(self):
+        return {name: _plain(getattr(self, name)) for name in self.__slots__}
+
+
+def _plain(value):
+    return value.to_dict() if isinstance(value, Payload) else value
+
+
+class ReplyInfo(Payload):
+    __slots__ = ('id', 'sender_name', 'content')
+
+
+class PropertyInfo(Payload):
+    __slots__ = ('id', 'title', 'cover_image')
+
+    @classmethod
+    def from_property(cls, prop):
+        if hasattr(prop, 'cover_image_url'):
+            # Annotated by Property.objects.with_cover_image()
+            image_url = prop.cover_image_url
+        else:
+            image = prop.images.filter(is_cover=True).first() or prop.images.first()
+            image_url = image.image_url if image else None
+        return cls(prop.id, prop.title, image_url)
+
+
+def display_name(user):
+    return f"{user.first_name} {user.last_name}".strip() or user.username
+
+
+class MessagePayload(Payload):
+    """A chat message as sent over sockets (same fields as MessageSerializer)"""
+    __slots__ = (
+        'id', 'sender', 'sender_name', 'content', 'is_read', 'timestamp', 'edited_at',
+        'reply_to', 'reply_to_info', 'attachment', 'property', 'property_details', 'client_id',
+    )
+
+    @classmethod
+    def from_message(cls, message):
+        reply = message.reply_to
+        reply_info = None
+        if reply is not None:
+            reply_info = ReplyInfo(reply.id, display_name(reply.sender), reply.content[:REPLY_PREVIEW_LENGTH])
+        prop = message.property
+        return cls(
+            id=message.id,
+            sender=message.sender_id,
+            sender_name=display_name(message.sender),
+            content=message.content,
+            is_read=message.is_read_by_recipient(),
+            timestamp=format_datetime(message.timestamp),
+            edited_at=format_datetime(message.edited_at),
+            reply_to=message.reply_to_id,
+            reply_to_info=reply_info,
+            attachment=message.attachment.url if message.attachment else None,
+            property=message.property_id,
+            property_details=PropertyInfo.from_property(prop) if prop is not None else None,
+            client_id=message.client_id,
+        )
+
+
+class Event(Payload):
+    """A socket frame; `type` is the frame type clients switch on"""
+    __slots__ = ()
+    type = None
+
+    def to_dict(self):
+        frame = {'type': self.type}
+        frame.update(super().to_dict())
+        return frame
+
+
+class MessageEvent(Event):
+    __slots__ = ('room_id', 'updated_at', 'message')
+    type = 'message'
+
+
+class EditEvent(Event):
+    __slots__ = ('room_id', 'message')
+    type = 'edited'
+
+
+class DeleteEvent(Event):
+    __slots__ = ('room_id', 'id')
+    type = 'deleted'
+
+
+class ReadEvent(Event):
+    __slots__ = ('room_id', 'reader_id', 'last_read_id')
+    type = 'read'
+
+
+class RoomEvent(Event):
+    __slots__ = ('room_id', 'updated_at')
+    type = 'room'
+
+
+class TypingEvent(Event):
+    __slots__ = ('room_id', 'user_id', 'typing')
+    type = 'typing'
+
+
+class PresenceEvent(Event):
+    __slots__ = ('user_id', 'online', 'last_seen')
+    type = 'presence'
+
+
+def to_frame(event):
+    return event.to_dict() if isinstance(event, Payload) else event
+
+
+def encode_json(event):
+    return json.dumps(to_frame(event), separators=(',', ':'))
+
+
+def encode_msgpack(event):
+    return msgpack.packb(to_frame(event), use_bin_type=True)
+
+
+def encoded(handler, event, **routing):
+    """
+    A channel layer message carrying `event` pre-encoded in both formats,
+    dispatched to the consumer method `handler`. `routing` adds fields the
+    consumers inspect without decoding the frame.
+    """
+    return {
+        'type': handler,
+        'text': encode_json(event),
+        'bytes': encode_msgpack(event),
+        **routing
+    }
+
+
+def decode_frame(text_data=None, bytes_data=None):
+    """A client frame as a dict, or None if it cannot be decoded"""
+    try:
+        if bytes_data is not None:
+            data = msgpack.unpackb(bytes_data, raw=False)
+        else:
+            data = json.loads(text_data)
+    except (ValueError, TypeError, msgpack.ExtraData, msgpack.FormatError, msgpack.StackError):
+        return None
+    return data if isinstance(data, dict) else None
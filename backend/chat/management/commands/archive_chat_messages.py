@@ -0,0 +1,58 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from chat.archive import ARCHIVE_AFTER_DAYS, SEGMENT_SIZE, archive_room
+from chat.models import ChatRoom, Message
+from chat.sharding import message_databases
+
+
+class Command(BaseCommand):
+    help = 'Move old chat messages out of the message table into compressed archive segments'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=ARCHIVE_AFTER_DAYS,
+            help='Archive messages older than N days'
+        )
+        parser.add_argument(
+            '--segment-size',
+            type=int,
+            default=SEGMENT_SIZE,
+            help='Most messages per segment file'
+        )
+        parser.add_argument(
+            '--room',
+            type=int,
+            help='Only archive this chat room'
+        )
+
+    def handle(self, *args, **options):
+        if options['days'] < 1:
+            raise CommandError('--days must be positive')
+        if options['segment_size'] < 1:
+            raise CommandError('--segment-size must be positive')
+
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        # Rooms and messages may be on different databases (chat.sharding)
+        room_ids = set()
+        for database in message_databases():
+            old = Message.objects.using(database).filter(timestamp__lt=cutoff)
+            if options['room'] is not None:
+                old = old.filter(room_id=options['room'])
+            room_ids.update(old.values_list('room_id', flat=True).distinct())
+        rooms = ChatRoom.objects.filter(pk__in=room_ids).order_by('pk')
+
+        archived = archived_rooms = 0
+        for room in rooms.iterator():
+            count = archive_room(room, cutoff, options['segment_size'])
+            if count:
+                archived += count
+                archived_rooms += 1
+                if options['verbosity'] > 1:
+                    self.stdout.write(f"Room {room.pk}: archived {count} messages")
+
+        self.stdout.write(self.style.SUCCESS(f"Archived {archived} messages from {archived_rooms} rooms"))
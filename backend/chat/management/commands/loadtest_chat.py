@@ -0,0 +1,561 @@
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import random
+import struct
+import threading
+import time
+import urllib.request
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework_simplejwt.tokens import AccessToken
+
+from chat.models import ChatRoom
+from chat.sharding import place_rooms
+from properties.models import Property
+
+User = get_user_model()
+
+# Synthetic users are recognised (and cleaned up) by this email domain
+LOADTEST_DOMAIN = 'loadtest.invalid'
+
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+# Messages carry "<CONTENT_PREFIX><sender>-<seq>" so receivers can time them
+CONTENT_PREFIX = 'loadtest '
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+
+class QueryCounter:
+    """
+    Counts queries on every database connection opened from now on,
+    including the ones opened by database_sync_to_async worker threads.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self):
+        connection_created.connect(self._on_connection, weak=False)
+        for connection in connections.all():
+            self._wrap(connection)
+
+    def _on_connection(self, sender, connection, **kwargs):
+        self._wrap(connection)
+
+    def _wrap(self, connection):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+class InProcessSocket:
+    """A chat socket driven straight through the ASGI application"""
+
+    def __init__(self, application, token, host, origin):
+        from channels.testing import WebsocketCommunicator
+        self.communicator = WebsocketCommunicator(
+            application,
+            f'/ws/chat/?token={token}',
+            headers=[(b'host', host.encode()), (b'origin', origin.encode())]
+        )
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect(timeout=30)
+        if not connected:
+            raise ConnectionError('Socket was refused')
+
+    async def send(self, frame):
+        await self.communicator.send_to(text_data=json.dumps(frame))
+
+    async def receive(self):
+        """The next frame, or None once the socket is closed"""
+        output = await self.communicator.receive_output(timeout=None)
+        if output['type'] == 'websocket.close':
+            return None
+        return json.loads(output['text'])
+
+    async def close(self):
+        await self.communicator.disconnect(timeout=5)
+
+
+class LocalhostSocket:
+    """
+    A chat socket over a real TCP connection. A minimal RFC 6455 client
+    (text frames, no extensions): autobahn's asyncio client cannot be used
+    once daphne has selected Twisted in this process.
+    """
+
+    def __init__(self, url, token, origin):
+        self.url = urlsplit(f'{url}/ws/chat/?token={token}')
+        self.origin = origin
+        self.reader = self.writer = None
+
+    async def connect(self):
+        host, port = self.url.hostname, self.url.port or 80
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        key = base64.b64encode(os.urandom(16)).decode()
+        self.writer.write((
+            f'GET {self.url.path}?{self.url.query} HTTP/1.1\r\n'
+            f'Host: {host}:{port}\r\n'
+            'Upgrade: websocket\r\n'
+            'Connection: Upgrade\r\n'
+            f'Sec-WebSocket-Key: {key}\r\n'
+            'Sec-WebSocket-Version: 13\r\n'
+            f'Origin: {self.origin}\r\n\r\n'
+        ).encode())
+        response = await self.reader.readuntil(b'\r\n\r\n')
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+        if not response.startswith(b'HTTP/1.1 101') or accept.encode() not in response:
+            self.writer.close()
+            status_line = response.split(b'\r\n', 1)[0].decode()
+            raise ConnectionError(f'Socket was refused ({status_line})')
+
+    def _write_frame(self, opcode, payload):
+        length = len(payload)
+        if length < 126:
+            header = struct.pack('!BB', 0x80 | opcode, 0x80 | length)
+        elif length < 1 << 16:
+            header = struct.pack('!BBH', 0x80 | opcode, 0x80 | 126, length)
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 0x80 | 127, length)
+        # Clients must mask every frame
+        mask = os.urandom(4)
+        repeated = (mask * (length // 4 + 1))[:length]
+        masked = (int.from_bytes(payload, 'big') ^ int.from_bytes(repeated, 'big')).to_bytes(length, 'big')
+        self.writer.write(header + mask + masked)
+
+    async def send(self, frame):
+        self._write_frame(0x1, json.dumps(frame).encode())
+
+    async def receive(self):
+        """The next frame, or None once the socket is closed"""
+        message = b''
+        try:
+            while True:
+                first, second = await self.reader.readexactly(2)
+                opcode, length = first & 0x0F, second & 0x7F
+                if length == 126:
+                    length, = struct.unpack('!H', await self.reader.readexactly(2))
+                elif length == 127:
+                    length, = struct.unpack('!Q', await self.reader.readexactly(8))
+                payload = await self.reader.readexactly(length)
+                if opcode == 0x8:
+                    return None
+                if opcode == 0x9:
+                    self._write_frame(0xA, payload)
+                    continue
+                message += payload
+                if first & 0x80 and opcode in (0x0, 0x1):
+                    return json.loads(message)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+
+    async def close(self):
+        if self.writer is not None:
+            self._write_frame(0x8, struct.pack('!H', 1000))
+            self.writer.close()
+
+
+class Participant:
+    """One simulated tenant or landlord with a single multiplexed chat socket"""
+
+    def __init__(self, run, user_id, token, room_ids):
+        self.run = run
+        self.user_id = user_id
+        self.token = token
+        self.room_ids = room_ids
+        self.socket = None
+        self.reader = None
+        self.last_message_ids = {}
+        self.sequence = 0
+
+    async def connect(self):
+        self.socket = self.run.make_socket(self.token)
+        started = time.perf_counter()
+        await self.socket.connect()
+        self.run.connect_latencies.append(time.perf_counter() - started)
+        self.reader = asyncio.ensure_future(self.read())
+        await self.socket.send({'action': 'subscribe', 'room_id': self.room_ids[0]})
+
+    async def read(self):
+        while True:
+            frame = await self.socket.receive()
+            if frame is None:
+                return
+            kind = frame.get('type')
+            if kind == 'ping':
+                await self.socket.send({'action': 'pong'})
+            elif kind == 'message':
+                message = frame['message']
+                self.last_message_ids[frame['room_id']] = message['id']
+                if message['sender'] != self.user_id:
+                    self.run.delivered(message['content'])
+            elif kind == 'throttled':
+                self.run.throttled += 1
+
+    async def chat(self, count, interval, reply_ratio):
+        for _ in range(count):
+            await asyncio.sleep(interval * random.uniform(0.5, 1.5))
+            for room_id in self.room_ids:
+                self.sequence += 1
+                content = f'{CONTENT_PREFIX}{self.user_id}-{self.sequence}'
+                frame = {'action': 'message', 'room_id': room_id, 'message': content}
+                reply_to = self.last_message_ids.get(room_id)
+                if reply_to and random.random() < reply_ratio:
+                    frame['reply_to'] = reply_to
+                self.run.sent(content)
+                await self.socket.send(frame)
+
+    async def mark_read(self):
+        for room_id in self.room_ids:
+            started = time.perf_counter()
+            await self.run.mark_read(self.token, room_id)
+            self.run.read_latencies.append(time.perf_counter() - started)
+
+    async def close(self):
+        if self.reader is not None:
+            self.reader.cancel()
+        await self.socket.close()
+
+
+class LoadRun:
+    """Shared state and measurements for one load test"""
+
+    def __init__(self, options):
+        self.options = options
+        self.in_process = options['url'] is None
+        self.connect_latencies = []
+        self.delivery_latencies = []
+        self.read_latencies = []
+        self.pending = {}
+        self.sent_count = 0
+        self.throttled = 0
+        self.connect_failures = 0
+        self.all_delivered = None
+        # Each in-process request runs in its own thread, and SQLite allows
+        # one writer at a time
+        single_writer = self.in_process and connections['default'].vendor == 'sqlite'
+        self.http_slots = asyncio.Semaphore(1 if single_writer else options['connect_concurrency'])
+
+        if self.in_process:
+            from homehive.asgi import application
+            self.application = application
+            hosts = [host for host in settings.ALLOWED_HOSTS if host not in ('*', '')]
+            self.host = hosts[0].lstrip('.') if hosts else 'localhost'
+        self.origin = options['origin'] or f'http://{self.host if self.in_process else "localhost"}'
+
+    def make_socket(self, token):
+        if self.in_process:
+            return InProcessSocket(self.application, token, self.host, self.origin)
+        return LocalhostSocket(self.options['url'], token, self.origin)
+
+    def sent(self, content):
+        self.sent_count += 1
+        self.pending[content] = time.perf_counter()
+
+    def delivered(self, content):
+        started = self.pending.pop(content, None)
+        if started is None:
+            return
+        self.delivery_latencies.append(time.perf_counter() - started)
+        if not self.pending and self.all_delivered is not None:
+            self.all_delivered.set()
+
+    async def mark_read(self, token, room_id):
+        path = f'/api/chat/rooms/{room_id}/mark-read/'
+        headers = {'Authorization': f'Bearer {token}'}
+        if self.in_process:
+            from channels.testing import HttpCommunicator
+            communicator = HttpCommunicator(
+                self.application, 'PATCH', path,
+                headers=[(b'host', self.host.encode()), (b'authorization', headers['Authorization'].encode())]
+            )
+            async with self.http_slots:
+                response = await communicator.get_response(timeout=30)
+            await communicator.send_input({'type': 'http.disconnect'})
+            await communicator.wait()
+            status = response['status']
+        else:
+            base = self.options['url'].replace('ws://', 'http://').replace('wss://', 'https://')
+            request = urllib.request.Request(base + path, method='PATCH', headers=headers)
+            async with self.http_slots:
+                status = await asyncio.to_thread(lambda: urllib.request.urlopen(request, timeout=30).status)
+        if status != 200:
+            raise CommandError(f'mark-read returned {status}')
+
+
+class Command(BaseCommand):
+    help = (
+        'Simulate tenants and landlords chatting over WebSockets and report connect '
+        'latency, delivery latency percentiles, queries per message and throughput'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rooms',
+            type=int,
+            default=500,
+            help='Conversations to simulate, one tenant each'
+        )
+        parser.add_argument(
+            '--rooms-per-landlord',
+            type=int,
+            default=5,
+            help='Conversations each landlord takes part in'
+        )
+        parser.add_argument(
+            '--messages',
+            type=int,
+            default=10,
+            help='Messages each participant sends in each of their rooms'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=1.0,
+            help='Average seconds between a participant\'s messages'
+        )
+        parser.add_argument(
+            '--reply-ratio',
+            type=float,
+            default=0.2,
+            help='Share of messages sent as replies to the last message in the room'
+        )
+        parser.add_argument(
+            '--connect-concurrency',
+            type=int,
+            default=100,
+            help='Sockets opened at the same time while ramping up'
+        )
+        parser.add_argument(
+            '--drain-timeout',
+            type=float,
+            default=10.0,
+            help='Seconds to wait for outstanding deliveries after the last send'
+        )
+        parser.add_argument(
+            '--layer',
+            choices=['memory', 'configured'],
+            default='memory',
+            help='In-process runs: use the in-memory channel layer, or CHANNEL_LAYERS '
+                 '(e.g. channels_redis against a local redis-server)'
+        )
+        parser.add_argument(
+            '--url',
+            help='Drive a running server instead, e.g. ws://localhost:8000 (it must share this database)'
+        )
+        parser.add_argument(
+            '--origin',
+            help='Origin header for sockets (defaults to the first allowed host)'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            help='Random seed, for repeatable runs'
+        )
+        parser.add_argument(
+            '--keep',
+            action='store_true',
+            help='Keep the synthetic users, rooms and messages afterwards'
+        )
+
+    def handle(self, *args, **options):
+        if options['rooms'] < 1 or options['rooms_per_landlord'] < 1 or options['messages'] < 1:
+            raise CommandError('--rooms, --rooms-per-landlord and --messages must be positive')
+        if options['url'] and not options['url'].startswith(('ws://', 'wss://')):
+            raise CommandError('--url must be a ws:// or wss:// URL')
+        if options['url'] and options['url'].startswith('wss://'):
+            raise CommandError('wss:// is not supported; point --url at the server over plain ws://')
+        random.seed(options['seed'])
+
+        if options['url'] is None and options['layer'] == 'memory':
+            from channels.layers import channel_layers
+            settings.CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+            channel_layers.backends.clear()
+
+        self.cleanup()
+        participants = self.create_participants(options)
+        try:
+            run = LoadRun(options)
+            self.report(run, asyncio.run(self.drive(run, participants)), len(participants))
+        finally:
+            if not options['keep']:
+                self.cleanup()
+
+    def cleanup(self):
+        # Cascades to properties, rooms, messages and notifications
+        User.objects.filter(email__endswith=f'@{LOADTEST_DOMAIN}').delete()
+
+    def create_participants(self, options):
+        """Users, properties and rooms for the run, created in bulk"""
+        room_count = options['rooms']
+        landlord_count = -(-room_count // options['rooms_per_landlord'])
+        password = make_password(None)
+
+        def make_user(kind, index, role):
+            return User(
+                email=f'{kind}{index}@{LOADTEST_DOMAIN}',
+                username=f'loadtest-{kind}{index}',
+                first_name=kind.title(),
+                last_name=str(index),
+                role=role,
+                password=password
+            )
+
+        self.stdout.write(f"Creating {landlord_count} landlords, {room_count} tenants and {room_count} rooms...")
+        landlords = User.objects.bulk_create(
+            [make_user('landlord', i, 'LANDLORD') for i in range(landlord_count)]
+        )
+        tenants = User.objects.bulk_create(
+            [make_user('tenant', i, 'TENANT') for i in range(room_count)]
+        )
+        properties = Property.objects.bulk_create([
+            Property(
+                landlord=landlord, title=f'Load test {landlord.last_name}', description='Load test',
+                price=1, location='Load test', property_type='APARTMENT', num_bedrooms=1, num_bathrooms=1
+            )
+            for landlord in landlords
+        ])
+        rooms = ChatRoom.objects.bulk_create([
+            ChatRoom(
+                landlord=landlords[i % landlord_count],
+                tenant=tenant,
+                property=properties[i % landlord_count]
+            )
+            for i, tenant in enumerate(tenants)
+        ])
+        if rooms[0].pk is None:
+            # Backends that cannot return ids from bulk inserts
+            rooms = list(ChatRoom.objects.filter(tenant__in=tenants).order_by('tenant_id'))
+        # bulk_create skips the signal that gives new rooms their shard
+        place_rooms(rooms)
+
+        rooms_by_user = {}
+        for room in rooms:
+            rooms_by_user.setdefault(room.landlord_id, []).append(room.id)
+            rooms_by_user.setdefault(room.tenant_id, []).append(room.id)
+        return [
+            (user.id, str(AccessToken.for_user(user)), rooms_by_user[user.id])
+            for user in landlords + tenants
+        ]
+
+    async def drive(self, run, participant_specs):
+        options = run.options
+        participants = [Participant(run, *spec) for spec in participant_specs]
+        queries = QueryCounter()
+        if run.in_process:
+            queries.install()
+
+        self.stdout.write(f"Connecting {len(participants)} sockets...")
+        limit = asyncio.Semaphore(options['connect_concurrency'])
+
+        async def connect(participant):
+            async with limit:
+                try:
+                    await participant.connect()
+                except (ConnectionError, OSError, asyncio.TimeoutError):
+                    run.connect_failures += 1
+                    return None
+                return participant
+
+        started = time.perf_counter()
+        participants = [p for p in await asyncio.gather(*(connect(p) for p in participants)) if p]
+        connect_seconds = time.perf_counter() - started
+
+        self.stdout.write("Chatting...")
+        queries_before, cpu_before = queries.count, time.process_time()
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            p.chat(options['messages'], options['interval'], options['reply_ratio']) for p in participants
+        ))
+        # Set by the last outstanding delivery
+        run.all_delivered = asyncio.Event()
+        if run.pending:
+            try:
+                await asyncio.wait_for(run.all_delivered.wait(), options['drain_timeout'])
+            except asyncio.TimeoutError:
+                pass
+        chat_seconds = time.perf_counter() - started
+        chat_cpu = time.process_time() - cpu_before
+        chat_queries = queries.count - queries_before
+        delivered = len(run.delivery_latencies)
+
+        self.stdout.write("Marking rooms read...")
+        queries_before = queries.count
+        await asyncio.gather(*(p.mark_read() for p in participants))
+        read_queries = queries.count - queries_before
+
+        await asyncio.gather(*(p.close() for p in participants))
+        return {
+            'connect_seconds': connect_seconds,
+            'chat_seconds': chat_seconds,
+            'chat_cpu': chat_cpu,
+            'delivered': delivered,
+            'chat_queries': chat_queries if run.in_process else None,
+            'read_queries': read_queries if run.in_process else None,
+        }
+
+    def report(self, run, results, participant_count):
+        def latencies(label, values):
+            values = sorted(value * 1000 for value in values)
+            if not values:
+                self.stdout.write(f"  {label}: no samples")
+                return
+            self.stdout.write(
+                f"  {label} (ms, n={len(values)}): p50={percentile(values, 50):.1f} "
+                f"p95={percentile(values, 95):.1f} p99={percentile(values, 99):.1f} max={values[-1]:.1f}"
+            )
+
+        delivered = results['delivered']
+        if run.in_process:
+            mode = f"in-process, {settings.CHANNEL_LAYERS['default']['BACKEND'].rsplit('.', 1)[-1]}"
+        else:
+            mode = run.options['url']
+        self.stdout.write(self.style.SUCCESS(f"\nLoad test: {participant_count} sockets, {mode}"))
+        self.stdout.write(
+            f"  connected in {results['connect_seconds']:.2f}s "
+            f"({participant_count / results['connect_seconds']:.0f} sockets/s, {run.connect_failures} failed)"
+        )
+        latencies('connect latency', run.connect_latencies)
+        latencies('delivery latency', run.delivery_latencies)
+        latencies('mark-read latency', run.read_latencies)
+        self.stdout.write(
+            f"  messages: {run.sent_count} sent, {delivered} delivered in time, "
+            f"{len(run.delivery_latencies) - delivered} late, {len(run.pending)} lost, {run.throttled} throttled"
+        )
+        throughput = f"  throughput: {delivered / results['chat_seconds']:.0f} messages/s over {results['chat_seconds']:.1f}s"
+        if run.in_process:
+            # The server shares this process, so its CPU time is the server's
+            throughput += (
+                f", {delivered / max(results['chat_cpu'], 1e-9):.0f} messages per CPU second "
+                f"({os.cpu_count()} cores available)"
+            )
+        self.stdout.write(throughput)
+        if results['chat_queries'] is not None:
+            self.stdout.write(
+                f"  DB queries: {results['chat_queries'] / max(run.sent_count, 1):.2f} per message, "
+                f"{results['read_queries'] / max(len(run.read_latencies), 1):.2f} per mark-read"
+            )
+        else:
+            self.stdout.write("  DB queries: not measured (the server runs in another process)")
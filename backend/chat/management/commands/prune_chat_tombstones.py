@@ -0,0 +1,31 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from chat.models import MessageTombstone
+from chat.sharding import message_databases
+
+
+class Command(BaseCommand):
+    help = 'Delete message tombstones too old to matter for reconnect resyncs'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=30,
+            help='Keep tombstones from the last N days'
+        )
+
+    def handle(self, *args, **options):
+        if options['days'] < 1:
+            raise CommandError('--days must be positive')
+        
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        deleted = 0
+        for database in message_databases():
+            count, _ = MessageTombstone.objects.using(database).filter(deleted_at__lt=cutoff).delete()
+            deleted += count
+        
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} tombstones"))
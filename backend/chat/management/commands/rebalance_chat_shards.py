@@ -0,0 +1,71 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from chat.models import ChatRoom
+from chat.sharding import (
+    PLACEMENT_CACHE_TIMEOUT, copy_room, purge_room, ring_shard, sharding_enabled, switch_room
+)
+
+
+class Command(BaseCommand):
+    help = 'Move chat rooms whose messages are not on the shard the hash ring places them on'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--room',
+            type=int,
+            help='Only rebalance this chat room'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report the rooms that would move without moving them'
+        )
+        parser.add_argument(
+            '--no-wait',
+            action='store_true',
+            help="Don't wait for cached placements to expire before the final copy "
+                 "(only safe while nothing is writing to the moved rooms)"
+        )
+
+    def handle(self, *args, **options):
+        if not sharding_enabled():
+            raise CommandError('Chat sharding is not enabled (CHAT_SHARD_DATABASE_URLS is empty)')
+
+        rooms = ChatRoom.objects.order_by('pk')
+        if options['room'] is not None:
+            rooms = rooms.filter(pk=options['room'])
+        moves = []
+        for room_id, shard in rooms.values_list('pk', 'shard').iterator():
+            source = shard or DEFAULT_DB_ALIAS
+            target = ring_shard(room_id)
+            if source != target:
+                moves.append((room_id, source, target))
+
+        if options['dry_run']:
+            for room_id, source, target in moves:
+                self.stdout.write(f"Room {room_id}: {source} -> {target}")
+            self.stdout.write(self.style.SUCCESS(f"{len(moves)} rooms would move"))
+            return
+
+        # 1. Copy while the source is still live, then point each room at its target
+        copied = 0
+        for room_id, source, target in moves:
+            copied += copy_room(room_id, source, target)
+            switch_room(room_id, target)
+            if options['verbosity'] > 1:
+                self.stdout.write(f"Room {room_id}: {source} -> {target}")
+
+        # 2. Processes may write to the old shard until their cached placement expires
+        if moves and not options['no_wait']:
+            self.stdout.write(f"Waiting {PLACEMENT_CACHE_TIMEOUT}s for cached placements to expire...")
+            time.sleep(PLACEMENT_CACHE_TIMEOUT)
+
+        # 3. Sweep up what was written in the meantime and drop the old copies
+        for room_id, source, target in moves:
+            copied += copy_room(room_id, source, target)
+            purge_room(room_id, source)
+
+        self.stdout.write(self.style.SUCCESS(f"Moved {len(moves)} rooms ({copied} messages)"))
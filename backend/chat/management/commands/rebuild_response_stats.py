@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.response_stats import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recompute landlords' first-response statistics from chat history"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Rooms read per batch'
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+
+        rooms = rebuild(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt response statistics from {rooms} rooms"))
@@ -0,0 +1,227 @@
+"""
+Chat socket health: counters (throttled and dropped frames, sockets closed
+for flooding, falling behind or going quiet) and live connection counts.
+
+Sockets count events in process memory. Every METRICS_FLUSH_INTERVAL
+seconds each process adds its counts to a Redis hash (chat:metrics) beside
+the channel layer and publishes its live sockets, in total and per room,
+under chat:node:<node_id> (expiring after NODE_TTL, so dead nodes drop
+out). A flood of throttled frames therefore costs no extra round trips and
+the figures cover every node. With the in-memory channel layer they stay
+in the process. Staff read them at GET /api/chat/metrics/.
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import weakref
+from collections import Counter
+
+from .presence import channel_layer_redis_url
+
+logger = logging.getLogger(__name__)
+
+METRICS_KEY = 'chat:metrics'
+METRICS_FLUSH_INTERVAL = 5
+NODE_TTL = 3 * METRICS_FLUSH_INTERVAL
+NODE_ID = f'{socket.gethostname()}:{os.getpid()}'
+
+THROTTLED_FRAMES = 'throttled_frames'
+THROTTLED_MESSAGES = 'throttled_messages'
+DROPPED_FRAMES = 'dropped_frames'
+SLOW_CONSUMERS_CLOSED = 'slow_consumers_closed'
+FLOODING_CLOSED = 'flooding_closed'
+UNRESPONSIVE_CLOSED = 'unresponsive_closed'
+IDLE_CLOSED = 'idle_closed'
+OVER_SOCKET_LIMIT = 'over_socket_limit'
+
+
+def node_key(node_id):
+    return f'chat:node:{node_id}'
+
+
+class RedisMetricsStore:
+    """Totals kept in Redis, shared by every process"""
+
+    def __init__(self, url):
+        self.url = url
+        self._sync_client = None
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    @property
+    def sync_client(self):
+        if self._sync_client is None:
+            import redis
+            self._sync_client = redis.Redis.from_url(self.url)
+        return self._sync_client
+
+    @property
+    def async_client(self):
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            import redis.asyncio
+            client = redis.asyncio.Redis.from_url(self.url)
+            self._async_clients[loop] = client
+        return client
+
+    async def add(self, counts):
+        async with self.async_client.pipeline(transaction=False) as pipe:
+            for name, amount in counts.items():
+                pipe.hincrby(METRICS_KEY, name, amount)
+            await pipe.execute()
+
+    def totals(self):
+        return {name.decode(): int(value) for name, value in self.sync_client.hgetall(METRICS_KEY).items()}
+
+    async def set_node(self, node_id, snapshot):
+        await self.async_client.set(node_key(node_id), json.dumps(snapshot), ex=NODE_TTL)
+
+    def nodes(self):
+        keys = list(self.sync_client.scan_iter(match=node_key('*'), count=100))
+        if not keys:
+            return {}
+        return {
+            key.decode().split(':', 2)[2]: json.loads(value)
+            for key, value in zip(keys, self.sync_client.mget(keys))
+            if value is not None
+        }
+
+
+class InMemoryMetricsStore:
+    """Process-local stand-in for the in-memory channel layer"""
+
+    def __init__(self):
+        self._totals = Counter()
+        self._nodes = {}
+        self._lock = threading.Lock()
+
+    async def add(self, counts):
+        with self._lock:
+            self._totals.update(counts)
+
+    def totals(self):
+        with self._lock:
+            return dict(self._totals)
+
+    async def set_node(self, node_id, snapshot):
+        with self._lock:
+            self._nodes[node_id] = (snapshot, time.time() + NODE_TTL)
+
+    def nodes(self):
+        now = time.time()
+        with self._lock:
+            return {node_id: snapshot for node_id, (snapshot, expires) in self._nodes.items() if expires > now}
+
+
+_store = None
+_store_lock = threading.Lock()
+
+# Counts not yet flushed, and the reporting task of each event loop
+_pending = Counter()
+_reporters = weakref.WeakKeyDictionary()
+
+# This process's open sockets, and its sockets listening to each room
+_live_sockets = Counter()
+_room_sockets = Counter()
+
+
+def get_metrics_store():
+    """The metrics store matching the configured channel layer"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            url = channel_layer_redis_url()
+            _store = RedisMetricsStore(url) if url else InMemoryMetricsStore()
+        return _store
+
+
+def _ensure_reporter():
+    loop = asyncio.get_running_loop()
+    if loop not in _reporters:
+        _reporters[loop] = loop.create_task(_report())
+
+
+async def _report():
+    while True:
+        await asyncio.sleep(METRICS_FLUSH_INTERVAL)
+        await flush_metrics()
+        try:
+            await get_metrics_store().set_node(NODE_ID, node_snapshot())
+        except Exception:
+            logger.exception('Could not publish chat connection counts')
+
+
+def incr(name, amount=1):
+    """Count an event. Must be called from a running event loop."""
+    _pending[name] += amount
+    _ensure_reporter()
+
+
+def socket_opened():
+    _live_sockets['sockets'] += 1
+    _ensure_reporter()
+
+
+def socket_closed():
+    _live_sockets['sockets'] -= 1
+
+
+def room_joined(room_id):
+    _room_sockets[room_id] += 1
+
+
+def room_left(room_id):
+    _room_sockets[room_id] -= 1
+    if _room_sockets[room_id] <= 0:
+        del _room_sockets[room_id]
+
+
+def node_snapshot():
+    """This process's live sockets, in total and per room"""
+    return {
+        'sockets': _live_sockets['sockets'],
+        'rooms': {str(room_id): count for room_id, count in _room_sockets.items()},
+    }
+
+
+async def flush_metrics():
+    """Add this process's pending counts to the shared totals"""
+    counts = dict(_pending)
+    _pending.clear()
+    if not counts:
+        return
+    try:
+        await get_metrics_store().add(counts)
+    except Exception:
+        logger.exception('Could not flush chat metrics %s', counts)
+
+
+def get_metrics():
+    """
+    Counter totals across every process (plus this process's unflushed
+    counts) and live sockets per node and per room.
+    """
+    store = get_metrics_store()
+    counters = Counter(store.totals())
+    counters.update(_pending)
+
+    nodes = store.nodes()
+    if _reporters:
+        # This process serves sockets: report its current figures
+        nodes[NODE_ID] = node_snapshot()
+    rooms = Counter()
+    for snapshot in nodes.values():
+        rooms.update(snapshot['rooms'])
+
+    return {
+        'counters': dict(counters),
+        'connections': {
+            'total': sum(snapshot['sockets'] for snapshot in nodes.values()),
+            'nodes': {node_id: snapshot['sockets'] for node_id, snapshot in nodes.items()},
+            'rooms': dict(rooms),
+        },
+    }
@@ -0,0 +1,68 @@
+# Generated by Django 5.0.14 on 2026-10-18 22:35
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_room_summaries(apps, schema_editor):
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    Message = apps.get_model('chat', 'Message')
+    
+    for room in ChatRoom.objects.all().iterator():
+        messages = Message.objects.filter(room_id=room.pk)
+        latest = messages.order_by('-timestamp', '-id').first()
+        unread = messages.filter(is_read=False)
+        ChatRoom.objects.filter(pk=room.pk).update(
+            last_message=latest,
+            last_message_preview=latest.content[:255] if latest else '',
+            last_message_at=latest.timestamp if latest else None,
+            landlord_unread_count=unread.exclude(sender_id=room.landlord_id).count(),
+            tenant_unread_count=unread.exclude(sender_id=room.tenant_id).count(),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_alter_chatroom_unique_together_message_property_and_more'),
+        ('properties', '0007_propertyimage_placeholder'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='landlord_unread_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.message'),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_message_preview',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='tenant_unread_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='chatroom',
+            index=models.Index(fields=['landlord', '-updated_at'], name='chat_chatro_landlor_b6ce35_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatroom',
+            index=models.Index(fields=['tenant', '-updated_at'], name='chat_chatro_tenant__5679b7_idx'),
+        ),
+        migrations.RunPython(backfill_room_summaries, migrations.RunPython.noop),
+    ]
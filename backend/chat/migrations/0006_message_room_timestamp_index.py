@@ -0,0 +1,20 @@
+# Generated by Django 5.0.14 on 2026-10-18 22:36
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_chatroom_summary'),
+        ('properties', '0007_propertyimage_placeholder'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', 'timestamp', 'id'], name='chat_messag_room_id_284f10_idx'),
+        ),
+    ]
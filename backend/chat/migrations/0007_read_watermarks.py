@@ -0,0 +1,47 @@
+# Generated by Django 5.0.14 on 2026-10-18 22:38
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def backfill_read_watermarks(apps, schema_editor):
+    """
+    Each participant's watermark becomes the newest message from the other
+    participant that they had already read.
+    """
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    Message = apps.get_model('chat', 'Message')
+    
+    for room in ChatRoom.objects.all().iterator():
+        read = Message.objects.filter(room_id=room.pk, is_read=True)
+        landlord_last_read = read.exclude(sender_id=room.landlord_id).aggregate(m=Max('id'))['m']
+        tenant_last_read = read.exclude(sender_id=room.tenant_id).aggregate(m=Max('id'))['m']
+        ChatRoom.objects.filter(pk=room.pk).update(
+            landlord_last_read_id=landlord_last_read or 0,
+            tenant_last_read_id=tenant_last_read or 0,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_message_room_timestamp_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='landlord_last_read_id',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='tenant_last_read_id',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_read_watermarks, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='message',
+            name='is_read',
+        ),
+    ]
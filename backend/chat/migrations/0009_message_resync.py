@@ -0,0 +1,52 @@
+# Generated by Django 5.0.14 on 2026-10-18 22:52
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_message_timestamp_default'),
+        ('properties', '0007_propertyimage_placeholder'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message_id', models.PositiveBigIntegerField()),
+                ('deleted_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Message Tombstone',
+                'verbose_name_plural': 'Message Tombstones',
+            },
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='edited_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', 'id'], name='chat_messag_room_id_12c833_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('edited_at__isnull', False)), fields=['room', 'edited_at'], name='chat_message_room_edited_idx'),
+        ),
+        migrations.AddField(
+            model_name='messagetombstone',
+            name='room',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='message_tombstones', to='chat.chatroom'),
+        ),
+        migrations.AddIndex(
+            model_name='messagetombstone',
+            index=models.Index(fields=['room', 'deleted_at'], name='chat_messag_room_id_8828af_idx'),
+        ),
+    ]
@@ -0,0 +1,77 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+# Kept in step with chat.search
+SEARCH_CONFIG = 'english'
+SEARCH_INDEX = 'chat_message_search'
+SEARCH_TABLE = 'chat_message_fts'
+
+
+def search_index():
+    return GinIndex(SearchVector('content', config=SEARCH_CONFIG), name=SEARCH_INDEX)
+
+
+def create_search_index(apps, schema_editor):
+    Message = apps.get_model('chat', 'Message')
+    table = Message._meta.db_table
+    vendor = schema_editor.connection.vendor
+
+    if vendor == 'postgresql':
+        # Built concurrently so a large message table stays writable meanwhile
+        schema_editor.execute(
+            search_index().create_sql(Message, schema_editor, concurrently=True)
+        )
+
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5("
+            f"content, content='{table}', content_rowid='id', "
+            f"tokenize='porter unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(
+            f'CREATE TRIGGER {SEARCH_TABLE}_insert AFTER INSERT ON "{table}" BEGIN '
+            f"INSERT INTO {SEARCH_TABLE} (rowid, content) VALUES (new.id, new.content); "
+            f"END"
+        )
+        schema_editor.execute(
+            f'CREATE TRIGGER {SEARCH_TABLE}_delete AFTER DELETE ON "{table}" BEGIN '
+            f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, content) VALUES ('delete', old.id, old.content); "
+            f"END"
+        )
+        schema_editor.execute(
+            f'CREATE TRIGGER {SEARCH_TABLE}_update AFTER UPDATE OF content ON "{table}" BEGIN '
+            f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, content) VALUES ('delete', old.id, old.content); "
+            f"INSERT INTO {SEARCH_TABLE} (rowid, content) VALUES (new.id, new.content); "
+            f"END"
+        )
+        # Index the messages already stored
+        schema_editor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('rebuild')")
+
+
+def drop_search_index(apps, schema_editor):
+    Message = apps.get_model('chat', 'Message')
+    vendor = schema_editor.connection.vendor
+
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            search_index().remove_sql(Message, schema_editor, concurrently=True)
+        )
+
+    elif vendor == 'sqlite':
+        for trigger in ('insert', 'delete', 'update'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {SEARCH_TABLE}_{trigger}')
+        schema_editor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('chat', '0009_message_resync'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.0.14 on 2026-10-18 23:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0010_message_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('backend', models.CharField(max_length=16)),
+                ('key', models.CharField(max_length=255)),
+                ('message_count', models.PositiveIntegerField()),
+                ('first_timestamp', models.DateTimeField()),
+                ('first_message_id', models.PositiveBigIntegerField()),
+                ('last_timestamp', models.DateTimeField()),
+                ('last_message_id', models.PositiveBigIntegerField()),
+                ('min_message_id', models.PositiveBigIntegerField()),
+                ('max_message_id', models.PositiveBigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='message_segments', to='chat.chatroom')),
+            ],
+            options={
+                'verbose_name': 'Message Segment',
+                'verbose_name_plural': 'Message Segments',
+                'indexes': [models.Index(fields=['room', 'first_timestamp', 'first_message_id'], name='chat_messag_room_id_f6c2f7_idx')],
+            },
+        ),
+    ]
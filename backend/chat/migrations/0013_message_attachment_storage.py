@@ -0,0 +1,25 @@
+# Generated by Django 5.0.14 on 2026-10-18 23:32
+
+import properties.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0012_message_client_id'),
+    ]
+
+    operations = [
+        # Storage has no database effect; altering the column would make
+        # SQLite rebuild the table and lose the search triggers (0010)
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='message',
+                    name='attachment',
+                    field=models.FileField(blank=True, null=True, storage=properties.storage.MediaStorage('chat-attachments'), upload_to='chat_attachments/'),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 5.0.14 on 2026-10-18 23:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# Kept in step with chat.search
+SEARCH_TABLE = 'chat_message_fts'
+
+
+def restore_search_triggers(apps, schema_editor):
+    """
+    SQLite rebuilds chat_message to drop its foreign key constraints, which
+    drops the search triggers from 0010 with it; put them back and reindex.
+    """
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    table = apps.get_model('chat', 'Message')._meta.db_table
+    schema_editor.execute(
+        f'CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_insert AFTER INSERT ON "{table}" BEGIN '
+        f"INSERT INTO {SEARCH_TABLE} (rowid, content) VALUES (new.id, new.content); "
+        f"END"
+    )
+    schema_editor.execute(
+        f'CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_delete AFTER DELETE ON "{table}" BEGIN '
+        f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, content) VALUES ('delete', old.id, old.content); "
+        f"END"
+    )
+    schema_editor.execute(
+        f'CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_update AFTER UPDATE OF content ON "{table}" BEGIN '
+        f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, content) VALUES ('delete', old.id, old.content); "
+        f"INSERT INTO {SEARCH_TABLE} (rowid, content) VALUES (new.id, new.content); "
+        f"END"
+    )
+    schema_editor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('rebuild')")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0013_message_attachment_storage'),
+        ('properties', '0007_propertyimage_placeholder'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='shard',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='chatroom',
+            name='last_message',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.message'),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='property',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='property_messages', to='properties.property'),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='room',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='chat.chatroom'),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='sender',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='sent_messages', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='messagesegment',
+            name='room',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='message_segments', to='chat.chatroom'),
+        ),
+        migrations.AlterField(
+            model_name='messagetombstone',
+            name='room',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='message_tombstones', to='chat.chatroom'),
+        ),
+        migrations.RunPython(restore_search_triggers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.14 on 2026-10-18 23:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0014_message_sharding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='first_response_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='inquiry_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
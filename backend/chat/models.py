@@ -1,9 +1,30 @@
 from django.db import models
+from django.db.models.constants import LOOKUP_SEP
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 from properties.models import Property
+from properties.storage import MediaStorage
 
 User = get_user_model()
 
+# Length of the last-message preview stored on ChatRoom
+PREVIEW_LENGTH = 255
+# Longest client-generated message id (a UUID fits)
+CLIENT_ID_MAX_LENGTH = 64
+
+
+def parse_client_id(value):
+    """
+    A client message id from a request or socket frame, or None if not
+    given. Raises ValueError if it is not a string of at most
+    CLIENT_ID_MAX_LENGTH characters.
+    """
+    if value in (None, ''):
+        return None
+    if not isinstance(value, str) or len(value) > CLIENT_ID_MAX_LENGTH:
+        raise ValueError(value)
+    return value
+
 
 class ChatRoom(models.Model):
     """
@@ -31,21 +52,148 @@ class ChatRoom(models.Model):
         blank=True,
         related_name='chat_rooms'
     )
+    
+    # Conversation summary, maintained by chat.signals so the inbox
+    # can be rendered from the room table alone
+    last_message = models.ForeignKey(
+        'Message',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+',
+        # Messages may live on another database (chat.sharding)
+        db_constraint=False
+    )
+    last_message_preview = models.CharField(max_length=PREVIEW_LENGTH, blank=True, default='')
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    landlord_unread_count = models.PositiveIntegerField(default=0)
+    tenant_unread_count = models.PositiveIntegerField(default=0)
+    
+    # Read watermarks: every message up to this id has been read by the participant
+    landlord_last_read_id = models.PositiveBigIntegerField(default=0)
+    tenant_last_read_id = models.PositiveBigIntegerField(default=0)
+    
+    # First-response bookkeeping (chat.response_stats): when the tenant opened
+    # the conversation, and when the landlord first wrote in it
+    inquiry_at = models.DateTimeField(null=True, blank=True)
+    first_response_at = models.DateTimeField(null=True, blank=True)
+    
+    # Database alias holding the room's messages, tombstones and archive
+    # segments; blank for 'default' (see chat.sharding)
+    shard = models.CharField(max_length=64, blank=True, default='')
+    
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         unique_together = ['landlord', 'tenant']
         ordering = ['-updated_at']
+        indexes = [
+            models.Index(fields=['landlord', '-updated_at']),
+            models.Index(fields=['tenant', '-updated_at']),
+        ]
         verbose_name = 'Chat Room'
         verbose_name_plural = 'Chat Rooms'
     
     def __str__(self):
         return f"Chat: {self.tenant.email} - {self.landlord.email}"
     
+    def unread_field_for(self, user):
+        """Name of the unread counter belonging to a participant"""
+        user_id = getattr(user, 'pk', user)
+        return 'landlord_unread_count' if user_id == self.landlord_id else 'tenant_unread_count'
+    
+    def last_read_field_for(self, user):
+        """Name of the read watermark belonging to a participant"""
+        user_id = getattr(user, 'pk', user)
+        return 'landlord_last_read_id' if user_id == self.landlord_id else 'tenant_last_read_id'
+    
+    def other_participant_id(self, user):
+        """Id of the participant who is not `user`"""
+        user_id = getattr(user, 'pk', user)
+        return self.tenant_id if user_id == self.landlord_id else self.landlord_id
+    
     def get_unread_count(self, user):
         """Get unread message count for a specific user"""
-        return self.messages.filter(is_read=False).exclude(sender=user).count()
+        return getattr(self, self.unread_field_for(user))
+
+
+class RoomQuerySet(models.QuerySet):
+    """Queries for the models stored on their room's shard (see chat.sharding)"""
+    
+    def in_room(self, room):
+        """Rows of `room` (a ChatRoom or its id), read from the room's database"""
+        from .sharding import shard_for_room
+        return self.using(shard_for_room(room)).filter(room_id=getattr(room, 'pk', room))
+
+    def create(self, **kwargs):
+        # The router gets no instance to place from create(), so pick the room's database here
+        room = kwargs.get('room', kwargs.get('room_id'))
+        if self._db is None and room is not None:
+            from .sharding import shard_for_room
+            return super(RoomQuerySet, self.using(shard_for_room(room))).create(**kwargs)
+        return super().create(**kwargs)
+
+    def delete_moved(self):
+        """
+        Delete the rows with a single DELETE and no delete signals or
+        cascades. Only for rows that live on elsewhere (in an archive
+        segment, or on another shard): to clients those messages still
+        exist, so the post_delete receivers must not leave tombstones,
+        broadcast deletions or remove segment files. Replies to deleted
+        messages are not cleared either. Returns the number of rows deleted.
+        """
+        return self._raw_delete(self.db)
+
+
+class MessageQuerySet(RoomQuerySet):
+    
+    # Relations to models that always stay on 'default'
+    CROSS_DATABASE_RELATIONS = ('room', 'sender', 'property')
+    
+    def with_related(self, *fields):
+        """
+        select_related(*fields), except that with sharding enabled the parts
+        of each path that lead off the message's database (rooms, users,
+        properties) are prefetched instead, as joins cannot cross databases.
+        """
+        from .sharding import sharding_enabled
+        if not sharding_enabled():
+            return self.select_related(*fields)
+        
+        joined, prefetched = [], []
+        for field in fields:
+            parts = field.split(LOOKUP_SEP)
+            local = []
+            for part in parts:
+                if part in self.CROSS_DATABASE_RELATIONS:
+                    break
+                local.append(part)
+            if local:
+                joined.append(LOOKUP_SEP.join(local))
+            if len(local) < len(parts):
+                prefetched.append(field)
+        messages = self.select_related(*joined) if joined else self
+        return messages.prefetch_related(*prefetched)
+
+
+class MessageManager(models.Manager.from_queryset(MessageQuerySet)):
+    
+    def create_once(self, client_id=None, **fields):
+        """
+        Create a message, unless its sender already sent one with `client_id`
+        in the room; a retried send then gets the original back, without a
+        second broadcast or notification.
+        
+        Returns:
+            tuple: (message, created)
+        """
+        messages = self.in_room(fields['room'])
+        if not client_id:
+            return messages.create(**fields), True
+        room = fields.pop('room')
+        sender = fields.pop('sender')
+        return messages.get_or_create(room=room, sender=sender, client_id=client_id, defaults=fields)
 
 
 class Message(models.Model):
@@ -53,15 +201,19 @@ class Message(models.Model):
     Individual chat message within a chat room.
     """
     
+    # Rooms, users and properties stay on 'default' while messages may be
+    # sharded, so these relations have no database constraints
     room = models.ForeignKey(
         ChatRoom,
         on_delete=models.CASCADE,
-        related_name='messages'
+        related_name='messages',
+        db_constraint=False
     )
     sender = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
-        related_name='sent_messages'
+        related_name='sent_messages',
+        db_constraint=False
     )
     # The property being discussed in this specific message
     property = models.ForeignKey(
@@ -69,7 +221,8 @@ class Message(models.Model):
         on_delete=models.SET_NULL,
         null=True,
         blank=True,
-        related_name='property_messages'
+        related_name='property_messages',
+        db_constraint=False
     )
     content = models.TextField()
     reply_to = models.ForeignKey(
@@ -79,18 +232,133 @@ class Message(models.Model):
         blank=True,
         related_name='replies'
     )
+    # Stored in the 'chat-attachments' bucket outside DEBUG; attachments can
+    # also be uploaded there directly and attached by key (properties.uploads)
     attachment = models.FileField(
         upload_to='chat_attachments/',
+        storage=MediaStorage('chat-attachments'),
         null=True,
         blank=True
     )
-    is_read = models.BooleanField(default=False)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set at creation; write-behind batching assigns it when the message is
+    # accepted, before the row is inserted
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
+    # Set when the content is edited, so reconnecting clients can catch up
+    edited_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # Optional id chosen by the sending client (e.g. a UUID), so a retried
+    # send is answered with the original message instead of a duplicate
+    client_id = models.CharField(max_length=CLIENT_ID_MAX_LENGTH, null=True, blank=True)
+    
+    objects = MessageManager()
     
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            # Keyset pagination of a room's history
+            models.Index(fields=['room', 'timestamp', 'id']),
+            # Messages newer than a resync point
+            models.Index(fields=['room', 'id']),
+            # Edits since a resync point
+            models.Index(
+                fields=['room', 'edited_at'],
+                condition=models.Q(edited_at__isnull=False),
+                name='chat_message_room_edited_idx'
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['room', 'sender', 'client_id'],
+                condition=models.Q(client_id__isnull=False),
+                name='chat_message_client_id_unique'
+            ),
+        ]
         verbose_name = 'Message'
         verbose_name_plural = 'Messages'
     
     def __str__(self):
         return f"{self.sender.email}: {self.content[:50]}"
+    
+    def save(self, *args, **kwargs):
+        from .sharding import sharding_enabled
+        if self.pk is None and sharding_enabled():
+            # Shards share one id sequence, kept on 'default' (chat.sharding)
+            from .batcher import allocate_message_id
+            self.pk = allocate_message_id()
+            kwargs['force_insert'] = True
+        super().save(*args, **kwargs)
+    
+    def is_read_by_recipient(self):
+        """Whether the recipient's read watermark has reached this message"""
+        if self.pk is None:
+            return False
+        room = self.room
+        recipient_id = room.other_participant_id(self.sender_id)
+        return self.pk <= getattr(room, room.last_read_field_for(recipient_id))
+
+
+class MessageTombstone(models.Model):
+    """
+    Record of a deleted message, so clients resyncing after a reconnect
+    can drop it. Old tombstones are removed by prune_chat_tombstones.
+    """
+    
+    room = models.ForeignKey(
+        ChatRoom,
+        on_delete=models.CASCADE,
+        related_name='message_tombstones',
+        db_constraint=False
+    )
+    message_id = models.PositiveBigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+    
+    objects = RoomQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['room', 'deleted_at']),
+        ]
+        verbose_name = 'Message Tombstone'
+        verbose_name_plural = 'Message Tombstones'
+    
+    def __str__(self):
+        return f"Deleted message {self.message_id} in room {self.room_id}"
+
+
+class MessageSegment(models.Model):
+    """
+    A compressed file of a room's archived messages (see chat.archive).
+    Segments of a room never overlap and are all older than the messages
+    left in the Message table.
+    """
+    
+    room = models.ForeignKey(
+        ChatRoom,
+        on_delete=models.CASCADE,
+        related_name='message_segments',
+        db_constraint=False
+    )
+    backend = models.CharField(max_length=16)
+    key = models.CharField(max_length=255)
+    message_count = models.PositiveIntegerField()
+    # Range of the (timestamp, id) keys inside, for paging
+    first_timestamp = models.DateTimeField()
+    first_message_id = models.PositiveBigIntegerField()
+    last_timestamp = models.DateTimeField()
+    last_message_id = models.PositiveBigIntegerField()
+    # Ids are not ordered by timestamp under write-behind, so cursor
+    # lookups by id check these instead
+    min_message_id = models.PositiveBigIntegerField()
+    max_message_id = models.PositiveBigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    objects = RoomQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['room', 'first_timestamp', 'first_message_id']),
+        ]
+        verbose_name = 'Message Segment'
+        verbose_name_plural = 'Message Segments'
+    
+    def __str__(self):
+        return f"{self.message_count} archived messages in room {self.room_id}"
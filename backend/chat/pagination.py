@@ -0,0 +1,115 @@
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+
+from .archive import archived_after, archived_before, archived_cursor, messages_from_records
+
+
+class MessageKeysetPagination(BasePagination):
+    """
+    Keyset pagination for chat history, backed by the (room, timestamp, id) index.
+    
+    Query parameters:
+    - (none): the newest `limit` messages
+    - before=<id>: the `limit` messages immediately older than message <id>
+    - after=<id>: the `limit` messages immediately newer than message <id>
+    - limit: page size (default 30, max 100)
+    
+    Each page is returned oldest-first, with cursors for loading further pages.
+    Cost per page is constant regardless of conversation length.
+    
+    When the view sets `room`, paging continues into the room's archived
+    segments (chat.archive) once the table runs out, and cursors may be
+    archived message ids.
+    """
+    default_limit = 30
+    max_limit = 100
+    
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params.get('limit', self.default_limit))
+        except (TypeError, ValueError):
+            raise ValidationError({'limit': 'Must be an integer.'})
+        return max(1, min(limit, self.max_limit))
+    
+    def get_cursor(self, queryset, request, param, room=None):
+        """
+        The (timestamp, id) key of the message named by `param`, and whether
+        it is archived.
+        """
+        value = request.query_params.get(param)
+        if value in (None, ''):
+            return None
+        try:
+            pk = int(value)
+        except (TypeError, ValueError):
+            raise ValidationError({param: 'Must be a message id.'})
+        
+        timestamp = queryset.filter(pk=pk).values_list('timestamp', flat=True).first()
+        if timestamp is not None:
+            return (timestamp, pk), False
+        if room is not None:
+            key = archived_cursor(room, pk)
+            if key is not None:
+                return key, True
+        raise ValidationError({param: 'Message not found in this room.'})
+    
+    def paginate_queryset(self, queryset, request, view=None):
+        limit = self.get_limit(request)
+        room = getattr(view, 'room', None)
+        if room is not None and not room.message_segments.exists():
+            room = None
+        before, _ = self.get_cursor(queryset, request, 'before', room) or (None, False)
+        after, after_archived = self.get_cursor(queryset, request, 'after', room) or (None, False)
+        if before and after:
+            raise ValidationError({'detail': "Use either 'before' or 'after', not both."})
+        
+        if after:
+            timestamp, pk = after
+            queryset = queryset.filter(
+                Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=pk)
+            ).order_by('timestamp', 'id')
+            page = []
+            if after_archived:
+                # Archived messages are all older than the table's
+                page = messages_from_records(room, archived_after(room, after, limit + 1))
+            page += list(queryset[:limit + 1 - len(page)])
+            self.has_newer = len(page) > limit
+            page = page[:limit]
+            self.has_older = True
+        else:
+            if before:
+                timestamp, pk = before
+                queryset = queryset.filter(
+                    Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=pk)
+                )
+            page = list(queryset.order_by('-timestamp', '-id')[:limit + 1])
+            if len(page) <= limit and room is not None:
+                page += messages_from_records(room, archived_before(room, before, limit + 1 - len(page)))
+            self.has_older = len(page) > limit
+            page = page[:limit]
+            page.reverse()
+            self.has_newer = before is not None
+        
+        self.page = page
+        return page
+    
+    def get_paginated_response(self, data):
+        return Response({
+            'has_older': self.has_older,
+            'has_newer': self.has_newer,
+            'before': self.page[0].id if self.page else None,
+            'after': self.page[-1].id if self.page else None,
+            'results': data
+        })
+
+
+class MessageSearchPagination(PageNumberPagination):
+    """
+    Numbered pages of search results, best match first.
+    Query parameters: page, limit (default 20, max 50).
+    """
+    page_size = 20
+    page_size_query_param = 'limit'
+    max_page_size = 50
@@ -0,0 +1,281 @@
+"""
+Online presence and typing indicators, kept out of the relational database.
+
+State lives in TTL keys beside the channel layer: in the channel layer's
+Redis when CHANNEL_LAYERS uses channels_redis, so every daphne node shares
+it, or in process memory with the in-memory channel layer (tests and
+single-process development).
+
+Keys:
+- chat:presence:<user_id>         sorted set of the user's open sockets
+                                  (channel names), scored by expiry time
+- chat:last_seen:<user_id>        unix time the user's last socket closed
+- chat:typing:<room_id>:<user_id> present while the user is typing
+- chat:contacts:<user_id>         set of the ids of the users the user chats
+                                  with, so presence is only told to contacts
+
+A socket refreshes its entry every PRESENCE_TTL / 3 seconds, so sockets on
+a node that dies stop counting as online within PRESENCE_TTL. The same
+entries cap how many sockets a user may hold open (MAX_SOCKETS_PER_USER).
+
+Socket liveness: the server pings every HEARTBEAT_INTERVAL seconds and
+closes sockets that sent nothing, not even a pong, for HEARTBEAT_TIMEOUT
+seconds, and, when IDLE_TIMEOUT is set, sockets whose client sent nothing
+but pongs for that long.
+"""
+import asyncio
+import threading
+import time
+import weakref
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+
+PRESENCE_TTL = getattr(settings, 'CHAT_PRESENCE_TTL', 60)
+TYPING_TTL = getattr(settings, 'CHAT_TYPING_TTL', 6)
+LAST_SEEN_TTL = 30 * 24 * 60 * 60
+CONTACTS_TTL = getattr(settings, 'CHAT_PRESENCE_CONTACTS_TTL', 24 * 60 * 60)
+
+HEARTBEAT_INTERVAL = getattr(settings, 'CHAT_HEARTBEAT_INTERVAL', 25)
+HEARTBEAT_TIMEOUT = getattr(settings, 'CHAT_HEARTBEAT_TIMEOUT', 60)
+IDLE_TIMEOUT = getattr(settings, 'CHAT_IDLE_TIMEOUT', 0)
+MAX_SOCKETS_PER_USER = getattr(settings, 'CHAT_MAX_SOCKETS_PER_USER', 10)
+
+
+def presence_key(user_id):
+    return f'chat:presence:{user_id}'
+
+
+def last_seen_key(user_id):
+    return f'chat:last_seen:{user_id}'
+
+
+def typing_key(room_id, user_id):
+    return f'chat:typing:{room_id}:{user_id}'
+
+
+def contacts_key(user_id):
+    return f'chat:contacts:{user_id}'
+
+
+# Member of every stored contact set, so users without contacts have a set too
+NO_CONTACT = 0
+
+
+def format_last_seen(value):
+    """ISO 8601 timestamp for a stored unix time"""
+    if value is None:
+        return None
+    return datetime.fromtimestamp(float(value), tz=dt_timezone.utc).isoformat()
+
+
+class RedisPresenceStore:
+    """Presence kept in Redis, shared by every process using the same channel layer"""
+
+    def __init__(self, url):
+        self.url = url
+        self._sync_client = None
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    @property
+    def sync_client(self):
+        if self._sync_client is None:
+            import redis
+            self._sync_client = redis.Redis.from_url(self.url)
+        return self._sync_client
+
+    @property
+    def async_client(self):
+        # redis.asyncio connections belong to the loop that opened them
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            import redis.asyncio
+            client = redis.asyncio.Redis.from_url(self.url)
+            self._async_clients[loop] = client
+        return client
+
+    async def add_connection(self, user_id, channel_name):
+        """Register a socket. Returns the user's number of open sockets, this one included."""
+        now = time.time()
+        key = presence_key(user_id)
+        async with self.async_client.pipeline(transaction=True) as pipe:
+            pipe.zremrangebyscore(key, '-inf', now)
+            pipe.zadd(key, {channel_name: now + PRESENCE_TTL})
+            pipe.zcard(key)
+            pipe.expire(key, PRESENCE_TTL)
+            _, _, count, _ = await pipe.execute()
+        return count
+
+    async def refresh_connection(self, user_id, channel_name):
+        key = presence_key(user_id)
+        async with self.async_client.pipeline(transaction=True) as pipe:
+            pipe.zadd(key, {channel_name: time.time() + PRESENCE_TTL})
+            pipe.expire(key, PRESENCE_TTL)
+            await pipe.execute()
+
+    async def remove_connection(self, user_id, channel_name):
+        """Unregister a socket. Returns True if the user went offline."""
+        now = time.time()
+        key = presence_key(user_id)
+        async with self.async_client.pipeline(transaction=True) as pipe:
+            pipe.zrem(key, channel_name)
+            pipe.zremrangebyscore(key, '-inf', now)
+            pipe.zcard(key)
+            _, _, count = await pipe.execute()
+        if count:
+            return False
+        await self.async_client.set(last_seen_key(user_id), now, ex=LAST_SEEN_TTL)
+        return True
+
+    async def set_typing(self, room_id, user_id, typing):
+        """Start or stop typing. Returns True if the state changed."""
+        key = typing_key(room_id, user_id)
+        client = self.async_client
+        if not typing:
+            return bool(await client.delete(key))
+        if await client.set(key, 1, ex=TYPING_TTL, nx=True):
+            return True
+        await client.expire(key, TYPING_TTL)
+        return False
+
+    def get_presence(self, user_ids):
+        """{user_id: {'online', 'last_seen'}} for many users in one round trip"""
+        now = time.time()
+        with self.sync_client.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.zcount(presence_key(user_id), now, '+inf')
+                pipe.get(last_seen_key(user_id))
+            results = pipe.execute()
+        return {
+            user_id: {
+                'online': online > 0,
+                'last_seen': None if online else format_last_seen(last_seen),
+            }
+            for user_id, online, last_seen in zip(user_ids, results[::2], results[1::2])
+        }
+
+    def set_contacts(self, user_id, contact_ids):
+        """Record the ids of everyone the user chats with"""
+        key = contacts_key(user_id)
+        with self.sync_client.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            pipe.sadd(key, NO_CONTACT, *contact_ids)
+            pipe.expire(key, CONTACTS_TTL)
+            pipe.execute()
+
+    def get_contacts(self, user_id):
+        """The user's recorded contact ids, or None if none are recorded"""
+        members = self.sync_client.smembers(contacts_key(user_id))
+        if not members:
+            return None
+        return {int(member) for member in members} - {NO_CONTACT}
+
+    def forget_contacts(self, user_ids):
+        """Drop recorded contacts, e.g. when the users start a conversation"""
+        self.sync_client.delete(*(contacts_key(user_id) for user_id in user_ids))
+
+
+class InMemoryPresenceStore:
+    """Process-local stand-in with the same semantics, for the in-memory channel layer"""
+
+    def __init__(self):
+        self._connections = {}
+        self._last_seen = {}
+        self._typing = {}
+        self._contacts = {}
+        self._lock = threading.Lock()
+
+    def _live(self, user_id, now):
+        sockets = self._connections.get(user_id, {})
+        for channel_name, expires in list(sockets.items()):
+            if expires <= now:
+                del sockets[channel_name]
+        return sockets
+
+    async def add_connection(self, user_id, channel_name):
+        now = time.time()
+        with self._lock:
+            sockets = self._live(user_id, now)
+            sockets[channel_name] = now + PRESENCE_TTL
+            self._connections[user_id] = sockets
+            return len(sockets)
+
+    async def refresh_connection(self, user_id, channel_name):
+        with self._lock:
+            self._connections.setdefault(user_id, {})[channel_name] = time.time() + PRESENCE_TTL
+
+    async def remove_connection(self, user_id, channel_name):
+        now = time.time()
+        with self._lock:
+            sockets = self._live(user_id, now)
+            sockets.pop(channel_name, None)
+            if sockets:
+                return False
+            self._connections.pop(user_id, None)
+            self._last_seen[user_id] = now
+            return True
+
+    async def set_typing(self, room_id, user_id, typing):
+        key = (room_id, user_id)
+        now = time.time()
+        with self._lock:
+            was_typing = self._typing.get(key, 0) > now
+            if typing:
+                self._typing[key] = now + TYPING_TTL
+            else:
+                self._typing.pop(key, None)
+            return was_typing != typing
+
+    def get_presence(self, user_ids):
+        now = time.time()
+        with self._lock:
+            presence = {}
+            for user_id in user_ids:
+                online = bool(self._live(user_id, now))
+                presence[user_id] = {
+                    'online': online,
+                    'last_seen': None if online else format_last_seen(self._last_seen.get(user_id)),
+                }
+            return presence
+
+    def set_contacts(self, user_id, contact_ids):
+        with self._lock:
+            self._contacts[user_id] = (set(contact_ids), time.time() + CONTACTS_TTL)
+
+    def get_contacts(self, user_id):
+        with self._lock:
+            contacts, expires = self._contacts.get(user_id, (None, 0))
+            return set(contacts) if expires > time.time() else None
+
+    def forget_contacts(self, user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._contacts.pop(user_id, None)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def channel_layer_redis_url():
+    """Redis URL of the default channel layer, or None if it is not Redis-backed"""
+    layer = settings.CHANNEL_LAYERS.get('default', {})
+    if 'channels_redis' not in layer.get('BACKEND', ''):
+        return None
+    host = layer.get('CONFIG', {}).get('hosts', ['redis://localhost:6379/0'])[0]
+    if isinstance(host, dict):
+        host = host.get('address')
+    if isinstance(host, (list, tuple)):
+        host = f'redis://{host[0]}:{host[1]}/0'
+    return host
+
+
+def get_presence_store():
+    """The presence store matching the configured channel layer"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            url = channel_layer_redis_url()
+            _store = RedisPresenceStore(url) if url else InMemoryPresenceStore()
+        return _store
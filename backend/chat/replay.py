@@ -0,0 +1,178 @@
+"""
+Bounded per-room replay buffer of recent chat events.
+
+Every published message, edit and delete is appended to its room's buffer
+(the newest REPLAY_BUFFER_SIZE events, kept for REPLAY_BUFFER_TTL seconds).
+A socket resyncing from message <since> replays the buffer without touching
+the database when the buffer still holds that message; otherwise it falls
+back to load_missed_events().
+
+Like chat.presence, the buffer lives in the channel layer's Redis
+(key chat:replay:<room_id>) or in process memory with the in-memory layer.
+"""
+import asyncio
+import json
+import threading
+import weakref
+from collections import deque
+
+from django.conf import settings
+
+from .presence import channel_layer_redis_url
+
+REPLAY_BUFFER_SIZE = getattr(settings, 'CHAT_REPLAY_BUFFER_SIZE', 200)
+REPLAY_BUFFER_TTL = getattr(settings, 'CHAT_REPLAY_BUFFER_TTL', 15 * 60)
+
+# Most messages a database resync sends before telling the client to refetch
+RESYNC_LIMIT = 500
+
+MESSAGE_EVENT = 'message'
+EDIT_EVENT = 'edited'
+DELETE_EVENT = 'deleted'
+
+
+def replay_key(room_id):
+    return f'chat:replay:{room_id}'
+
+
+def replay_entry(event, message_id, message=None):
+    """
+    A buffered event: a new or edited message carries its payload
+    (MessagePayload.to_dict()), a delete only the id.
+    """
+    return {'event': event, 'id': message_id, 'message': message}
+
+
+def events_after(entries, since_id):
+    """
+    The buffered events that followed message `since_id`, or None if the
+    buffer no longer reaches back to it.
+    """
+    for index, entry in enumerate(entries):
+        if entry['event'] == MESSAGE_EVENT and entry['id'] == since_id:
+            return entries[index + 1:]
+    return None
+
+
+class RedisReplayBuffer:
+    """Replay buffer kept in Redis, shared by every process"""
+
+    def __init__(self, url):
+        self.url = url
+        self._sync_client = None
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    @property
+    def sync_client(self):
+        if self._sync_client is None:
+            import redis
+            self._sync_client = redis.Redis.from_url(self.url)
+        return self._sync_client
+
+    @property
+    def async_client(self):
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            import redis.asyncio
+            client = redis.asyncio.Redis.from_url(self.url)
+            self._async_clients[loop] = client
+        return client
+
+    def _queue_append(self, pipe, room_id, entry):
+        key = replay_key(room_id)
+        pipe.rpush(key, json.dumps(entry))
+        pipe.ltrim(key, -REPLAY_BUFFER_SIZE, -1)
+        pipe.expire(key, REPLAY_BUFFER_TTL)
+
+    def append(self, room_id, entry):
+        with self.sync_client.pipeline(transaction=True) as pipe:
+            self._queue_append(pipe, room_id, entry)
+            pipe.execute()
+
+    async def aappend(self, room_id, entry):
+        async with self.async_client.pipeline(transaction=True) as pipe:
+            self._queue_append(pipe, room_id, entry)
+            await pipe.execute()
+
+    async def aread(self, room_id):
+        raw = await self.async_client.lrange(replay_key(room_id), 0, -1)
+        return [json.loads(item) for item in raw]
+
+
+class InMemoryReplayBuffer:
+    """Process-local stand-in for the in-memory channel layer (no expiry)"""
+
+    def __init__(self):
+        self._rooms = {}
+        self._lock = threading.Lock()
+
+    def append(self, room_id, entry):
+        with self._lock:
+            buffer = self._rooms.setdefault(room_id, deque(maxlen=REPLAY_BUFFER_SIZE))
+            buffer.append(entry)
+
+    async def aappend(self, room_id, entry):
+        self.append(room_id, entry)
+
+    async def aread(self, room_id):
+        with self._lock:
+            return list(self._rooms.get(room_id, ()))
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_replay_buffer():
+    """The replay buffer matching the configured channel layer"""
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            url = channel_layer_redis_url()
+            _buffer = RedisReplayBuffer(url) if url else InMemoryReplayBuffer()
+        return _buffer
+
+
+def load_missed_events(room, since_id, limit=RESYNC_LIMIT):
+    """
+    Everything a client holding messages up to `since_id` missed in a room,
+    from indexed range queries:
+    - messages after `since_id` (oldest first, at most `limit`),
+    - edits to older messages and deletes of older messages made since
+      message `since_id` was sent.
+
+    Returns:
+        tuple: (list of replay entries, whether new messages were truncated)
+    """
+    from .models import Message, MessageTombstone
+    from .events import MessagePayload
+
+    messages = Message.objects.in_room(room)
+    since_timestamp = (
+        messages.filter(pk__lte=since_id).order_by('-id').values_list('timestamp', flat=True).first()
+    )
+
+    related = ('sender', 'room', 'reply_to__sender', 'property')
+    new_messages = list(
+        messages.filter(pk__gt=since_id).with_related(*related).order_by('timestamp', 'id')[:limit + 1]
+    )
+    truncated = len(new_messages) > limit
+    new_messages = new_messages[:limit]
+
+    tombstones = MessageTombstone.objects.in_room(room).filter(message_id__lte=since_id)
+    if since_timestamp is None:
+        # Every message the client had has been deleted
+        edited = []
+    else:
+        edited = list(
+            messages.filter(pk__lte=since_id, edited_at__gt=since_timestamp)
+            .with_related(*related).order_by('edited_at')
+        )
+        tombstones = tombstones.filter(deleted_at__gt=since_timestamp)
+    deleted_ids = list(tombstones.order_by('deleted_at').values_list('message_id', flat=True))
+
+    entries = [replay_entry(EDIT_EVENT, m.id, MessagePayload.from_message(m).to_dict()) for m in edited]
+    entries += [replay_entry(DELETE_EVENT, message_id) for message_id in deleted_ids]
+    entries += [replay_entry(MESSAGE_EVENT, m.id, MessagePayload.from_message(m).to_dict()) for m in new_messages]
+    return entries, truncated
@@ -0,0 +1,226 @@
+"""
+Landlord first-response statistics.
+
+A conversation counts once: as an inquiry when the tenant writes first,
+and as answered when the landlord first writes after that. Conversations
+the landlord opened are not counted. The room records both moments
+(ChatRoom.inquiry_at, ChatRoom.first_response_at), so only a room's first
+tenant message and first landlord message cost anything beyond the usual
+room summary update; the rest are recognised from the room already loaded.
+
+Each answered inquiry adds its first-response time to a histogram on the
+landlord (CustomUser.response_time_histogram, counts per RESPONSE_TIME_BUCKETS
+bucket), from which the median and p90 are re-estimated and stored next to
+the inquiry and response counts. Estimates interpolate within a bucket, so
+they are clamped to the fastest and slowest times seen (also stored): a
+landlord who always answers within seconds is not shown minutes. Profiles
+and listing cards read those columns from the user row they already load.
+
+rebuild_response_stats recomputes everything from message history.
+"""
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F, Min
+
+from .archive import load_segment
+from .models import ChatRoom, Message
+from .sharding import message_databases
+
+User = get_user_model()
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+# Upper bounds (seconds) of the histogram buckets; a last bucket holds the rest
+RESPONSE_TIME_BUCKETS = (
+    5 * MINUTE, 15 * MINUTE, 30 * MINUTE, HOUR, 2 * HOUR, 4 * HOUR,
+    8 * HOUR, 12 * HOUR, DAY, 2 * DAY, 3 * DAY, 7 * DAY,
+)
+
+
+def bucket_for(seconds):
+    for index, upper in enumerate(RESPONSE_TIME_BUCKETS):
+        if seconds <= upper:
+            return index
+    return len(RESPONSE_TIME_BUCKETS)
+
+
+def histogram_quantile(histogram, quantile, fastest=None, slowest=None):
+    """
+    Estimate a quantile (0-1) of the response times counted in `histogram`,
+    interpolating within its bucket and clamped to the fastest and slowest
+    times observed, if given. None for an empty histogram.
+    """
+    total = sum(histogram)
+    if not total:
+        return None
+    estimate = _interpolate(histogram, quantile * total)
+    if fastest is not None:
+        estimate = max(estimate, fastest)
+    if slowest is not None:
+        estimate = min(estimate, slowest)
+    return estimate
+
+
+def _interpolate(histogram, rank):
+    seen = lower = 0
+    for index, count in enumerate(histogram):
+        if count and seen + count >= rank:
+            if index == len(RESPONSE_TIME_BUCKETS):
+                # Unbounded: the best estimate is where it starts
+                return lower
+            upper = RESPONSE_TIME_BUCKETS[index]
+            return round(lower + (upper - lower) * (rank - seen) / count)
+        seen += count
+        if index < len(RESPONSE_TIME_BUCKETS):
+            lower = RESPONSE_TIME_BUCKETS[index]
+    return lower
+
+
+def summarize(histogram, fastest=None, slowest=None):
+    """The stored fields for a landlord with `histogram` and observed bounds"""
+    return {
+        'response_time_histogram': histogram,
+        'fastest_response_seconds': fastest,
+        'slowest_response_seconds': slowest,
+        'median_response_seconds': histogram_quantile(histogram, 0.5, fastest, slowest),
+        'p90_response_seconds': histogram_quantile(histogram, 0.9, fastest, slowest),
+    }
+
+
+def _observe(seconds, fastest, slowest):
+    """The observed bounds after one more response time"""
+    seconds = round(seconds)
+    return (
+        seconds if fastest is None else min(fastest, seconds),
+        seconds if slowest is None else max(slowest, seconds),
+    )
+
+
+def record_response(landlord_id, seconds):
+    """Count one answered inquiry, first answered after `seconds`"""
+    seconds = max(seconds, 0)
+    with transaction.atomic():
+        stats = User.objects.select_for_update().filter(pk=landlord_id).values_list(
+            'response_time_histogram', 'fastest_response_seconds', 'slowest_response_seconds'
+        ).first()
+        if stats is None:
+            return
+        histogram, fastest, slowest = stats
+        histogram = histogram + [0] * (len(RESPONSE_TIME_BUCKETS) + 1 - len(histogram))
+        histogram[bucket_for(seconds)] += 1
+        User.objects.filter(pk=landlord_id).update(
+            response_count=F('response_count') + 1,
+            **summarize(histogram, *_observe(seconds, fastest, slowest))
+        )
+
+
+def record_message(message):
+    """
+    Update the first-response bookkeeping for a new message. Cheap for
+    every message but a room's first from each participant.
+    """
+    room = message.room
+    if room.first_response_at is not None:
+        # The landlord has written already; nothing left to record
+        return
+    rooms = ChatRoom.objects.filter(pk=room.pk, first_response_at__isnull=True)
+
+    if message.sender_id == room.landlord_id:
+        # Conditional, so only one of concurrent first replies is counted
+        answered = rooms.update(first_response_at=message.timestamp)
+        room.first_response_at = message.timestamp
+        if answered:
+            inquiry_at = ChatRoom.objects.filter(pk=room.pk).values_list('inquiry_at', flat=True).first()
+            if inquiry_at is not None:
+                record_response(room.landlord_id, (message.timestamp - inquiry_at).total_seconds())
+
+    elif room.inquiry_at is None:
+        opened = rooms.filter(inquiry_at__isnull=True).update(inquiry_at=message.timestamp)
+        room.inquiry_at = message.timestamp
+        if opened:
+            User.objects.filter(pk=room.landlord_id).update(inquiry_count=F('inquiry_count') + 1)
+
+
+# Rebuilding from history
+
+def first_messages(room_ids):
+    """
+    {room id: {sender id: timestamp of their first message}} over the
+    message table and archive segments of the given rooms
+    """
+    firsts = {room_id: {} for room_id in room_ids}
+    for database in message_databases():
+        rows = Message.objects.using(database).filter(
+            room_id__in=room_ids
+        ).values('room_id', 'sender_id').annotate(first=Min('timestamp'))
+        for row in rows:
+            current = firsts[row['room_id']].get(row['sender_id'])
+            if current is None or row['first'] < current:
+                firsts[row['room_id']][row['sender_id']] = row['first']
+
+    # Segments hold a room's oldest messages, so the oldest segment that
+    # has a participant's messages has their first one
+    for room in ChatRoom.objects.filter(pk__in=room_ids):
+        found = {}
+        participants = {room.landlord_id, room.tenant_id}
+        for segment in room.message_segments.order_by('first_timestamp', 'first_message_id').iterator():
+            for record in load_segment(segment):
+                found.setdefault(record['sender'], record['timestamp'])
+            if participants <= set(found):
+                break
+        for sender_id, timestamp in found.items():
+            current = firsts[room.pk].get(sender_id)
+            if current is None or timestamp < current:
+                firsts[room.pk][sender_id] = timestamp
+    return firsts
+
+
+def rebuild(batch_size=500):
+    """
+    Recompute every room's bookkeeping and every landlord's statistics from
+    message history. Returns the number of rooms processed.
+    """
+    stats = {}
+    rooms = ChatRoom.objects.order_by('pk').only('pk', 'landlord_id', 'tenant_id')
+    processed = 0
+    last_pk = 0
+    while True:
+        batch = list(rooms.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            break
+        last_pk = batch[-1].pk
+        firsts = first_messages([room.pk for room in batch])
+
+        for room in batch:
+            tenant_first = firsts[room.pk].get(room.tenant_id)
+            landlord_first = firsts[room.pk].get(room.landlord_id)
+            room.inquiry_at = tenant_first if tenant_first and (not landlord_first or tenant_first <= landlord_first) else None
+            room.first_response_at = landlord_first
+
+            landlord = stats.setdefault(room.landlord_id, {
+                'inquiries': 0, 'responses': 0, 'histogram': [0] * (len(RESPONSE_TIME_BUCKETS) + 1),
+                'fastest': None, 'slowest': None,
+            })
+            if room.inquiry_at is not None:
+                landlord['inquiries'] += 1
+                if landlord_first is not None:
+                    seconds = (landlord_first - room.inquiry_at).total_seconds()
+                    landlord['responses'] += 1
+                    landlord['histogram'][bucket_for(seconds)] += 1
+                    landlord['fastest'], landlord['slowest'] = _observe(seconds, landlord['fastest'], landlord['slowest'])
+
+        ChatRoom.objects.bulk_update(batch, ['inquiry_at', 'first_response_at'])
+        processed += len(batch)
+
+    with transaction.atomic():
+        User.objects.filter(role=User.UserRole.LANDLORD).update(
+            inquiry_count=0, response_count=0, **summarize([])
+        )
+        for landlord_id, landlord in stats.items():
+            User.objects.filter(pk=landlord_id).update(
+                inquiry_count=landlord['inquiries'],
+                response_count=landlord['responses'],
+                **summarize(landlord['histogram'], landlord['fastest'], landlord['slowest'])
+            )
+    return processed
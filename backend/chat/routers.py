@@ -0,0 +1,49 @@
+"""
+Database router for sharded chat messages (see chat.sharding).
+
+Message, MessageTombstone and MessageSegment rows go to their room's
+database; every other model stays on 'default'. Every database gets the
+full schema, so messages keep one set of migrations wherever they live.
+"""
+from django.db import DEFAULT_DB_ALIAS
+
+SHARDED_MODELS = {'chat.message', 'chat.messagetombstone', 'chat.messagesegment'}
+
+
+def is_sharded(model):
+    return model._meta.label_lower in SHARDED_MODELS
+
+
+class ChatShardRouter:
+
+    def _db_for(self, model, **hints):
+        if not is_sharded(model):
+            return DEFAULT_DB_ALIAS
+
+        instance = hints.get('instance')
+        if instance is None:
+            # Querysets without a room; room-level ones use in_room()
+            return None
+        if is_sharded(type(instance)):
+            if instance._state.db is not None:
+                return instance._state.db
+            room_id = getattr(instance, 'room_id', None)
+        elif instance._meta.label_lower == 'chat.chatroom':
+            # A room's related managers: room.messages, room.message_segments, ...
+            room_id = instance.pk
+        else:
+            return None
+        if room_id is None:
+            return None
+
+        from .sharding import shard_for_room
+        return shard_for_room(room_id)
+
+    db_for_read = _db_for
+    db_for_write = _db_for
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Sharded rows point at rooms, users and properties on 'default'
+        if is_sharded(type(obj1)) or is_sharded(type(obj2)):
+            return True
+        return None
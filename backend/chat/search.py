@@ -0,0 +1,213 @@
+"""
+Full-text search over a user's chat history.
+
+Message.content is indexed by the database itself, so the index never
+lags behind writes (including write-behind batches):
+- PostgreSQL: a GIN expression index on to_tsvector(SEARCH_CONFIG, content)
+  (SEARCH_INDEX), ranked with ts_rank and highlighted with ts_headline.
+- SQLite: an FTS5 table (SEARCH_TABLE) over chat_message, kept in step by
+  triggers, ranked with bm25() and highlighted with snippet().
+
+Ranking is bounded: only the newest SEARCH_CANDIDATES matches in the user's
+rooms, by (timestamp, id), are ranked, so a common word in a long history
+costs at most that many rank computations. Older matches beyond them are
+not returned. On PostgreSQL the candidate query is a LIMIT over the match
+filter and room filter (EXPLAIN shows a Limit over either a bitmap scan of
+SEARCH_INDEX or a backward scan of the (room, timestamp, id) index,
+whichever the planner estimates cheaper), and ts_rank runs in the outer
+query on the candidate ids only.
+
+Both are created by migration 0010_message_search. Results are limited to
+rooms the user belongs to. Snippets are HTML-escaped with the matched
+terms wrapped in <mark>.
+
+Archived messages (chat.archive) have left the table and so the index;
+search covers the unarchived history only, and responses say how far back
+the archive reaches (archived_until).
+"""
+import heapq
+import html
+import re
+
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, SearchVector
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Max, Q
+from django.db.models.expressions import RawSQL
+
+from .models import ChatRoom, Message, MessageSegment
+from .sharding import sharding_enabled
+
+SEARCH_CONFIG = 'english'
+SEARCH_INDEX = 'chat_message_search'
+SEARCH_TABLE = 'chat_message_fts'
+
+# Placed around matches by the database, replaced after escaping
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_STOP = '\x03'
+SNIPPET_WORDS = 16
+
+# Newest matches ranked per search (and per shard)
+SEARCH_CANDIDATES = getattr(settings, 'CHAT_SEARCH_CANDIDATES', 1000)
+
+_words = re.compile(r'\w+')
+
+
+def search_vector():
+    """The indexed expression; searches must use it unchanged to hit the index"""
+    return SearchVector('content', config=SEARCH_CONFIG)
+
+
+def fts5_query(text):
+    """
+    Every word of `text` as a quoted FTS5 string, so operators and stray
+    punctuation in user input are matched literally. Returns '' if there
+    are no words.
+    """
+    return ' '.join(f'"{word}"' for word in _words.findall(text))
+
+
+def highlight(snippet):
+    """Escape a snippet and turn the database's match markers into <mark> tags"""
+    return (
+        html.escape(snippet or '')
+        .replace(HIGHLIGHT_START, '<mark>')
+        .replace(HIGHLIGHT_STOP, '</mark>')
+    )
+
+
+def _rooms_by_database(user, room_id=None):
+    """
+    {database: rooms} for `user`'s rooms (or room `room_id` only): a
+    queryset on 'default', or lists of room ids with sharded messages
+    """
+    rooms = ChatRoom.objects.filter(Q(landlord=user) | Q(tenant=user))
+    if room_id is not None:
+        rooms = rooms.filter(pk=room_id)
+    
+    if not sharding_enabled():
+        return {DEFAULT_DB_ALIAS: rooms}
+    
+    room_ids_by_database = {}
+    for pk, shard in rooms.values_list('pk', 'shard'):
+        room_ids_by_database.setdefault(shard or DEFAULT_DB_ALIAS, []).append(pk)
+    return room_ids_by_database
+
+
+def search_messages(user, text, room_id=None):
+    """
+    Messages in `user`'s rooms (or in room `room_id` only) matching `text`,
+    best match first, annotated with `rank` and a marked-up `snippet`
+    (pass it through highlight() before display). Archived messages are
+    not searched; see archived_until().
+    
+    With sharded messages (chat.sharding) each shard holding some of the
+    rooms is searched and the results merged (ShardedResults).
+    """
+    results = [
+        _search(Message.objects.using(database).filter(room__in=rooms), text, database)
+        for database, rooms in _rooms_by_database(user, room_id).items()
+    ]
+    if not results:
+        return Message.objects.none()
+    if len(results) == 1:
+        return results[0]
+    return ShardedResults(results)
+
+
+def archived_until(user, room_id=None):
+    """
+    Timestamp of the newest archived message in the rooms search_messages
+    would search, or None if none of their messages are archived. Older
+    history in those rooms has moved to archive segments (chat.archive),
+    which search does not cover.
+    """
+    newest = [
+        MessageSegment.objects.using(database).filter(room__in=rooms).aggregate(
+            newest=Max('last_timestamp')
+        )['newest']
+        for database, rooms in _rooms_by_database(user, room_id).items()
+    ]
+    return max((timestamp for timestamp in newest if timestamp is not None), default=None)
+
+
+def _search(messages, text, database):
+    """
+    The newest SEARCH_CANDIDATES of `messages` matching `text` on
+    `database`, ranked and with snippets
+    """
+    vendor = connections[database].vendor
+    
+    if vendor == 'postgresql':
+        query = SearchQuery(text, config=SEARCH_CONFIG, search_type='websearch')
+        candidates = messages.annotate(
+            document=search_vector(),
+        ).filter(
+            document=query,
+        )
+        annotations = {
+            'rank': SearchRank(search_vector(), query),
+            'snippet': SearchHeadline(
+                'content', query,
+                config=SEARCH_CONFIG,
+                start_sel=HIGHLIGHT_START,
+                stop_sel=HIGHLIGHT_STOP,
+                max_words=SNIPPET_WORDS,
+                min_words=SNIPPET_WORDS // 2,
+            ),
+        }
+    
+    elif vendor == 'sqlite':
+        match = fts5_query(text)
+        if not match:
+            return messages.none()
+        table = Message._meta.db_table
+        # bm25() and snippet() only work inside the MATCH query, hence the correlated subqueries
+        matching = f'FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s'
+        candidates = messages.filter(id__in=RawSQL(f'SELECT rowid {matching}', [match]))
+        annotations = {
+            'rank': RawSQL(f'SELECT -bm25({SEARCH_TABLE}) {matching} AND rowid = "{table}"."id"', [match]),
+            'snippet': RawSQL(
+                f"SELECT snippet({SEARCH_TABLE}, 0, %s, %s, '…', %s) {matching} AND rowid = \"{table}\".\"id\"",
+                [HIGHLIGHT_START, HIGHLIGHT_STOP, SNIPPET_WORDS, match]
+            ),
+        }
+    
+    else:
+        raise ImproperlyConfigured(
+            f"Chat search is not supported on the '{vendor}' database backend"
+        )
+    
+    newest = candidates.order_by('-timestamp', '-id').values('id')[:SEARCH_CANDIDATES]
+    return Message.objects.using(database).filter(
+        id__in=newest,
+    ).with_related('sender').annotate(**annotations).order_by('-rank', '-timestamp', '-id')
+
+
+def _result_key(message):
+    return (-message.rank, -message.timestamp.timestamp(), -message.id)
+
+
+class ShardedResults:
+    """
+    Search results from several shards, merged best match first. Offers what
+    pagination needs: count() and slicing, which reads up to the end of the
+    slice from every shard. Ranks are computed per shard, so ordering across
+    shards is approximate.
+    """
+    
+    def __init__(self, querysets):
+        self.querysets = querysets
+    
+    def count(self):
+        return sum(queryset.count() for queryset in self.querysets)
+    
+    def __len__(self):
+        return self.count()
+    
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        merged = heapq.merge(*(queryset[:index.stop] for queryset in self.querysets), key=_result_key)
+        return list(merged)[index]
@@ -1,28 +1,72 @@
 from rest_framework import serializers
+from django.contrib.auth import get_user_model
+from properties.uploads import confirm_upload
+from .events import PropertyInfo
 from .models import ChatRoom, Message
-from accounts.serializers import UserSerializer
-from properties.serializers import PropertyListSerializer
+from .search import highlight
+
+User = get_user_model()
+
+
+class ReplyToField(serializers.PrimaryKeyRelatedField):
+    """
+    A message in the same room, looked up on the room's database
+    (chat.sharding): the `room` in the serializer context, or the room of
+    the message being edited.
+    """
+    
+    def get_queryset(self):
+        instance = self.root.instance
+        room = self.context.get('room') or getattr(instance, 'room_id', None)
+        if room is None:
+            return Message.objects.all()
+        return Message.objects.in_room(room)
 
 
 class MessageSerializer(serializers.ModelSerializer):
     """Serializer for chat messages"""
     
     sender_name = serializers.SerializerMethodField()
+    is_read = serializers.BooleanField(source='is_read_by_recipient', read_only=True)
+    reply_to = ReplyToField(required=False, allow_null=True)
     reply_to_info = serializers.SerializerMethodField()
     property_details = serializers.SerializerMethodField()
+    attachment_key = serializers.CharField(
+        max_length=255,
+        required=False,
+        write_only=True,
+        help_text="Key of an attachment uploaded directly to storage"
+    )
     
     class Meta:
         model = Message
         fields = [
             'id', 'sender', 'sender_name', 'content', 'is_read', 
-            'timestamp', 'reply_to', 'reply_to_info', 'attachment',
-            'property', 'property_details'
+            'timestamp', 'edited_at', 'reply_to', 'reply_to_info', 'attachment',
+            'attachment_key', 'property', 'property_details', 'client_id'
         ]
-        read_only_fields = ['id', 'sender', 'timestamp', 'reply_to_info', 'property_details']
+        read_only_fields = ['id', 'sender', 'is_read', 'timestamp', 'edited_at', 'reply_to_info', 'property_details']
     
     def get_sender_name(self, obj):
         return f"{obj.sender.first_name} {obj.sender.last_name}".strip() or obj.sender.username
 
+    def validate(self, attrs):
+        key = attrs.pop('attachment_key', None)
+        if key:
+            if attrs.get('attachment'):
+                raise serializers.ValidationError({'attachment_key': 'Send either an attachment or an attachment_key.'})
+            try:
+                confirm_upload(self.context['request'].user, 'chat_attachment', key)
+            except serializers.ValidationError as error:
+                raise serializers.ValidationError({'attachment_key': error.detail})
+            attrs['attachment'] = key
+        return attrs
+
+    def update(self, instance, validated_data):
+        # A message keeps the client id it was sent with
+        validated_data.pop('client_id', None)
+        return super().update(instance, validated_data)
+
     def get_reply_to_info(self, obj):
         if obj.reply_to:
             return {
@@ -34,30 +78,47 @@ class MessageSerializer(serializers.ModelSerializer):
 
     def get_property_details(self, obj):
         if obj.property:
-            # Use the same logic as PropertyListSerializer to get cover image
-            cover = obj.property.images.filter(is_cover=True).first()
-            image_url = None
-            if cover:
-                image_url = cover.image_url
-            else:
-                first_image = obj.property.images.first()
-                if first_image:
-                    image_url = first_image.image_url
-                    
-            return {
-                'id': obj.property.id,
-                'title': obj.property.title,
-                'cover_image': image_url
-            }
+            return PropertyInfo.from_property(obj.property).to_dict()
         return None
 
 
+class MessageSearchResultSerializer(serializers.ModelSerializer):
+    """A chat message matching a search, with its highlighted snippet"""
+    
+    sender_name = serializers.SerializerMethodField()
+    snippet = serializers.SerializerMethodField()
+    rank = serializers.FloatField(read_only=True)
+    
+    class Meta:
+        model = Message
+        fields = ['id', 'room', 'sender', 'sender_name', 'snippet', 'rank', 'timestamp', 'edited_at']
+        read_only_fields = fields
+    
+    def get_sender_name(self, obj):
+        return f"{obj.sender.first_name} {obj.sender.last_name}".strip() or obj.sender.username
+    
+    def get_snippet(self, obj):
+        return highlight(obj.snippet)
+
+
+class ChatParticipantSerializer(serializers.ModelSerializer):
+    """Compact user info shown in the conversation list"""
+    
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'first_name', 'last_name', 'avatar', 'role']
+
+
 class ChatRoomSerializer(serializers.ModelSerializer):
-    """Serializer for chat rooms"""
+    """
+    Serializer for chat rooms.
+    Built entirely from the room row, its participants and the property's
+    prefetched images, using the summary fields kept up to date by chat.signals.
+    """
     
-    landlord = UserSerializer(read_only=True)
-    tenant = UserSerializer(read_only=True)
-    property = PropertyListSerializer(read_only=True)
+    landlord = ChatParticipantSerializer(read_only=True)
+    tenant = ChatParticipantSerializer(read_only=True)
+    property = serializers.SerializerMethodField()
     last_message = serializers.SerializerMethodField()
     unread_count = serializers.SerializerMethodField()
     
@@ -69,10 +130,24 @@ class ChatRoomSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'created_at', 'updated_at']
     
+    def get_property(self, obj):
+        if not obj.property:
+            return None
+        images = list(obj.property.images.all())
+        cover = next((img for img in images if img.is_cover), None) or (images[0] if images else None)
+        return {
+            'id': obj.property.id,
+            'title': obj.property.title,
+            'cover_image': cover.image_url if cover else None
+        }
+    
     def get_last_message(self, obj):
-        last_message = obj.messages.order_by('-timestamp').first()
-        if last_message:
-            return MessageSerializer(last_message).data
+        if obj.last_message_id:
+            return {
+                'id': obj.last_message_id,
+                'content': obj.last_message_preview,
+                'timestamp': serializers.DateTimeField().to_representation(obj.last_message_at)
+            }
         return None
     
     def get_unread_count(self, obj):
@@ -0,0 +1,250 @@
+"""
+Sharding of chat messages across databases.
+
+With CHAT_SHARDS set to a list of database aliases, each room's messages,
+tombstones and archive segments live on one of them, recorded in
+ChatRoom.shard; rooms, users and everything else stay on 'default'
+(chat.routers.ChatShardRouter). New rooms are placed by consistent hashing
+of their id onto CHAT_SHARDS (HashRing), so adding a shard only changes the
+placement of about 1/N of the rooms. rebalance_chat_shards moves existing
+rooms to where the ring places them now. Rooms created before sharding was
+enabled keep their messages on 'default' until they are rebalanced.
+
+Joins cannot cross databases, so:
+- room-level queries go through Message.objects.in_room(room) (or the
+  related managers of a room), which picks the room's database;
+- relations to rooms, users and properties are prefetched rather than
+  joined (MessageQuerySet.with_related);
+- message ids are reserved from 'default' (chat.batcher.reserve_message_ids),
+  so they are unique across shards and survive moves between them.
+
+Without CHAT_SHARDS everything is on 'default' and nothing here costs a query.
+"""
+import bisect
+import hashlib
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from .models import ChatRoom, Message, MessageSegment, MessageTombstone
+
+# Points per shard on the ring; more points spread rooms more evenly
+VIRTUAL_NODES = 64
+# How long a process trusts a room's cached placement (see rebalance_chat_shards)
+PLACEMENT_CACHE_TIMEOUT = getattr(settings, 'CHAT_SHARD_PLACEMENT_CACHE_TIMEOUT', 60)
+MOVE_BATCH_SIZE = 1000
+# Message fields that can change after a message is sent
+MESSAGE_SYNC_FIELDS = ('content', 'edited_at', 'attachment', 'property_id', 'reply_to_id')
+
+
+def get_shards():
+    return list(getattr(settings, 'CHAT_SHARDS', ()))
+
+
+def sharding_enabled():
+    return bool(getattr(settings, 'CHAT_SHARDS', ()))
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.md5(str(value).encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent hashing of keys onto nodes, with VIRTUAL_NODES points per node"""
+
+    def __init__(self, nodes, virtual_nodes=VIRTUAL_NODES):
+        if not nodes:
+            raise ValueError('A hash ring needs at least one node')
+        points = sorted(
+            (_hash(f'{node}#{index}'), node)
+            for node in nodes
+            for index in range(virtual_nodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node_for(self, key):
+        """The node owning `key`: the first point clockwise from its hash"""
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._nodes[index]
+
+
+@lru_cache(maxsize=8)
+def _ring(shards):
+    return HashRing(shards)
+
+
+def ring_shard(room_id):
+    """The shard the ring places room `room_id` on"""
+    return _ring(tuple(get_shards())).node_for(room_id)
+
+
+def message_databases():
+    """Every database that may hold messages: 'default' and the shards"""
+    return list(dict.fromkeys([DEFAULT_DB_ALIAS, *get_shards()]))
+
+
+# Placement
+
+def placement_cache_key(room_id):
+    return f'chat:shard:{room_id}'
+
+
+def shard_for_room(room):
+    """
+    The database holding a room's messages. `room` is a ChatRoom or its id;
+    the placement is read through the cache rather than from the instance,
+    as long-lived instances (e.g. a socket's rooms) miss rebalancing.
+    """
+    if not sharding_enabled():
+        return DEFAULT_DB_ALIAS
+    room_id = getattr(room, 'pk', room)
+    key = placement_cache_key(room_id)
+    shard = cache.get(key)
+    if shard is None:
+        shard = ChatRoom.objects.filter(pk=room_id).values_list('shard', flat=True).first() or DEFAULT_DB_ALIAS
+        cache.set(key, shard, PLACEMENT_CACHE_TIMEOUT)
+    return shard
+
+
+def place_rooms(rooms):
+    """Give new rooms their shard on the ring (a no-op without CHAT_SHARDS)"""
+    if not sharding_enabled():
+        return
+    for room in rooms:
+        room.shard = ring_shard(room.pk)
+    ChatRoom.objects.bulk_update(rooms, ['shard'])
+    cache.set_many({placement_cache_key(room.pk): room.shard for room in rooms}, PLACEMENT_CACHE_TIMEOUT)
+
+
+def message_database(pk):
+    """The database holding message `pk`, for lookups without a room"""
+    databases = message_databases()
+    if len(databases) > 1:
+        for database in databases:
+            if Message.objects.using(database).filter(pk=pk).exists():
+                return database
+    return DEFAULT_DB_ALIAS
+
+
+# Moving rooms between shards
+
+def _row_key(row, fields):
+    return tuple(getattr(row, field) for field in fields)
+
+
+def _edited_later(row, current):
+    """Whether message `row` was edited after its copy `current`"""
+    return row.edited_at is not None and (current.edited_at is None or row.edited_at > current.edited_at)
+
+
+def _copy_rows(queryset, target, key_fields, skip=(), is_newer=None, update_fields=()):
+    """
+    Copy the rows of `queryset` missing on `target` (matched on `key_fields`),
+    except those whose key is in `skip`. Rows both have are only refreshed
+    (`update_fields`) where `is_newer(row, copy)`, so changes made on `target`
+    since an earlier copy win. Returns the number of rows copied.
+    """
+    model = queryset.model
+    target_rows = model.objects.using(target)
+    copied = 0
+    last_pk = 0
+    while True:
+        rows = list(queryset.filter(pk__gt=last_pk).order_by('pk')[:MOVE_BATCH_SIZE])
+        if not rows:
+            return copied
+        last_pk = rows[-1].pk
+
+        existing = {
+            _row_key(row, key_fields): row
+            for row in target_rows.filter(**{f'{key_fields[0]}__in': [getattr(row, key_fields[0]) for row in rows]})
+        }
+        missing, stale = [], []
+        for row in rows:
+            key = _row_key(row, key_fields)
+            current = existing.get(key)
+            if current is None:
+                if key not in skip:
+                    missing.append(row)
+            elif is_newer is not None and is_newer(row, current):
+                for field in update_fields:
+                    setattr(current, field, getattr(row, field))
+                stale.append(current)
+
+        if model is not Message:
+            # Only message ids are global; the target numbers other rows itself
+            for row in missing:
+                row.pk = None
+        target_rows.bulk_create(missing)
+        if stale:
+            target_rows.bulk_update(stale, list(update_fields))
+        copied += len(missing)
+
+
+def _gone_from(room_id, database, source):
+    """
+    Keys ((id,)) of a room's messages removed on `database` without
+    `source` knowing: deleted there (tombstoned), or archived into a
+    segment `source` does not have.
+    """
+    from .archive import load_segment
+    gone = set(
+        MessageTombstone.objects.using(database).filter(room_id=room_id).values_list('message_id', flat=True)
+    )
+    source_segments = set(MessageSegment.objects.using(source).filter(room_id=room_id).values_list('key', flat=True))
+    for segment in MessageSegment.objects.using(database).filter(room_id=room_id).exclude(key__in=source_segments):
+        gone.update(record['id'] for record in load_segment(segment))
+    return {(message_id,) for message_id in gone}
+
+
+def copy_room(room_id, source, target):
+    """
+    Bring `target` up to date with a room's rows on `source`: messages,
+    tombstones and archive segments. Safe to repeat, including after the
+    room has switched to `target`: messages deleted or archived on `target`
+    are not copied back and edits made there are kept, while deletions and
+    later edits on `source` are carried over. Returns the number of
+    messages copied.
+    """
+    messages = Message.objects.using(source).filter(room_id=room_id)
+    with transaction.atomic(using=target):
+        # Copied in id order, so a reply's target is copied before it
+        copied = _copy_rows(
+            messages, target, ('id',),
+            skip=_gone_from(room_id, target, source),
+            is_newer=_edited_later,
+            update_fields=MESSAGE_SYNC_FIELDS
+        )
+        _copy_rows(MessageTombstone.objects.using(source).filter(room_id=room_id), target, ('message_id',))
+        _copy_rows(MessageSegment.objects.using(source).filter(room_id=room_id), target, ('key',))
+
+        deleted = list(
+            MessageTombstone.objects.using(source).filter(room_id=room_id).values_list('message_id', flat=True)
+        )
+        target_messages = Message.objects.using(target).filter(room_id=room_id)
+        # What a regular delete's SET_NULL did to replies on `source`
+        target_messages.filter(reply_to_id__in=deleted).update(reply_to=None)
+        target_messages.filter(pk__in=deleted).delete_moved()
+    return copied
+
+
+def purge_room(room_id, database):
+    """
+    Remove a room's rows from `database` without running delete signals:
+    no tombstones or broadcasts, and archive files are left alone.
+    """
+    with transaction.atomic(using=database):
+        for model in (MessageSegment, MessageTombstone):
+            model.objects.using(database).filter(room_id=room_id).delete_moved()
+        messages = Message.objects.using(database).filter(room_id=room_id)
+        # Replies within the room would otherwise block deleting what they quote
+        messages.filter(reply_to__isnull=False).update(reply_to=None)
+        messages.delete_moved()
+
+
+def switch_room(room_id, shard):
+    """Point a room at `shard`; processes pick it up within PLACEMENT_CACHE_TIMEOUT"""
+    ChatRoom.objects.filter(pk=room_id).update(shard=shard)
+    cache.delete(placement_cache_key(room_id))
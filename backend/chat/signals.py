@@ -1,34 +1,182 @@
-from django.db.models.signals import post_save
+import logging
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.dispatch import receiver
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
-from .models import Message
-from .serializers import MessageSerializer
+from .broadcast import publish_delete, publish_edit, publish_message
+from .archive import delete_segment_file
+from .models import PREVIEW_LENGTH, ChatRoom, Message, MessageSegment, MessageTombstone
+from .presence import get_presence_store
+from .response_stats import record_message
+from .sharding import get_shards, place_rooms, purge_room, shard_for_room
+from properties.models import Property
+
+logger = logging.getLogger(__name__)
+
+
+def _recipient_unread_field(room, sender_id):
+    """Unread counter of the participant who did not send the message"""
+    return room.unread_field_for(room.other_participant_id(sender_id))
+
+
+@receiver(post_save, sender=Message)
+def update_room_summary(sender, instance, created, **kwargs):
+    """
+    Keep the room's last-message summary and unread counters in step
+    with its messages, using single UPDATE statements.
+    """
+    if getattr(instance, '_summary_applied', False):
+        # Write-behind batches update summaries per room (chat.batcher)
+        return
+    
+    rooms = ChatRoom.objects.filter(pk=instance.room_id)
+    
+    if created:
+        recipient_field = _recipient_unread_field(instance.room, instance.sender_id)
+        rooms.update(
+            last_message=instance,
+            last_message_preview=instance.content[:PREVIEW_LENGTH],
+            last_message_at=instance.timestamp,
+            updated_at=instance.timestamp,
+            **{recipient_field: F(recipient_field) + 1}
+        )
+    else:
+        # An edit of the latest message changes the preview
+        rooms.filter(last_message=instance).update(
+            last_message_preview=instance.content[:PREVIEW_LENGTH]
+        )
+
+
+def _is_cascade_delete(kwargs):
+    """True when a message is deleted because its room or sender was"""
+    origin = kwargs.get('origin')
+    return origin is not None and getattr(origin, 'model', type(origin)) is not Message
+
+
+@receiver(post_delete, sender=Message)
+def update_room_summary_on_delete(sender, instance, **kwargs):
+    """Undo a deleted message's contribution to the room summary"""
+    if _is_cascade_delete(kwargs):
+        # Cascade from a room or user delete; the summary goes with the room
+        return
+    
+    try:
+        room = ChatRoom.objects.only(
+            'landlord_id', 'tenant_id', 'last_message_id', 'landlord_last_read_id', 'tenant_last_read_id'
+        ).get(pk=instance.room_id)
+    except ChatRoom.DoesNotExist:
+        # The whole room is being deleted
+        return
+    
+    recipient_id = room.other_participant_id(instance.sender_id)
+    if instance.pk > getattr(room, room.last_read_field_for(recipient_id)):
+        # The message was still unread
+        recipient_field = _recipient_unread_field(room, instance.sender_id)
+        ChatRoom.objects.filter(pk=room.pk).update(
+            **{recipient_field: Greatest(F(recipient_field) - 1, Value(0))}
+        )
+    
+    # The FK is cleared when the latest message goes; fall back to the previous one
+    if room.last_message_id is None:
+        latest = Message.objects.using(kwargs['using']).filter(room_id=room.pk).order_by('-timestamp', '-id').first()
+        ChatRoom.objects.filter(pk=room.pk).update(
+            last_message=latest,
+            last_message_preview=latest.content[:PREVIEW_LENGTH] if latest else '',
+            last_message_at=latest.timestamp if latest else None
+        )
+
+
+@receiver(post_save, sender=Message)
+def update_response_stats(sender, instance, created, **kwargs):
+    """Landlord first-response statistics (see chat.response_stats)"""
+    if created:
+        record_message(instance)
+
 
 @receiver(post_save, sender=Message)
 def broadcast_chat_message(sender, instance, created, **kwargs):
     """
     Broadcast message to WebSocket room group when saved in DB.
-    This ensures messages created via API (like those with attachments)
-    are sent to real-time clients.
+    This is the only place new messages are published, so messages created
+    via the API and via the consumer reach real-time clients exactly once.
     """
     if created:
-        channel_layer = get_channel_layer()
-        room_group_name = f'chat_{instance.room.id}'
-        
-        # We need to serialise the message same as the consumer/serializer does
-        # Use MessageSerializer for consistency
-        serializer = MessageSerializer(instance)
-        message_data = serializer.data
-        
-        # Add extra fields that consumer might expect if any (currently it matches)
-        # Note: sender_id, sender_email etc are extra in consumer's response
-        # Let's enrich it to be safe or just use serializer data which is the truth
-        
-        async_to_sync(channel_layer.group_send)(
-            room_group_name,
-            {
-                'type': 'chat_message',
-                'message': message_data
-            }
-        )
+        publish_message(instance)
+    else:
+        publish_edit(instance)
+
+
+@receiver(post_delete, sender=Message)
+def broadcast_chat_message_delete(sender, instance, **kwargs):
+    """
+    Leave a tombstone for reconnecting clients (see chat.replay) and tell
+    connected ones that the message is gone.
+    """
+    if _is_cascade_delete(kwargs):
+        return
+    MessageTombstone.objects.using(kwargs['using']).create(room_id=instance.room_id, message_id=instance.pk)
+    publish_delete(instance.room, instance.pk, using=kwargs['using'])
+
+
+@receiver(post_delete, sender=MessageSegment)
+def delete_segment_file_on_delete(sender, instance, **kwargs):
+    """Remove an archive segment's file once its row is gone for good"""
+    transaction.on_commit(lambda: delete_segment_file(instance.backend, instance.key), using=kwargs['using'])
+
+
+@receiver(post_save, sender=ChatRoom)
+def place_new_room(sender, instance, created, **kwargs):
+    """Put a new room's messages on its shard (chat.sharding)"""
+    if created:
+        place_rooms([instance])
+
+
+def _forget_contacts_on_commit(room, using):
+    """
+    Drop the participants' recorded contacts (chat.presence) once the room
+    change commits. The room exists either way, so a presence store failure
+    is logged rather than raised into the request.
+    """
+    participants = (room.landlord_id, room.tenant_id)
+    
+    def forget():
+        try:
+            get_presence_store().forget_contacts(participants)
+        except Exception:
+            logger.exception('Could not forget the chat contacts of users %s', participants)
+    
+    transaction.on_commit(forget, using=using)
+
+
+@receiver(post_save, sender=ChatRoom)
+def forget_contacts_of_new_room(sender, instance, created, **kwargs):
+    """A new room makes its participants each other's contacts"""
+    if created:
+        _forget_contacts_on_commit(instance, kwargs['using'])
+
+
+@receiver(post_delete, sender=ChatRoom)
+def forget_contacts_of_deleted_room(sender, instance, **kwargs):
+    """A deleted room may end its participants' contact"""
+    _forget_contacts_on_commit(instance, kwargs['using'])
+
+
+@receiver(pre_delete, sender=ChatRoom)
+def purge_sharded_room(sender, instance, **kwargs):
+    """
+    Deletes only cascade within a database, so remove the rows a room keeps
+    on a shard here; its rows on 'default' cascade as usual.
+    """
+    shard = shard_for_room(instance)
+    if shard != DEFAULT_DB_ALIAS:
+        purge_room(instance.pk, shard)
+
+
+@receiver(pre_delete, sender=Property)
+def clear_sharded_message_properties(sender, instance, **kwargs):
+    """The SET_NULL of Message.property, on the shards Django's delete does not reach"""
+    for shard in get_shards():
+        if shard != DEFAULT_DB_ALIAS:
+            Message.objects.using(shard).filter(property_id=instance.pk).update(property=None)
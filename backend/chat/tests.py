@@ -1,3 +1,652 @@
-from django.test import TestCase
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from properties.storage import LOCAL_BACKEND
+
+from .archive import archive_room
+from .batcher import claim_client_id, persist_messages, release_client_ids
+from .consumers import DENIED_ROOM_TTL, UserChatConsumer, prepare_message
+from .models import ChatRoom, Message, MessageTombstone
+from .presence import InMemoryPresenceStore
+from .response_stats import (
+    DAY, MINUTE, RESPONSE_TIME_BUCKETS, bucket_for, histogram_quantile, rebuild, record_message
+)
+from .throttling import InMemoryRateLimiter
+from .search import ShardedResults, archived_until, search_messages
+from .sharding import copy_room, purge_room, ring_shard, switch_room
+
+User = get_user_model()
+
+# Database aliases added by homehive.settings_test
+SHARDS = ['chat_shard_test_1', 'chat_shard_test_2']
+SHARDS_CONFIGURED = set(SHARDS) <= set(settings.DATABASES)
+
+
+@skipUnless(SHARDS_CONFIGURED, 'needs the shard databases of homehive.settings_test')
+@override_settings(CHAT_SHARDS=SHARDS)
+class ChatShardingTests(TestCase):
+    """Chat messages spread over two local SQLite shards (chat.sharding)"""
+
+    databases = {'default', *SHARDS} if SHARDS_CONFIGURED else {'default'}
+
+    def setUp(self):
+        # Placements are cached by room id, and ids repeat between tests
+        cache.clear()
+        self.landlord = User.objects.create_user(
+            email='landlord@example.com', username='landlord', password='x', role='LANDLORD'
+        )
+        self.tenants = []
+
+    def create_room(self, shard=None):
+        """A new room, on `shard` if given (created until the ring puts one there)"""
+        while True:
+            tenant = User.objects.create_user(
+                email=f'tenant{len(self.tenants)}@example.com',
+                username=f'tenant{len(self.tenants)}',
+                password='x',
+                role='TENANT'
+            )
+            self.tenants.append(tenant)
+            room = ChatRoom.objects.create(landlord=self.landlord, tenant=tenant)
+            room.refresh_from_db()
+            if shard is None or room.shard == shard:
+                return room
+
+    def send(self, room, content, sender=None):
+        message, _ = Message.objects.create_once(room=room, sender=sender or room.tenant, content=content)
+        return message
+
+    def messages_on(self, database, room):
+        return Message.objects.using(database).filter(room_id=room.pk)
+
+    def test_new_rooms_are_placed_on_the_ring(self):
+        room = self.create_room()
+        self.assertEqual(room.shard, ring_shard(room.pk))
+
+    def test_messages_are_stored_and_read_on_the_room_shard(self):
+        room = self.create_room()
+        other = next(shard for shard in ['default', *SHARDS] if shard != room.shard)
+        message = self.send(room, 'hello')
+
+        self.assertEqual(message._state.db, room.shard)
+        self.assertTrue(self.messages_on(room.shard, room).filter(pk=message.pk).exists())
+        self.assertFalse(self.messages_on(other, room).exists())
+        self.assertEqual(list(Message.objects.in_room(room)), [message])
+
+        # A retry with the same client id finds the original on the shard
+        first, created = Message.objects.create_once(room=room, sender=room.tenant, content='hi', client_id='a')
+        again, created_again = Message.objects.create_once(room=room, sender=room.tenant, content='hi', client_id='a')
+        self.assertTrue(created)
+        self.assertFalse(created_again)
+        self.assertEqual(first.pk, again.pk)
+
+    def test_message_ids_are_unique_across_shards(self):
+        first = self.send(self.create_room(SHARDS[0]), 'one')
+        second = self.send(self.create_room(SHARDS[1]), 'two')
+        self.assertNotEqual(first.pk, second.pk)
+
+    def test_search_merges_results_from_every_shard(self):
+        first_room = self.create_room(SHARDS[0])
+        second_room = self.create_room(SHARDS[1])
+        older = self.send(first_room, 'apple pie', sender=self.landlord)
+        newer = self.send(second_room, 'apple tart', sender=self.landlord)
+        self.send(second_room, 'banana', sender=self.landlord)
+
+        results = search_messages(self.landlord, 'apple')
+        self.assertIsInstance(results, ShardedResults)
+        self.assertEqual(results.count(), 2)
+        self.assertEqual({message.pk for message in results[0:10]}, {older.pk, newer.pk})
+        self.assertEqual(len(results[1:2]), 1)
+
+        # One room is on one shard only
+        self.assertEqual([m.pk for m in search_messages(self.landlord, 'apple', room_id=first_room.pk)], [older.pk])
+        # Tenants only find their own conversations
+        self.assertEqual([m.pk for m in search_messages(first_room.tenant, 'apple')], [older.pk])
+
+    def test_deleting_a_room_purges_its_shard(self):
+        room = self.create_room()
+        self.send(room, 'one')
+        self.send(room, 'two').delete()
+        self.assertTrue(MessageTombstone.objects.using(room.shard).filter(room_id=room.pk).exists())
+
+        room.delete()
+        self.assertFalse(self.messages_on(room.shard, room).exists())
+        self.assertFalse(MessageTombstone.objects.using(room.shard).filter(room_id=room.pk).exists())
+
+    def test_events_are_published_when_the_shard_commits(self):
+        room = self.create_room()
+        with mock.patch('chat.broadcast._send_message') as send_message, \
+                mock.patch('chat.broadcast._send_delete') as send_delete:
+            with self.captureOnCommitCallbacks(using=room.shard, execute=True):
+                message = self.send(room, 'hi')
+                message.delete()
+                send_message.assert_not_called()
+            send_message.assert_called_once_with(message)
+            send_delete.assert_called_once()
+
+    def move_off_the_ring(self, room):
+        """Put a room on the shard the ring does not place it on"""
+        source = room.shard
+        wrong = next(shard for shard in SHARDS if shard != source)
+        copy_room(room.pk, source, wrong)
+        switch_room(room.pk, wrong)
+        purge_room(room.pk, source)
+        return wrong
+
+    def test_rebalance_moves_rooms_back_onto_the_ring(self):
+        room = self.create_room()
+        messages = [self.send(room, f'message {index}') for index in range(3)]
+        source = self.move_off_the_ring(room)
+
+        call_command('rebalance_chat_shards', no_wait=True, stdout=StringIO())
+
+        room.refresh_from_db()
+        self.assertEqual(room.shard, ring_shard(room.pk))
+        self.assertEqual(list(Message.objects.in_room(room).order_by('pk')), messages)
+        self.assertFalse(self.messages_on(source, room).exists())
+
+    def test_rebalance_keeps_changes_made_while_rooms_move(self):
+        room = self.create_room()
+        edited, deleted, kept = [self.send(room, f'message {index}') for index in range(3)]
+        source = self.move_off_the_ring(room)
+        target = ring_shard(room.pk)
+
+        def write_during_the_wait(seconds):
+            # Writers that already see the target...
+            message = Message.objects.in_room(room).get(pk=edited.pk)
+            message.content = 'edited after the switch'
+            message.edited_at = timezone.now()
+            message.save()
+            Message.objects.in_room(room).get(pk=deleted.pk).delete()
+            # ...and one whose cached placement still points at the source
+            Message.objects.using(source).create(room=room, sender=room.tenant, content='late')
+
+        with mock.patch('chat.management.commands.rebalance_chat_shards.time.sleep', side_effect=write_during_the_wait):
+            call_command('rebalance_chat_shards', stdout=StringIO())
+
+        messages = {message.pk: message for message in self.messages_on(target, room)}
+        self.assertEqual(messages[edited.pk].content, 'edited after the switch')
+        self.assertNotIn(deleted.pk, messages)
+        self.assertIn(kept.pk, messages)
+        self.assertEqual(sorted(m.content for m in messages.values()), ['edited after the switch', 'late', 'message 2'])
+        self.assertFalse(self.messages_on(source, room).exists())
+
+    def test_copy_carries_over_deletions_and_edits_on_the_source(self):
+        room = self.create_room()
+        edited, deleted = self.send(room, 'before'), self.send(room, 'doomed')
+        reply = Message.objects.create(room=room, sender=room.tenant, content='re', reply_to=deleted)
+        source = room.shard
+        target = next(shard for shard in SHARDS if shard != source)
+        copy_room(room.pk, source, target)
+
+        edited.content = 'after'
+        edited.edited_at = timezone.now()
+        edited.save()
+        deleted.delete()
+        copy_room(room.pk, source, target)
+
+        messages = {message.pk: message for message in self.messages_on(target, room)}
+        self.assertEqual(messages[edited.pk].content, 'after')
+        self.assertNotIn(deleted.pk, messages)
+        self.assertIsNone(messages[reply.pk].reply_to_id)
+
+
+class ChatSearchTests(TestCase):
+    """Only the newest SEARCH_CANDIDATES matches are ranked"""
+
+    def setUp(self):
+        self.landlord = User.objects.create_user(
+            email='landlord@example.com', username='landlord', password='x', role='LANDLORD'
+        )
+        self.tenant = User.objects.create_user(
+            email='tenant@example.com', username='tenant', password='x', role='TENANT'
+        )
+        self.room = ChatRoom.objects.create(landlord=self.landlord, tenant=self.tenant)
+        now = timezone.now()
+        self.messages = []
+        # The oldest match is the best one
+        for index, content in enumerate(['kitchen kitchen kitchen', 'kitchen sink', 'new kitchen', 'kitchen', 'garden']):
+            message = Message.objects.create(room=self.room, sender=self.tenant, content=content)
+            Message.objects.filter(pk=message.pk).update(timestamp=now - timedelta(days=5 - index))
+            self.messages.append(message)
+
+    def test_all_matches_are_ranked_within_the_bound(self):
+        results = search_messages(self.tenant, 'kitchen')
+        self.assertEqual(results.count(), 4)
+        self.assertEqual(results[0].pk, self.messages[0].pk)
+
+    def test_only_the_newest_matches_are_ranked(self):
+        with mock.patch('chat.search.SEARCH_CANDIDATES', 2):
+            results = search_messages(self.tenant, 'kitchen')
+            with CaptureQueriesContext(connection) as queries:
+                ranked = list(results)
+        self.assertEqual({message.pk for message in ranked}, {self.messages[2].pk, self.messages[3].pk})
+        # Ranks are computed in the outer query, over the limited candidate ids
+        sql = queries.captured_queries[0]['sql']
+        self.assertIn('bm25', sql)
+        self.assertIn('LIMIT 2', sql)
+
+
+class ChatArchiveSearchTests(TestCase):
+    """Search covers the unarchived history only, and says so"""
+
+    def setUp(self):
+        archive_root = tempfile.TemporaryDirectory()
+        self.addCleanup(archive_root.cleanup)
+        for patcher in (
+            mock.patch('chat.archive.ARCHIVE_ROOT', archive_root.name),
+            mock.patch('chat.archive.get_default_backend', return_value=LOCAL_BACKEND),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.landlord = User.objects.create_user(
+            email='landlord@example.com', username='landlord', password='x', role='LANDLORD'
+        )
+        self.tenant = User.objects.create_user(
+            email='tenant@example.com', username='tenant', password='x', role='TENANT'
+        )
+        self.room = ChatRoom.objects.create(landlord=self.landlord, tenant=self.tenant)
+        now = timezone.now()
+        for index in range(30):
+            message = Message.objects.create(room=self.room, sender=self.tenant, content=f'kitchen {index}')
+            Message.objects.filter(pk=message.pk).update(timestamp=now - timedelta(days=30 - index))
+
+    def test_archived_messages_are_reported_instead_of_searched(self):
+        self.assertIsNone(archived_until(self.tenant))
+
+        archived = archive_room(self.room, timezone.now() - timedelta(days=5, hours=12), segment_size=10)
+        self.assertEqual(archived, 25)
+        self.assertEqual(search_messages(self.tenant, 'kitchen').count(), 5)
+
+        newest_archived = timezone.now() - timedelta(days=6)
+        self.assertAlmostEqual(archived_until(self.tenant), newest_archived, delta=timedelta(minutes=1))
+        self.assertIsNone(archived_until(self.landlord, room_id=self.room.pk + 1))
+
+        client = APIClient()
+        client.force_authenticate(self.tenant)
+        response = client.get('/api/chat/messages/search/', {'q': 'kitchen'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 5)
+        self.assertAlmostEqual(response.data['archived_until'], newest_archived, delta=timedelta(minutes=1))
+
+
+class BulkPresenceTests(TestCase):
+    """Presence is only reported for the caller's chat contacts"""
+
+    def setUp(self):
+        self.store = InMemoryPresenceStore()
+        for target in ('chat.views.get_presence_store', 'chat.signals.get_presence_store'):
+            patcher = mock.patch(target, return_value=self.store)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.landlord = User.objects.create_user(
+            email='landlord@example.com', username='landlord', password='x', role='LANDLORD'
+        )
+        self.tenant = User.objects.create_user(
+            email='tenant@example.com', username='tenant', password='x', role='TENANT'
+        )
+        self.stranger = User.objects.create_user(
+            email='stranger@example.com', username='stranger', password='x', role='TENANT'
+        )
+        ChatRoom.objects.create(landlord=self.landlord, tenant=self.tenant)
+        for user in (self.tenant, self.stranger):
+            async_to_sync(self.store.add_connection)(user.id, f'socket-{user.id}')
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.landlord)
+
+    def get_presence(self, *users):
+        response = self.client.get('/api/chat/presence/', {'user_ids': ','.join(str(user.id) for user in users)})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_only_contacts_are_reported(self):
+        self.assertEqual(self.get_presence(self.tenant, self.stranger), {
+            str(self.tenant.id): {'online': True, 'last_seen': None},
+        })
+        self.assertEqual(self.store.get_contacts(self.landlord.id), {self.tenant.id})
+
+        # Recorded contacts answer without the database
+        with self.assertNumQueries(0):
+            self.assertEqual(list(self.get_presence(self.tenant, self.stranger)), [str(self.tenant.id)])
+
+    def test_new_conversations_add_contacts(self):
+        self.get_presence(self.stranger)
+        with self.captureOnCommitCallbacks(execute=True):
+            ChatRoom.objects.create(landlord=self.landlord, tenant=self.stranger)
+        self.assertIsNone(self.store.get_contacts(self.landlord.id))
+        self.assertEqual(list(self.get_presence(self.stranger)), [str(self.stranger.id)])
+
+    def test_deleted_conversations_forget_contacts(self):
+        self.get_presence(self.tenant)
+        with self.captureOnCommitCallbacks(execute=True):
+            ChatRoom.objects.get(landlord=self.landlord, tenant=self.tenant).delete()
+        self.assertEqual(self.get_presence(self.tenant), {})
+
+    def test_presence_store_failures_do_not_fail_room_changes(self):
+        with mock.patch.object(self.store, 'forget_contacts', side_effect=ConnectionError), \
+                self.assertLogs('chat.signals', 'ERROR'), \
+                self.captureOnCommitCallbacks(execute=True):
+            ChatRoom.objects.create(landlord=self.landlord, tenant=self.stranger)
+        self.assertTrue(ChatRoom.objects.filter(tenant=self.stranger).exists())
+
+
+class ResponseStatsTests(TestCase):
+    """Landlord first-response statistics (chat.response_stats)"""
+
+    def setUp(self):
+        self.landlord = User.objects.create_user(
+            email='landlord@example.com', username='landlord', password='x', role='LANDLORD'
+        )
+        self.tenants = []
+        self.start = timezone.now() - timedelta(days=1)
+
+    def create_room(self):
+        tenant = User.objects.create_user(
+            email=f'tenant{len(self.tenants)}@example.com',
+            username=f'tenant{len(self.tenants)}',
+            password='x',
+            role='TENANT'
+        )
+        self.tenants.append(tenant)
+        return ChatRoom.objects.create(landlord=self.landlord, tenant=tenant)
+
+    def send(self, room, sender, seconds):
+        """A message `seconds` after the test's start"""
+        return Message.objects.create(
+            room=room, sender=sender, content='hi', timestamp=self.start + timedelta(seconds=seconds)
+        )
+
+    def stats(self):
+        self.landlord.refresh_from_db()
+        return self.landlord.response_stats()
+
+    def test_bucket_for(self):
+        self.assertEqual(bucket_for(0), 0)
+        self.assertEqual(bucket_for(5 * MINUTE), 0)
+        self.assertEqual(bucket_for(5 * MINUTE + 1), 1)
+        self.assertEqual(bucket_for(7 * DAY), len(RESPONSE_TIME_BUCKETS) - 1)
+        self.assertEqual(bucket_for(30 * DAY), len(RESPONSE_TIME_BUCKETS))
+
+    def test_histogram_quantile(self):
+        self.assertIsNone(histogram_quantile([], 0.5))
+        self.assertIsNone(histogram_quantile([0, 0], 0.5))
+        # Interpolated within the bucket...
+        self.assertEqual(histogram_quantile([2], 0.5), 150)
+        self.assertEqual(histogram_quantile([1, 1], 0.9), 5 * MINUTE + round(0.8 * 10 * MINUTE))
+        # ...unless bounded by the times observed
+        self.assertEqual(histogram_quantile([1], 0.5, fastest=1, slowest=1), 1)
+        self.assertEqual(histogram_quantile([1, 1], 0.5, fastest=400, slowest=600), 400)
+        # Beyond the last bound, the estimate is where the open bucket starts
+        histogram = [0] * len(RESPONSE_TIME_BUCKETS) + [3]
+        self.assertEqual(histogram_quantile(histogram, 0.9), 7 * DAY)
+
+    def test_instant_replies_are_not_shown_as_minutes(self):
+        room = self.create_room()
+        self.send(room, room.tenant, 0)
+        self.send(room, self.landlord, 1)
+        self.send(room, self.landlord, 100)
+
+        self.assertEqual(self.stats(), {
+            'median_response_seconds': 1,
+            'p90_response_seconds': 1,
+            'response_rate': 1.0,
+            'inquiry_count': 1,
+        })
+
+    def test_conversations_the_landlord_opened_are_not_counted(self):
+        room = self.create_room()
+        self.send(room, self.landlord, 0)
+        self.send(room, room.tenant, 60)
+        self.send(room, self.landlord, 120)
+
+        room.refresh_from_db()
+        self.assertIsNone(room.inquiry_at)
+        self.assertEqual(self.stats()['inquiry_count'], 0)
+        self.assertIsNone(self.stats()['median_response_seconds'])
+
+    def test_unanswered_inquiries_lower_the_response_rate(self):
+        answered, unanswered = self.create_room(), self.create_room()
+        self.send(answered, answered.tenant, 0)
+        self.send(answered, self.landlord, 30)
+        self.send(unanswered, unanswered.tenant, 0)
+
+        self.assertEqual(self.stats()['response_rate'], 0.5)
+        self.assertEqual(self.stats()['inquiry_count'], 2)
+
+    def test_concurrent_first_replies_are_counted_once(self):
+        room = self.create_room()
+        self.send(room, room.tenant, 0)
+        # Two sockets loaded the room before either reply was recorded
+        first, second = ChatRoom.objects.get(pk=room.pk), ChatRoom.objects.get(pk=room.pk)
+        record_message(Message(room=first, sender=self.landlord, timestamp=self.start + timedelta(seconds=10)))
+        record_message(Message(room=second, sender=self.landlord, timestamp=self.start + timedelta(seconds=20)))
+
+        self.landlord.refresh_from_db()
+        self.assertEqual(self.landlord.response_count, 1)
+        self.assertEqual(self.landlord.median_response_seconds, 10)
+
+    def test_rebuild_recomputes_from_history(self):
+        fast, slow, opened = self.create_room(), self.create_room(), self.create_room()
+        self.send(fast, fast.tenant, 0)
+        self.send(fast, self.landlord, 2)
+        self.send(slow, slow.tenant, 0)
+        self.send(slow, self.landlord, 2 * DAY)
+        self.send(opened, self.landlord, 0)
+        self.send(opened, opened.tenant, 10)
+        expected = self.stats()
+
+        User.objects.filter(pk=self.landlord.pk).update(
+            inquiry_count=0, response_count=0, response_time_histogram=[],
+            median_response_seconds=None, p90_response_seconds=None
+        )
+        ChatRoom.objects.update(inquiry_at=None, first_response_at=None)
+
+        self.assertEqual(rebuild(batch_size=2), 3)
+        self.assertEqual(self.stats(), expected)
+        self.assertEqual(self.landlord.fastest_response_seconds, 2)
+        self.assertEqual(self.landlord.slowest_response_seconds, 2 * DAY)
+        self.assertEqual(expected['inquiry_count'], 2)
+        self.assertEqual(expected['p90_response_seconds'], round(1.8 * DAY))
+
+
+class InMemoryRateLimiterTests(SimpleTestCase):
+    """Idle buckets of the in-process rate limiter are evicted"""
+
+    def test_refilled_buckets_are_evicted(self):
+        clock = [1000.0]
+        with mock.patch('chat.throttling.time.monotonic', side_effect=lambda: clock[0]):
+            limiter = InMemoryRateLimiter()
+            take = async_to_sync(limiter.take)
+            for user_id in range(100):
+                self.assertEqual(take(f'idle:{user_id}', 1, 10, cost=5), 0)
+            self.assertEqual(take('busy', 0.1, 10, cost=10), 0)
+            self.assertEqual(len(limiter), 101)
+
+            # Idle buckets refill in 5s, 'busy' takes 100s
+            clock[0] += 5
+            self.assertEqual(take('busy', 0.1, 10, cost=0), 0)
+            self.assertEqual(len(limiter), 101)
+            clock[0] += limiter.SWEEP_INTERVAL
+            self.assertEqual(take('other', 1, 10), 0)
+            self.assertEqual(len(limiter), 2)
+
+            # An evicted bucket starts over full, as it would have been
+            self.assertEqual(take('idle:0', 1, 10, cost=10), 0)
+            self.assertGreater(take('busy', 0.1, 10, cost=10), 0)
+
+
+class RoomAccessTests(TestCase):
+    """The multiplexed socket checks unknown room ids one room at a time"""
+
+    def setUp(self):
+        self.landlord = User.objects.create_user(
+            email='landlord@example.com', username='landlord', password='x', role='LANDLORD'
+        )
+        self.tenant = User.objects.create_user(
+            email='tenant@example.com', username='tenant', password='x', role='TENANT'
+        )
+        self.stranger = User.objects.create_user(
+            email='stranger@example.com', username='stranger', password='x', role='LANDLORD'
+        )
+        self.consumer = UserChatConsumer()
+        self.consumer.user = self.tenant
+        self.consumer.rooms = {}
+        self.consumer.denied_rooms = {}
+
+    def has_access(self, room_id):
+        return async_to_sync(self.consumer.has_room_access)(room_id)
+
+    def test_new_rooms_are_loaded_alone(self):
+        room = ChatRoom.objects.create(landlord=self.landlord, tenant=self.tenant)
+        with self.assertNumQueries(1):
+            self.assertTrue(self.has_access(room.pk))
+        with self.assertNumQueries(0):
+            self.assertTrue(self.has_access(room.pk))
+        self.assertEqual(list(self.consumer.rooms), [room.pk])
+
+    def test_misses_are_remembered_briefly(self):
+        other = ChatRoom.objects.create(landlord=self.stranger, tenant=self.tenant)
+        foreign = ChatRoom.objects.create(
+            landlord=self.landlord,
+            tenant=User.objects.create_user(email='t2@example.com', username='t2', password='x', role='TENANT')
+        )
+        clock = [1000.0]
+        with mock.patch('chat.consumers.time.monotonic', side_effect=lambda: clock[0]):
+            with self.assertNumQueries(1):
+                self.assertFalse(self.has_access(foreign.pk))
+            with self.assertNumQueries(0):
+                for _ in range(10):
+                    self.assertFalse(self.has_access(foreign.pk))
+            clock[0] += DENIED_ROOM_TTL + 1
+            with self.assertNumQueries(1):
+                self.assertFalse(self.has_access(foreign.pk))
+        self.assertTrue(self.has_access(other.pk))
+
+
+class ClientIdTests(TestCase):
+    """Resending a message with the same client_id does not store it twice"""
+
+    def setUp(self):
+        cache.clear()
+        self.landlord = User.objects.create_user(
+            email='landlord@example.com', username='landlord', password='x', role='LANDLORD'
+        )
+        self.tenant = User.objects.create_user(
+            email='tenant@example.com', username='tenant', password='x', role='TENANT'
+        )
+        self.room = ChatRoom.objects.create(landlord=self.landlord, tenant=self.tenant)
+        self.client = APIClient()
+        self.client.force_authenticate(self.tenant)
+
+    def consumer(self):
+        consumer = UserChatConsumer()
+        consumer.user = self.tenant
+        consumer.channel_name = 'test.channel'
+        consumer.events = []
+
+        async def send_event(event):
+            consumer.events.append(event)
+
+        consumer.send_event = send_event
+        return consumer
+
+    def send(self, consumer, content, client_id):
+        with mock.patch('chat.consumers.take_user_message', mock.AsyncMock(return_value=0)):
+            async_to_sync(consumer.write_message)(self.room, content, client_id=client_id)
+        return consumer.events[-1]
+
+    def test_create_once(self):
+        first, created = Message.objects.create_once(room=self.room, sender=self.tenant, content='Hi', client_id='a')
+        self.assertTrue(created)
+        again, created = Message.objects.create_once(room=self.room, sender=self.tenant, content='Hi!', client_id='a')
+        self.assertFalse(created)
+        self.assertEqual(again.pk, first.pk)
+        self.assertEqual(again.content, 'Hi')
+
+        # Client ids are per sender, and messages without one are always new
+        _, created = Message.objects.create_once(room=self.room, sender=self.landlord, content='Hi', client_id='a')
+        self.assertTrue(created)
+        for _ in range(2):
+            _, created = Message.objects.create_once(room=self.room, sender=self.tenant, content='Hey')
+            self.assertTrue(created)
+        self.assertEqual(Message.objects.filter(room=self.room).count(), 4)
+
+    def test_rest_resend_returns_the_original(self):
+        url = f'/api/chat/rooms/{self.room.pk}/messages/send/'
+        first = self.client.post(url, {'content': 'Hi', 'client_id': 'a'}, format='json')
+        again = self.client.post(url, {'content': 'Hi', 'client_id': 'a'}, format='json')
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(again.status_code, 200)
+        self.assertEqual(again.data['id'], first.data['id'])
+        self.assertEqual(Message.objects.filter(room=self.room).count(), 1)
+
+        long_id = self.client.post(url, {'content': 'Hi', 'client_id': 'x' * 65}, format='json')
+        self.assertEqual(long_id.status_code, 400)
+
+    def test_socket_resend_is_acked_as_a_duplicate(self):
+        consumer = self.consumer()
+        first = self.send(consumer, 'Hi', 'a')
+        again = self.send(consumer, 'Hi', 'a')
+
+        self.assertEqual(first['type'], 'ack')
+        self.assertFalse(first['duplicate'])
+        self.assertTrue(again['duplicate'])
+        self.assertEqual((again['id'], again['timestamp']), (first['id'], first['timestamp']))
+        self.assertEqual(Message.objects.filter(room=self.room).count(), 1)
+
+        self.assertEqual(self.send(consumer, 'Hi', 1)['type'], 'error')
+
+    @override_settings(CHAT_WRITE_BEHIND=True)
+    def test_write_behind_resend_is_acked_while_queued_and_after_storing(self):
+        batcher = mock.Mock(add=mock.AsyncMock())
+        consumer = self.consumer()
+        with mock.patch('chat.consumers.get_batcher', return_value=batcher), \
+                mock.patch('chat.consumers.broadcast_message', mock.AsyncMock()) as broadcast:
+            first = self.send(consumer, 'Hi', 'a')
+            queued = self.send(consumer, 'Hi', 'a')
+
+            batcher.add.assert_called_once()
+            message = batcher.add.call_args.args[0]
+            self.assertEqual(first['id'], message.id)
+            self.assertFalse(first['duplicate'])
+            self.assertTrue(queued['duplicate'])
+            self.assertEqual(queued['id'], message.id)
+            broadcast.assert_called_once()
+
+            # Once stored, the message is found even without the claim
+            persist_messages([message])
+            cache.clear()
+            stored = self.send(consumer, 'Hi', 'a')
+
+        self.assertTrue(stored['duplicate'])
+        self.assertEqual(stored['id'], message.id)
+        batcher.add.assert_called_once()
+        self.assertEqual(Message.objects.filter(room=self.room).count(), 1)
+
+    def test_failed_messages_release_their_claim(self):
+        message, _ = prepare_message(self.room, self.tenant, 'Hi', client_id='a')
+        self.assertIsNone(claim_client_id(message))
+
+        resend, _ = prepare_message(self.room, self.tenant, 'Hi', client_id='a')
+        self.assertEqual(claim_client_id(resend), (message.id, message.timestamp))
+
+        async_to_sync(release_client_ids)([message])
+        self.assertIsNone(claim_client_id(resend))
@@ -0,0 +1,171 @@
+"""
+Rate limits and backpressure for chat sockets.
+
+Token buckets:
+- every frame a socket receives takes a token from the connection's own
+  bucket (CHAT_FRAME_RATE per second, bursts of CHAT_FRAME_BURST), checked
+  in process before the frame is decoded;
+- every message a user sends takes a token from the user's bucket
+  (CHAT_USER_MESSAGE_RATE / CHAT_USER_MESSAGE_BURST), shared by all of the
+  user's sockets on every node. Like chat.presence it lives in the channel
+  layer's Redis (key chat:ratelimit:<user_id>), or in process memory with
+  the in-memory channel layer.
+
+A socket throttled THROTTLE_CLOSE_AFTER times in a row is closed.
+
+Outbound frames wait in a queue of at most CHAT_SEND_QUEUE_SIZE frames per
+socket. When it is full, ephemeral frames (typing, presence) are dropped and
+anything else closes the socket; the client reconnects and resyncs.
+"""
+import asyncio
+import threading
+import time
+import weakref
+
+from django.conf import settings
+
+from .presence import channel_layer_redis_url
+
+FRAME_RATE = getattr(settings, 'CHAT_FRAME_RATE', 10)
+FRAME_BURST = getattr(settings, 'CHAT_FRAME_BURST', 30)
+USER_MESSAGE_RATE = getattr(settings, 'CHAT_USER_MESSAGE_RATE', 5)
+USER_MESSAGE_BURST = getattr(settings, 'CHAT_USER_MESSAGE_BURST', 15)
+SEND_QUEUE_SIZE = getattr(settings, 'CHAT_SEND_QUEUE_SIZE', 256)
+THROTTLE_CLOSE_AFTER = 50
+
+# Close codes
+CLOSE_POLICY_VIOLATION = 1008
+CLOSE_UNRESPONSIVE = 4001
+CLOSE_IDLE = 4002
+CLOSE_SLOW_CONSUMER = 4008
+CLOSE_TOO_MANY_SOCKETS = 4009
+
+
+def rate_limit_key(user_id):
+    return f'chat:ratelimit:{user_id}'
+
+
+class TokenBucket:
+    """In-process token bucket"""
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, cost=1):
+        """
+        Take `cost` tokens if the bucket holds them. Returns 0 when allowed,
+        otherwise the seconds until it would be.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0
+        return (cost - self.tokens) / self.rate
+
+    def is_full(self, now):
+        """Whether the bucket has refilled completely, so a new one would behave the same"""
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+# Refill and take atomically, timed by the Redis server so node clocks do not matter.
+# Returns the seconds to wait as a string (Lua numbers become integers in replies).
+TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+
+class RedisRateLimiter:
+    """Token buckets kept in Redis, shared by every process"""
+
+    def __init__(self, url):
+        self.url = url
+        self._scripts = weakref.WeakKeyDictionary()
+
+    @property
+    def take_script(self):
+        # redis.asyncio connections belong to the loop that opened them
+        loop = asyncio.get_running_loop()
+        script = self._scripts.get(loop)
+        if script is None:
+            import redis.asyncio
+            script = redis.asyncio.Redis.from_url(self.url).register_script(TAKE_SCRIPT)
+            self._scripts[loop] = script
+        return script
+
+    async def take(self, key, rate, burst, cost=1):
+        return float(await self.take_script(keys=[key], args=[rate, burst, cost]))
+
+
+class InMemoryRateLimiter:
+    """
+    Process-local stand-in for the in-memory channel layer. Buckets that
+    have refilled are dropped every SWEEP_INTERVAL seconds, as the Redis
+    keys expire, so idle users and rooms do not accumulate.
+    """
+    SWEEP_INTERVAL = 60
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._next_sweep = time.monotonic() + self.SWEEP_INTERVAL
+
+    def _sweep(self, now):
+        for key, bucket in list(self._buckets.items()):
+            if bucket.is_full(now):
+                del self._buckets[key]
+        self._next_sweep = now + self.SWEEP_INTERVAL
+
+    async def take(self, key, rate, burst, cost=1):
+        with self._lock:
+            now = time.monotonic()
+            if now >= self._next_sweep:
+                self._sweep(now)
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(rate, burst)
+            return bucket.take(cost)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """The rate limiter matching the configured channel layer"""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            url = channel_layer_redis_url()
+            _limiter = RedisRateLimiter(url) if url else InMemoryRateLimiter()
+        return _limiter
+
+
+async def take_user_message(user_id):
+    """Take a token from a user's message bucket; returns the seconds to wait, 0 if allowed"""
+    return await get_rate_limiter().take(rate_limit_key(user_id), USER_MESSAGE_RATE, USER_MESSAGE_BURST)
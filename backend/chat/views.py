@@ -1,14 +1,24 @@
 from rest_framework import generics, status
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
-from rest_framework.exceptions import PermissionDenied
-from django.db.models import Q
-from .models import ChatRoom, Message
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from django.db.models import Case, F, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+from .broadcast import publish_read, publish_room
+from .metrics import get_metrics
+from .models import CLIENT_ID_MAX_LENGTH, ChatRoom, Message, parse_client_id
+from .pagination import MessageKeysetPagination, MessageSearchPagination
+from .presence import get_presence_store
+from .search import archived_until, search_messages
+from .sharding import message_database
 from properties.models import Property
 from .serializers import (
     ChatRoomSerializer,
     ChatRoomCreateSerializer,
+    MessageSearchResultSerializer,
     MessageSerializer
 )
 
@@ -25,7 +35,7 @@ class ChatRoomListView(generics.ListAPIView):
         user = self.request.user
         return ChatRoom.objects.filter(
             Q(landlord=user) | Q(tenant=user)
-        ).select_related('landlord', 'tenant', 'property').prefetch_related('messages')
+        ).select_related('landlord', 'tenant', 'property').prefetch_related('property__images')
 
 
 @api_view(['POST'])
@@ -72,6 +82,9 @@ def create_or_get_chat_room(request):
         room.property = property_obj
         room.save()
     
+    if created:
+        publish_room(room)
+    
     return Response({
         'room': ChatRoomSerializer(room, context={'request': request}).data,
         'created': created
@@ -81,10 +94,12 @@ def create_or_get_chat_room(request):
 class ChatMessageListView(generics.ListCreateAPIView):
     """
     List messages for a specific chat room or send a new message.
-    Paginated with oldest first.
+    Returns the newest page first; pass before=<id> to load older history
+    or after=<id> to catch up on newer messages (see MessageKeysetPagination).
     """
     serializer_class = MessageSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = MessageKeysetPagination
     
     def get_queryset(self):
         room_id = self.kwargs['room_id']
@@ -98,7 +113,13 @@ class ChatMessageListView(generics.ListCreateAPIView):
         except ChatRoom.DoesNotExist:
             return Message.objects.none()
         
-        return Message.objects.filter(room_id=room_id).select_related('sender')
+        # Lets the paginator read through to archived segments
+        self.room = room
+        return Message.objects.in_room(room).with_related('sender', 'room', 'reply_to__sender', 'property')
+
+    def get_serializer_context(self):
+        # Replies are looked up in the room (see ReplyToField)
+        return {**super().get_serializer_context(), 'room': getattr(self, 'room', None)}
 
     def create(self, request, *args, **kwargs):
         room_id = self.kwargs['room_id']
@@ -118,27 +139,68 @@ class ChatMessageListView(generics.ListCreateAPIView):
                 status=status.HTTP_403_FORBIDDEN
             )
 
+        self.room = room
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         
-        # Save message
-        message = serializer.save(sender=user, room=room)
-        
-        # Update room's updated_at timestamp used for sorting conversations
-        room.save()
+        # Saving updates the room summary used for sorting conversations;
+        # a retry with the same client_id gets the original message back
+        message, created = Message.objects.create_once(sender=user, room=room, **serializer.validated_data)
+        serializer.instance = message
         
+        if not created:
+            return Response(serializer.data, status=status.HTTP_200_OK)
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
 
+class MessageSearchView(generics.ListAPIView):
+    """
+    Full-text search across the authenticated user's conversations:
+    ?q=<words>, optionally &room=<id> to search one conversation.
+    Ranked best match first and paginated with ?page= (see MessageSearchPagination).
+    Archived messages are not searched: `archived_until` in the response is
+    the newest archived message's timestamp in the searched rooms (or null).
+    """
+    serializer_class = MessageSearchResultSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = MessageSearchPagination
+    
+    def get_queryset(self):
+        text = self.request.query_params.get('q', '').strip()
+        if not text:
+            raise ValidationError({'q': 'Enter something to search for.'})
+        
+        room_id = self.request.query_params.get('room')
+        if room_id in (None, ''):
+            room_id = None
+        else:
+            try:
+                room_id = int(room_id)
+            except ValueError:
+                raise ValidationError({'room': 'Must be a chat room id.'})
+        
+        self.room_id = room_id
+        return search_messages(self.request.user, text, room_id=room_id)
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        response.data['archived_until'] = archived_until(request.user, room_id=self.room_id)
+        return response
+
+
 class ChatMessageDetailView(generics.RetrieveUpdateDestroyAPIView):
     """
     Retrieve, update or delete a chat message.
     Only the sender can update or delete their message.
     """
-    queryset = Message.objects.all()
     serializer_class = MessageSerializer
     permission_classes = [IsAuthenticated]
+    
+    def get_queryset(self):
+        # Looked up by id alone, so find the database holding it (chat.sharding)
+        database = message_database(self.kwargs['pk'])
+        return Message.objects.using(database).with_related('sender', 'room')
 
     def perform_destroy(self, instance):
         if instance.sender != self.request.user:
@@ -148,7 +210,8 @@ class ChatMessageDetailView(generics.RetrieveUpdateDestroyAPIView):
     def perform_update(self, serializer):
         if serializer.instance.sender != self.request.user:
             raise PermissionDenied("You can only edit your own messages.")
-        serializer.save()
+        # Recorded so reconnecting clients pick up the edit (chat.replay)
+        serializer.save(edited_at=timezone.now())
     
     def update(self, request, *args, **kwargs):
         """Custom update to check permissions explicitly if needed, but perform_update handles it."""
@@ -199,11 +262,17 @@ def mark_messages_read(request, room_id):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        # Mark messages as read (only messages not sent by this user)
-        Message.objects.filter(
-            room=room,
-            is_read=False
-        ).exclude(sender=user).update(is_read=True)
+        # Move the user's read watermark up to the latest message: one UPDATE
+        # on the room row regardless of how many messages were unread
+        last_read_field = room.last_read_field_for(user)
+        rooms = ChatRoom.objects.filter(pk=room.pk)
+        rooms.update(**{
+            last_read_field: Greatest(F(last_read_field), Coalesce(F('last_message_id'), Value(0))),
+            room.unread_field_for(user): 0
+        })
+        last_read_id = rooms.values_list(last_read_field, flat=True).first()
+        
+        publish_read(room, user, last_read_id)
         
         return Response({'message': 'Messages marked as read'}, status=status.HTTP_200_OK)
         
@@ -222,16 +291,75 @@ def unread_count(request):
     """
     user = request.user
     
-    # Count unread messages in all rooms where user is participant
-    # excludes messages sent by the user themselves
-    count = Message.objects.filter(
-        room__in=ChatRoom.objects.filter(Q(landlord=user) | Q(tenant=user)),
-        is_read=False
-    ).exclude(sender=user).count()
+    # Sum the per-participant unread counters kept on each room
+    landlord_total = ChatRoom.objects.filter(landlord=user).aggregate(
+        total=Sum('landlord_unread_count')
+    )['total'] or 0
+    tenant_total = ChatRoom.objects.filter(tenant=user).aggregate(
+        total=Sum('tenant_unread_count')
+    )['total'] or 0
+    count = landlord_total + tenant_total
     
     return Response({'count': count})
 
 
+# Upper bound on user ids per presence query
+MAX_PRESENCE_USERS = 100
+
+
+@api_view(['GET'])
+@authentication_classes([JWTStatelessUserAuthentication])
+@permission_classes([IsAuthenticated])
+def bulk_presence(request):
+    """
+    Online status and last-seen time for many users at once, e.g. every
+    participant in the conversation list: ?user_ids=1,2,3
+    
+    Only the caller's chat contacts are reported; other ids are left out.
+    Served from the presence store, where sockets record each user's
+    contacts; the token is validated without loading the user, so only a
+    caller without recorded contacts costs a database query.
+    """
+    raw_ids = request.query_params.get('user_ids', '')
+    try:
+        user_ids = list(dict.fromkeys(int(value) for value in raw_ids.split(',') if value.strip()))
+    except ValueError:
+        return Response(
+            {'error': 'user_ids must be a comma-separated list of integers'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if len(user_ids) > MAX_PRESENCE_USERS:
+        return Response(
+            {'error': f'At most {MAX_PRESENCE_USERS} user ids can be queried at once'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    store = get_presence_store()
+    caller_id = request.user.id
+    contacts = store.get_contacts(caller_id)
+    if contacts is None:
+        contacts = set(
+            ChatRoom.objects.filter(Q(landlord_id=caller_id) | Q(tenant_id=caller_id)).annotate(
+                contact_id=Case(When(landlord_id=caller_id, then=F('tenant_id')), default=F('landlord_id'))
+            ).values_list('contact_id', flat=True)
+        )
+        store.set_contacts(caller_id, contacts)
+    
+    presence = store.get_presence([user_id for user_id in user_ids if user_id in contacts])
+    return Response({str(user_id): state for user_id, state in presence.items()})
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def socket_metrics(request):
+    """
+    Chat socket health across every node: counters (throttled frames and
+    messages, dropped frames, closed sockets) and live sockets per node and
+    per room.
+    """
+    return Response(get_metrics())
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def send_message(request, room_id):
@@ -258,19 +386,26 @@ def send_message(request, room_id):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Create the message
-        message = Message.objects.create(
+        try:
+            client_id = parse_client_id(request.data.get('client_id'))
+        except ValueError:
+            return Response(
+                {'error': f'client_id must be a string of at most {CLIENT_ID_MAX_LENGTH} characters'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # Create the message (also updates the room summary); a retry with
+        # the same client_id gets the original message back
+        message, created = Message.objects.create_once(
+            client_id=client_id,
             room=room,
             sender=user,
             content=content
         )
         
-        # Update room's updated_at timestamp
-        room.save()
-        
         return Response(
             MessageSerializer(message).data,
-            status=status.HTTP_201_CREATED
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK
         )
         
     except ChatRoom.DoesNotExist:
@@ -0,0 +1,209 @@
+"""
+Media serving for local-storage mode.
+Replaces django.conf.urls.static.static with a view that understands
+byte-range requests and HTTP caching, so videos can seek without
+downloading the whole file and browsers can cache uploads aggressively.
+"""
+import mimetypes
+import os
+import re
+import stat
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    HttpResponseNotModified,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods, require_safe
+
+from properties.local_storage import UploadRejected, save_upload_local
+
+# Uploaded files are saved as <uuid4>.<ext> and never overwritten,
+# so their content never changes for a given path.
+CONTENT_ADDRESSED_NAME = re.compile(
+    r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\.[A-Za-z0-9]+$'
+)
+RANGE_HEADER = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'public, max-age=0, must-revalidate'
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def _make_etag(st):
+    """Strong ETag derived from modification time and size"""
+    return quote_etag(f"{int(st.st_mtime_ns):x}-{st.st_size:x}")
+
+
+def _etag_matches(header, etag):
+    """Check an If-None-Match / If-Range header against an ETag"""
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    candidates = [tag.strip() for tag in header.split(',')]
+    # Weak comparison is fine for GET/HEAD conditional requests
+    return etag in candidates or f"W/{etag}" in candidates
+
+
+def _parse_range(header, size):
+    """
+    Parse a single-range ``Range`` header.
+
+    Returns:
+        tuple: (start, end) inclusive byte offsets, None if the header should
+        be ignored, or False if the range is not satisfiable
+    """
+    match = RANGE_HEADER.match(header.strip())
+    if not match:
+        # Malformed or multi-range requests get the full content
+        return None
+
+    start, end = match.groups()
+    if start == '' and end == '':
+        return None
+
+    if start == '':
+        # Suffix range: the last N bytes
+        length = int(end)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+
+    start = int(start)
+    end = int(end) if end else size - 1
+    if start >= size or end < start:
+        return False
+    return start, min(end, size - 1)
+
+
+def _iter_range(path, start, length):
+    """Stream ``length`` bytes of a file starting at ``start``"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _cache_control(path):
+    if CONTENT_ADDRESSED_NAME.match(os.path.basename(path)):
+        return getattr(settings, 'MEDIA_IMMUTABLE_CACHE_CONTROL', IMMUTABLE_CACHE_CONTROL)
+    return REVALIDATE_CACHE_CONTROL
+
+
+@require_safe
+def serve_media(request, path, document_root=None):
+    """
+    Serve a file from MEDIA_ROOT with Range, ETag and Last-Modified support.
+
+    When MEDIA_ACCEL_REDIRECT is set (e.g. '/protected-media/'), the body is
+    handed off to the front-end proxy via X-Accel-Redirect so it can use
+    sendfile; otherwise full responses go through FileResponse, which lets
+    WSGI servers use wsgi.file_wrapper.
+    """
+    document_root = document_root or settings.MEDIA_ROOT
+    try:
+        full_path = safe_join(document_root, path)
+    except SuspiciousFileOperation:
+        raise Http404('Invalid media path')
+
+    try:
+        st = os.stat(full_path)
+    except OSError:
+        raise Http404('Media file not found')
+    if not stat.S_ISREG(st.st_mode):
+        raise Http404('Media file not found')
+
+    etag = _make_etag(st)
+    last_modified = http_date(st.st_mtime)
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+
+    def _apply_headers(response):
+        response['ETag'] = etag
+        response['Last-Modified'] = last_modified
+        response['Cache-Control'] = _cache_control(full_path)
+        response['Accept-Ranges'] = 'bytes'
+        return response
+
+    # Conditional GET: If-None-Match takes precedence over If-Modified-Since
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        if _etag_matches(if_none_match, etag):
+            return _apply_headers(HttpResponseNotModified())
+    else:
+        if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        if if_modified_since is not None and int(st.st_mtime) <= if_modified_since:
+            return _apply_headers(HttpResponseNotModified())
+
+    accel_prefix = getattr(settings, 'MEDIA_ACCEL_REDIRECT', None)
+    if accel_prefix:
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = f"{accel_prefix.rstrip('/')}/{path.lstrip('/')}"
+        return _apply_headers(response)
+
+    size = st.st_size
+    byte_range = None
+    range_header = request.META.get('HTTP_RANGE')
+    if range_header:
+        # Only honour the range if the client's copy is still current
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if not if_range or _etag_matches(if_range, etag) or if_range == last_modified:
+            byte_range = _parse_range(range_header, size)
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f"bytes */{size}"
+        return _apply_headers(response)
+
+    if byte_range is None or byte_range == (0, size - 1):
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+        response['Content-Length'] = str(size)
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(
+            _iter_range(full_path, start, length),
+            status=206,
+            content_type=content_type,
+        )
+        response['Content-Length'] = str(length)
+        response['Content-Range'] = f"bytes {start}-{end}/{size}"
+
+    if encoding:
+        response['Content-Encoding'] = encoding
+    return _apply_headers(response)
+
+
+@csrf_exempt
+@require_http_methods(['PUT'])
+def receive_upload(request, token):
+    """
+    Accept a direct upload to a URL issued by properties.storage.create_upload_url,
+    standing in for Supabase signed upload URLs in local-storage mode. The body
+    is streamed to disk; it is never buffered in memory.
+    """
+    try:
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0) or None
+    except ValueError:
+        return JsonResponse({'error': 'Invalid Content-Length'}, status=400)
+
+    try:
+        key = save_upload_local(token, request.content_type, content_length, request)
+    except UploadRejected as error:
+        return JsonResponse({'error': str(error)}, status=error.status)
+    return JsonResponse({'key': key}, status=201)
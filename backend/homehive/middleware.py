@@ -1,39 +1,60 @@
 from django.contrib.auth.models import AnonymousUser
 from channels.db import database_sync_to_async
 from channels.middleware import BaseMiddleware
-from django.db import close_old_connections
-from jwt import decode as jwt_decode
-from django.conf import settings
-from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
 from urllib.parse import parse_qs
+from accounts.principal import (
+    PRINCIPAL_CACHE_TTL,
+    build_user,
+    load_principal,
+    principal_cache_key,
+)
 
-User = get_user_model()
 
-@database_sync_to_async
-def get_user(token_key):
+async def get_user(token_key):
+    """
+    Resolve the user for a raw access token.
+
+    The token is validated by simplejwt's configured token classes (signature,
+    expiry, token type). The user is built from the cached principal, so the
+    database is only queried on a cache miss; other fields load lazily.
+    """
     try:
-        # Decode the access token
-        decoded_data = jwt_decode(token_key, settings.SECRET_KEY, algorithms=["HS256"])
-        user_id = decoded_data.get('user_id')
-        return User.objects.get(id=user_id)
-    except Exception as e:
+        validated_token = JWTStatelessUserAuthentication().get_validated_token(token_key)
+        user_id = validated_token[api_settings.USER_ID_CLAIM]
+    except (InvalidToken, KeyError):
         return AnonymousUser()
 
+    key = principal_cache_key(user_id)
+    values = await cache.aget(key)
+    if values is None:
+        values = await database_sync_to_async(load_principal)(user_id)
+        if values is None:
+            return AnonymousUser()
+        await cache.aset(key, values, PRINCIPAL_CACHE_TTL)
+
+    user = build_user(values)
+    if not user.is_active:
+        return AnonymousUser()
+    return user
+
+
 class TokenAuthMiddleware(BaseMiddleware):
     """
     Middleware to authenticate WebSocket connections using JWT token in query string.
     """
     async def __call__(self, scope, receive, send):
-        close_old_connections()
-        
         # Get query string
         query_string = scope.get('query_string', b'').decode()
         query_params = parse_qs(query_string)
         token = query_params.get('token', [None])[0]
-        
+
         if token:
             scope['user'] = await get_user(token)
         else:
             scope['user'] = AnonymousUser()
-            
+
         return await super().__call__(scope, receive, send)
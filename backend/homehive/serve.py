@@ -0,0 +1,39 @@
+"""
+Run daphne with permessage-deflate WebSocket compression.
+
+daphne does not expose autobahn's compression options, so this launcher
+swaps in a WebSocket factory that accepts permessage-deflate offers and
+then hands over to daphne's own command line:
+
+    python -m homehive.serve -b 0.0.0.0 -p 8000 homehive.asgi:application
+
+Clients that do not offer the extension are served uncompressed.
+"""
+from autobahn.websocket.compress import PerMessageDeflateOffer, PerMessageDeflateOfferAccept
+from daphne import server
+from daphne.cli import CommandLineInterface
+from daphne.ws_protocol import WebSocketFactory
+
+
+def accept_deflate(offers):
+    """Accept the first permessage-deflate offer a client makes"""
+    for offer in offers:
+        if isinstance(offer, PerMessageDeflateOffer):
+            return PerMessageDeflateOfferAccept(offer)
+    return None
+
+
+class CompressingWebSocketFactory(WebSocketFactory):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.setProtocolOptions(perMessageCompressionAccept=accept_deflate)
+
+
+def main():
+    server.WebSocketFactory = CompressingWebSocketFactory
+    CommandLineInterface.entrypoint()
+
+
+if __name__ == '__main__':
+    main()
@@ -93,6 +93,18 @@ DATABASES = {
     )
 }
 
+# Chat message shards (see chat/sharding.py)
+# Each URL becomes a database alias chat_shard_<n>; rooms' messages are
+# spread across them by consistent hashing of the room id. Only ever append
+# URLs (and run rebalance_chat_shards): rooms record their shard's alias.
+CHAT_SHARDS = []
+for index, url in enumerate(config('CHAT_SHARD_DATABASE_URLS', default='', cast=Csv()), start=1):
+    alias = f'chat_shard_{index}'
+    DATABASES[alias] = dj_database_url.parse(url, conn_max_age=600, conn_health_checks=True)
+    CHAT_SHARDS.append(alias)
+CHAT_SHARD_PLACEMENT_CACHE_TIMEOUT = config('CHAT_SHARD_PLACEMENT_CACHE_TIMEOUT', default=60, cast=int)
+DATABASE_ROUTERS = ['chat.routers.ChatShardRouter']
+
 # Channels Layer (Redis)
 CHANNEL_LAYERS = {
     'default': {
@@ -103,6 +115,24 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Cache
+# Point CACHE_URL at Redis (e.g. redis://localhost:6379/1) in multi-node
+# deployments so cached WebSocket principals are invalidated everywhere.
+CACHE_URL = config('CACHE_URL', default='')
+if CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
+
 # Custom User Model
 AUTH_USER_MODEL = 'accounts.CustomUser'
 
@@ -221,3 +251,54 @@ SOCIALACCOUNT_ADAPTER = 'accounts.adapters.CustomSocialAccountAdapter'
 SUPABASE_URL = config('SUPABASE_URL', default='')
 SUPABASE_KEY = config('SUPABASE_KEY', default='')
 SUPABASE_SERVICE_KEY = config('SUPABASE_SERVICE_KEY', default='')
+
+# Local media serving (see homehive/media.py)
+# Set to a proxy-internal location (e.g. '/protected-media/') to let nginx
+# stream files with sendfile via X-Accel-Redirect.
+MEDIA_ACCEL_REDIRECT = config('MEDIA_ACCEL_REDIRECT', default='')
+
+# Direct uploads (see properties/uploads.py): lifetime of signed upload URLs
+# issued by the local stand-in, in seconds
+UPLOAD_URL_TTL = config('UPLOAD_URL_TTL', default=900, cast=int)
+
+# Write-behind chat persistence (see chat/batcher.py)
+# When enabled, WebSocket messages are acknowledged and broadcast at once
+# and inserted in batches every FLUSH_INTERVAL_MS or FLUSH_SIZE messages.
+CHAT_WRITE_BEHIND = config('CHAT_WRITE_BEHIND', default=False, cast=bool)
+CHAT_WRITE_BEHIND_FLUSH_SIZE = config('CHAT_WRITE_BEHIND_FLUSH_SIZE', default=200, cast=int)
+CHAT_WRITE_BEHIND_FLUSH_INTERVAL_MS = config('CHAT_WRITE_BEHIND_FLUSH_INTERVAL_MS', default=10, cast=int)
+CHAT_WRITE_BEHIND_MAX_PENDING = config('CHAT_WRITE_BEHIND_MAX_PENDING', default=5000, cast=int)
+CHAT_WRITE_BEHIND_ID_BLOCK_SIZE = config('CHAT_WRITE_BEHIND_ID_BLOCK_SIZE', default=1, cast=int)
+
+# Chat socket rate limits and backpressure (see chat/throttling.py)
+# Frames per second per socket, messages per second per user (across all
+# nodes), and the most outbound frames a socket may have waiting.
+CHAT_FRAME_RATE = config('CHAT_FRAME_RATE', default=10, cast=float)
+CHAT_FRAME_BURST = config('CHAT_FRAME_BURST', default=30, cast=int)
+CHAT_USER_MESSAGE_RATE = config('CHAT_USER_MESSAGE_RATE', default=5, cast=float)
+CHAT_USER_MESSAGE_BURST = config('CHAT_USER_MESSAGE_BURST', default=15, cast=int)
+CHAT_SEND_QUEUE_SIZE = config('CHAT_SEND_QUEUE_SIZE', default=256, cast=int)
+
+# Chat socket heartbeats (see chat/presence.py)
+# Sockets silent for HEARTBEAT_TIMEOUT seconds are closed; IDLE_TIMEOUT
+# (0 = never) also closes sockets whose client only answers pings.
+CHAT_HEARTBEAT_INTERVAL = config('CHAT_HEARTBEAT_INTERVAL', default=25, cast=int)
+CHAT_HEARTBEAT_TIMEOUT = config('CHAT_HEARTBEAT_TIMEOUT', default=60, cast=int)
+CHAT_IDLE_TIMEOUT = config('CHAT_IDLE_TIMEOUT', default=0, cast=int)
+CHAT_MAX_SOCKETS_PER_USER = config('CHAT_MAX_SOCKETS_PER_USER', default=10, cast=int)
+
+# Chat search ranks only the newest CHAT_SEARCH_CANDIDATES matches (see chat/search.py)
+CHAT_SEARCH_CANDIDATES = config('CHAT_SEARCH_CANDIDATES', default=1000, cast=int)
+
+# Cold archival of chat messages (see chat/archive.py)
+# archive_chat_messages moves messages older than ARCHIVE_AFTER_DAYS into
+# compressed segments of up to ARCHIVE_SEGMENT_SIZE messages, stored in a
+# private Supabase bucket (or ARCHIVE_ROOT in DEBUG).
+CHAT_ARCHIVE_AFTER_DAYS = config('CHAT_ARCHIVE_AFTER_DAYS', default=90, cast=int)
+CHAT_ARCHIVE_SEGMENT_SIZE = config('CHAT_ARCHIVE_SEGMENT_SIZE', default=1000, cast=int)
+CHAT_ARCHIVE_BUCKET = config('CHAT_ARCHIVE_BUCKET', default='chat-archive')
+CHAT_ARCHIVE_ROOT = config('CHAT_ARCHIVE_ROOT', default=str(BASE_DIR / 'chat_archive'))
+
+# Recipients per chunk when notifying a property's savers and followers
+# (see notifications/fanout.py)
+NOTIFICATION_FANOUT_CHUNK_SIZE = config('NOTIFICATION_FANOUT_CHUNK_SIZE', default=1000, cast=int)
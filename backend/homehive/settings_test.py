@@ -0,0 +1,18 @@
+"""
+Settings for running the tests:
+
+    python manage.py test --settings=homehive.settings_test
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR, DATABASES
+
+# Two local SQLite shards for the sharding tests (chat/tests.py), which turn
+# sharding on for themselves; other tests run unsharded
+CHAT_TEST_SHARDS = ['chat_shard_test_1', 'chat_shard_test_2']
+DATABASES = {
+    **DATABASES,
+    **{
+        alias: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / f'{alias}.sqlite3'}
+        for alias in CHAT_TEST_SHARDS
+    },
+}
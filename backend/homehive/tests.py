@@ -0,0 +1,96 @@
+import os
+import tempfile
+import uuid
+
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from .media import IMMUTABLE_CACHE_CONTROL, REVALIDATE_CACHE_CONTROL, serve_media
+
+
+@override_settings(MEDIA_ACCEL_REDIRECT=None)
+class ServeMediaTests(SimpleTestCase):
+    """Range, conditional and caching behaviour of the local media view"""
+
+    content = bytes(range(100))
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.document_root = directory.name
+        self.name = f'{uuid.uuid4()}.mp4'
+        with open(os.path.join(self.document_root, self.name), 'wb') as f:
+            f.write(self.content)
+        self.factory = RequestFactory()
+
+    def get(self, path=None, **headers):
+        request = self.factory.get('/media/', headers=headers)
+        return serve_media(request, path or self.name, document_root=self.document_root)
+
+    def body(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_full_response(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Length'], '100')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(self.body(response), self.content)
+
+    def test_single_range(self):
+        response = self.get(Range='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/100')
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(self.body(response), self.content[10:20])
+
+    def test_open_ended_range_stops_at_the_end_of_the_file(self):
+        response = self.get(Range='bytes=90-500')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 90-99/100')
+        self.assertEqual(self.body(response), self.content[90:])
+
+    def test_suffix_range(self):
+        response = self.get(Range='bytes=-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 95-99/100')
+        self.assertEqual(self.body(response), self.content[95:])
+
+    def test_range_past_the_end_is_not_satisfiable(self):
+        for header in ('bytes=100-', 'bytes=20-10', 'bytes=-0'):
+            with self.subTest(header=header):
+                response = self.get(Range=header)
+                self.assertEqual(response.status_code, 416)
+                self.assertEqual(response['Content-Range'], 'bytes */100')
+
+    def test_malformed_range_gets_the_full_content(self):
+        for header in ('bytes=abc', 'items=0-10', 'bytes=0-1,5-6', 'bytes=-'):
+            with self.subTest(header=header):
+                response = self.get(Range=header)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(self.body(response), self.content)
+
+    def test_stale_if_range_gets_the_full_content(self):
+        response = self.get(Range='bytes=0-9', If_Range='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.content)
+
+    def test_matching_etag_is_not_modified(self):
+        etag = self.get()['ETag']
+        for header in (etag, f'"other", W/{etag}', '*'):
+            with self.subTest(header=header):
+                response = self.get(If_None_Match=header)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response['ETag'], etag)
+
+        self.assertEqual(self.get(If_None_Match='"other"').status_code, 200)
+
+    def test_content_addressed_names_are_cached_forever(self):
+        self.assertEqual(self.get()['Cache-Control'], IMMUTABLE_CACHE_CONTROL)
+
+        with override_settings(MEDIA_IMMUTABLE_CACHE_CONTROL='public, max-age=60'):
+            self.assertEqual(self.get()['Cache-Control'], 'public, max-age=60')
+
+    def test_other_names_are_revalidated(self):
+        with open(os.path.join(self.document_root, 'avatar.png'), 'wb') as f:
+            f.write(self.content)
+        self.assertEqual(self.get('avatar.png')['Cache-Control'], REVALIDATE_CACHE_CONTROL)
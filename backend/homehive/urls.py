@@ -1,10 +1,12 @@
 """
 URL configuration for homehive project.
 """
+import re
+
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf import settings
-from django.conf.urls.static import static
+from .media import receive_upload, serve_media
 
 urlpatterns = [
     # Admin
@@ -22,6 +24,15 @@ urlpatterns = [
     path('accounts/', include('allauth.urls')),
 ]
 
-# Serve media files in development
+# Serve media files in development (local storage mode)
+# Supports Range requests for video seeking and ETag/Last-Modified caching.
+# Direct uploads are received here too, in place of Supabase signed upload URLs.
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    urlpatterns += [
+        path('uploads/<str:token>/', receive_upload, name='direct-upload'),
+        re_path(
+            r'^%s(?P<path>.*)$' % re.escape(settings.MEDIA_URL.lstrip('/')),
+            serve_media,
+            name='media',
+        ),
+    ]
@@ -0,0 +1,85 @@
+"""
+Bulk notification fan-out.
+
+fan_out() sends one notification to many users with a fixed number of
+statements per chunk of FANOUT_CHUNK_SIZE recipients, however many there
+are: one to drop recipients who turned notifications off, one set-based
+DELETE of the notifications the new one supersedes, and one bulk INSERT.
+
+Recipients come from audiences (e.g. a property's savers, then the
+landlord's followers) listed most specific first. A user in several
+audiences is notified once, with the first audience's title and message.
+"""
+from collections import namedtuple
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Notification
+
+User = get_user_model()
+
+FANOUT_CHUNK_SIZE = getattr(settings, 'NOTIFICATION_FANOUT_CHUNK_SIZE', 1000)
+
+# `user_ids`: any iterable of user ids, e.g. a values_list queryset
+Audience = namedtuple('Audience', ['user_ids', 'title', 'message'])
+FanoutResult = namedtuple('FanoutResult', ['recipients', 'notified'])
+
+
+def _recipients(audiences, exclude_id=None):
+    """{user id: audience}, each user under the first audience they are in"""
+    recipients = {}
+    for audience in audiences:
+        for user_id in audience.user_ids:
+            if user_id != exclude_id:
+                recipients.setdefault(user_id, audience)
+    return recipients
+
+
+def fan_out(audiences, type, sender=None, replaces=None, chunk_size=FANOUT_CHUNK_SIZE, **related):
+    """
+    Notify every user in `audiences` once.
+
+    Args:
+        audiences: Audience list, most specific first
+        type: Notification.NotificationType of the notifications
+        sender: user who triggered them; never notified themselves
+        replaces: Q of a recipient's existing notifications the new one
+            supersedes, deleted before it is created
+        **related: related_*_id fields of the notifications
+
+    Returns:
+        FanoutResult: the number of distinct recipients processed, and how
+        many of them were notified (the rest have notifications turned off)
+    """
+    recipients = _recipients(audiences, exclude_id=getattr(sender, 'pk', None))
+    user_ids = list(recipients)
+    notified = 0
+
+    for start in range(0, len(user_ids), chunk_size):
+        chunk = list(User.objects.filter(
+            Q(push_notifications=True) | Q(email_notifications=True),
+            pk__in=user_ids[start:start + chunk_size]
+        ).order_by().values_list('pk', flat=True))
+        if not chunk:
+            continue
+
+        with transaction.atomic():
+            if replaces is not None:
+                Notification.objects.filter(replaces, user_id__in=chunk).delete()
+            Notification.objects.bulk_create([
+                Notification(
+                    user_id=user_id,
+                    sender=sender,
+                    type=type,
+                    title=recipients[user_id].title,
+                    message=recipients[user_id].message,
+                    **related
+                )
+                for user_id in chunk
+            ])
+        notified += len(chunk)
+
+    return FanoutResult(len(user_ids), notified)
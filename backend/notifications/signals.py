@@ -1,20 +1,26 @@
+from django.contrib.auth import get_user_model
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.utils import timezone
 from datetime import timedelta
 from chat.models import Message
 from reviews.models import Review
-from properties.models import Property
 from .models import Notification
 
+User = get_user_model()
+
 
 @receiver(post_save, sender=Message)
 def create_message_notification(sender, instance, created, **kwargs):
     """Create notification for new messages with hour-based deduplication"""
     if created:
-        # Notify the recipient (not the sender)
+        # Notify the recipient (not the sender), comparing ids so the
+        # room's participants are not loaded
         room = instance.room
-        recipient = room.landlord if instance.sender == room.tenant else room.tenant
+        recipient_id = room.other_participant_id(instance.sender_id)
+        recipient = User.objects.only(
+            'id', 'push_notifications', 'email_notifications'
+        ).get(pk=recipient_id)
         
         if recipient.push_notifications or recipient.email_notifications:
             # Calculate one hour ago
@@ -38,37 +44,6 @@ def create_message_notification(sender, instance, created, **kwargs):
             )
 
 
-@receiver(post_save, sender=Property)
-def create_property_update_notification(sender, instance, created, **kwargs):
-    """Create notification for property updates with hour-based deduplication"""
-    if not created:
-        # Notify users who saved this property
-        from properties.models import SavedProperty
-        saved_by = SavedProperty.objects.filter(property=instance).select_related('tenant')
-        
-        # Calculate one hour ago
-        one_hour_ago = timezone.now() - timedelta(hours=1)
-        
-        for saved in saved_by:
-            if saved.tenant.push_notifications or saved.tenant.email_notifications:
-                # Delete property update notifications from same landlord within last hour
-                Notification.objects.filter(
-                    user=saved.tenant,
-                    sender=instance.landlord,
-                    type=Notification.NotificationType.PROPERTY_UPDATE,
-                    created_at__gte=one_hour_ago
-                ).delete()
-
-                Notification.objects.create(
-                    user=saved.tenant,
-                    sender=instance.landlord,
-                    type=Notification.NotificationType.PROPERTY_UPDATE,
-                    title='Property Updated',
-                    message=f'A property you saved has been updated: {instance.title}',
-                    related_property_id=instance.id
-                )
-
-
 @receiver(post_save, sender=Review)
 def create_review_notification(sender, instance, created, **kwargs):
     """Create notification when a review is posted"""
@@ -1,3 +1,106 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import Q
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from accounts.models import Follow
+from properties.models import Property, SavedProperty
+from properties.signals import fan_out_property_activity
+
+from .fanout import Audience, FanoutResult, fan_out
+from .models import Notification
+
+User = get_user_model()
+
+
+class PropertyActivityFanoutTests(TestCase):
+    """Notifications for a property's savers and the landlord's followers"""
+
+    def setUp(self):
+        self.landlord = User.objects.create_user(
+            email='landlord@example.com', username='landlord', password='x', role='LANDLORD',
+            first_name='Ada', last_name='Obi'
+        )
+        self.tenants = [
+            User.objects.create_user(
+                email=f'tenant{index}@example.com', username=f'tenant{index}', password='x', role='TENANT'
+            )
+            for index in range(5)
+        ]
+        # Notifications fan out in a background thread; tests call the fan-out themselves
+        patcher = mock.patch('properties.signals.threading.Thread')
+        self.thread = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.property = Property.objects.create(
+            landlord=self.landlord, title='Flat', description='d', price=1000, location='l',
+            state='Lagos', city='Ikeja', property_type='APARTMENT', num_bedrooms=1, num_bathrooms=1, num_toilets=1
+        )
+
+    def notifications(self, user):
+        return Notification.objects.filter(user=user, related_property_id=self.property.pk)
+
+    def test_savers_who_follow_the_landlord_are_notified_once(self):
+        saver_and_follower, follower = self.tenants[:2]
+        SavedProperty.objects.create(tenant=saver_and_follower, property=self.property)
+        Follow.objects.create(follower=saver_and_follower, following=self.landlord)
+        Follow.objects.create(follower=follower, following=self.landlord)
+
+        old_price = self.property.price
+        self.property.price = 1200
+        result = fan_out_property_activity(self.property, created=False, old_price=old_price)
+
+        self.assertEqual(result, FanoutResult(recipients=2, notified=2))
+        self.assertEqual([n.title for n in self.notifications(saver_and_follower)], ['Price Update Alert'])
+        self.assertEqual([n.title for n in self.notifications(follower)], ['Property Updated'])
+        self.assertFalse(self.notifications(self.landlord).exists())
+
+        # A later update replaces the notifications instead of adding to them
+        fan_out_property_activity(self.property, created=False, old_price=self.property.price)
+        self.assertEqual([n.title for n in self.notifications(saver_and_follower)], ['Property Updated'])
+
+    def test_saves_fan_out_after_commit_in_the_background(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.property.title = 'Renovated flat'
+            self.property.save()
+        self.thread.assert_called_once()
+        self.assertEqual(self.thread.call_args.kwargs['args'], (self.property, False, self.property.price))
+        self.thread.return_value.start.assert_called_once_with()
+
+    def test_counter_only_saves_notify_nobody(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.property.increment_views()
+            self.property.increment_saves()
+        self.assertEqual(callbacks, [])
+        self.thread.assert_not_called()
+
+    def test_fan_out_in_chunks(self):
+        muted = self.tenants[0]
+        User.objects.filter(pk=muted.pk).update(push_notifications=False, email_notifications=False)
+        Notification.objects.create(
+            user=self.tenants[1], type=Notification.NotificationType.PROPERTY_UPDATE,
+            title='Old', message='old', related_property_id=self.property.pk
+        )
+        audiences = [Audience([tenant.pk for tenant in self.tenants], 'Title', 'Message')]
+
+        with CaptureQueriesContext(connection) as queries:
+            result = fan_out(
+                audiences,
+                Notification.NotificationType.PROPERTY_UPDATE,
+                sender=self.landlord,
+                replaces=Q(related_property_id=self.property.pk),
+                chunk_size=2,
+                related_property_id=self.property.pk
+            )
 
-# Create your tests here.
+        self.assertEqual(result, FanoutResult(recipients=5, notified=4))
+        # Per chunk: recipients with notifications on, replaced notifications, new ones
+        statements = [
+            query['sql'].split()[0] for query in queries.captured_queries if 'SAVEPOINT' not in query['sql']
+        ]
+        self.assertEqual(statements, ['SELECT', 'DELETE', 'INSERT'] * 3)
+        self.assertFalse(self.notifications(muted).exists())
+        for tenant in self.tenants[1:]:
+            self.assertEqual([n.title for n in self.notifications(tenant)], ['Title'])
@@ -2,28 +2,33 @@
 Local file storage for development.
 Saves media files to Django's MEDIA_ROOT folder.
 """
+import mimetypes
 import os
+import time
 import uuid
 from django.conf import settings
+from django.core import signing
 
 
-def upload_file_local(file, folder="uploads"):
+def upload_file_local(file, folder="uploads", filename=None):
     """
     Save a file to local media storage.
     
     Args:
         file: File object to save (Django UploadedFile)
         folder: Folder path within MEDIA_ROOT
+        filename: Optional custom filename
     
     Returns:
         str: URL path to the saved file (relative to MEDIA_URL)
     """
-    # Generate unique filename
-    ext = 'bin'
-    if hasattr(file, 'name') and file.name:
-        ext = file.name.split('.')[-1]
-    
-    filename = f"{uuid.uuid4()}.{ext}"
+    # Generate unique filename if not provided
+    if not filename:
+        ext = 'bin'
+        if hasattr(file, 'name') and file.name:
+            ext = file.name.split('.')[-1]
+        
+        filename = f"{uuid.uuid4()}.{ext}"
     
     # Create folder path
     folder_path = os.path.join(settings.MEDIA_ROOT, folder)
@@ -68,3 +73,136 @@ def delete_file_local(file_url):
     except Exception as e:
         print(f"Failed to delete local file: {str(e)}")
         return False
+
+
+def local_path_from_url(file_url):
+    """
+    Map a media URL back to its path under MEDIA_ROOT.
+    Returns None if the URL does not point at local media.
+    """
+    if not file_url or settings.MEDIA_URL not in file_url:
+        return None
+    relative_path = file_url.split(settings.MEDIA_URL)[-1]
+    file_path = os.path.normpath(os.path.join(settings.MEDIA_ROOT, relative_path))
+    # Refuse paths that escape MEDIA_ROOT
+    if not file_path.startswith(os.path.normpath(str(settings.MEDIA_ROOT)) + os.sep):
+        return None
+    return file_path
+
+
+def read_file_local(file_url):
+    """
+    Read a locally stored file using its URL.
+    Returns the file content as bytes, or None if it does not exist.
+    """
+    file_path = local_path_from_url(file_url)
+    if file_path is None or not os.path.exists(file_path):
+        return None
+    with open(file_path, 'rb') as source:
+        return source.read()
+
+
+# Signed direct uploads (the local stand-in for Supabase signed upload URLs)
+
+UPLOAD_TOKEN_SALT = 'properties.local_storage.upload'
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class UploadRejected(Exception):
+    """A direct upload the local stand-in refuses; `status` is the HTTP status to answer with"""
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+def local_url(key):
+    """Public URL of a file stored under MEDIA_ROOT"""
+    base_url = getattr(settings, 'BACKEND_URL', 'http://localhost:8000')
+    return f"{base_url}{settings.MEDIA_URL}{key}"
+
+
+def local_path(key):
+    """Path of a storage key under MEDIA_ROOT, or None if it would escape it"""
+    root = os.path.normpath(str(settings.MEDIA_ROOT))
+    file_path = os.path.normpath(os.path.join(root, key))
+    if not file_path.startswith(root + os.sep):
+        return None
+    return file_path
+
+
+def create_upload_url_local(key, content_type, max_size, expires_in):
+    """
+    A URL the file can be PUT to within `expires_in` seconds. The key,
+    content type and size limit travel signed in the URL itself.
+    """
+    token = signing.dumps(
+        {'key': key, 'type': content_type, 'max': max_size, 'exp': int(time.time()) + expires_in},
+        salt=UPLOAD_TOKEN_SALT
+    )
+    base_url = getattr(settings, 'BACKEND_URL', 'http://localhost:8000')
+    return f"{base_url}/uploads/{token}/"
+
+
+def save_upload_local(token, content_type, content_length, stream):
+    """
+    Store the body of a PUT to an upload URL, enforcing what was signed.
+    
+    Returns:
+        str: the storage key written
+    
+    Raises:
+        UploadRejected: if the URL is invalid or expired, or the upload breaks its terms
+    """
+    try:
+        terms = signing.loads(token, salt=UPLOAD_TOKEN_SALT)
+    except signing.BadSignature:
+        raise UploadRejected('Invalid upload URL', 403)
+    if time.time() > terms['exp']:
+        raise UploadRejected('Upload URL has expired', 403)
+    
+    if content_type != terms['type']:
+        raise UploadRejected(f"Content-Type must be {terms['type']}", 415)
+    if content_length is not None and content_length > terms['max']:
+        raise UploadRejected('File is too large', 413)
+    
+    file_path = local_path(terms['key'])
+    if file_path is None:
+        raise UploadRejected('Invalid upload URL', 403)
+    if os.path.exists(file_path):
+        # Stored files are immutable (see homehive.media)
+        raise UploadRejected('Already uploaded', 409)
+    
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    partial_path = f"{file_path}.part"
+    written = 0
+    try:
+        with open(partial_path, 'wb') as destination:
+            while True:
+                chunk = stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > terms['max']:
+                    raise UploadRejected('File is too large', 413)
+                destination.write(chunk)
+        os.replace(partial_path, file_path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    return terms['key']
+
+
+def stat_file_local(key):
+    """(size, content type) of a locally stored file, or None if it does not exist"""
+    file_path = local_path(key)
+    if file_path is None or not os.path.isfile(file_path):
+        return None
+    content_type = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+    return os.path.getsize(file_path), content_type
+
+
+def delete_key_local(key):
+    file_path = local_path(key)
+    if file_path is not None and os.path.exists(file_path):
+        os.remove(file_path)
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from properties.models import PropertyImage
+from properties.placeholders import fill_placeholders
+
+
+class Command(BaseCommand):
+    help = 'Generate low-quality placeholders for property images that do not have one yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Number of images to update per bulk_update call'
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Regenerate placeholders even for images that already have one'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        
+        images = PropertyImage.objects.only('id', 'image_url', 'placeholder').order_by('id')
+        if not options['force']:
+            images = images.filter(placeholder='')
+        
+        total = images.count()
+        self.stdout.write(f"Generating placeholders for {total} images...")
+        
+        updated, failed = fill_placeholders(
+            images,
+            batch_size=batch_size,
+            on_failure=lambda image, reason: self.stderr.write(reason)
+        )
+        
+        self.stdout.write(self.style.SUCCESS(
+            f"Updated {updated} images ({failed} failed)"
+        ))
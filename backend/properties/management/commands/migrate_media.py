@@ -0,0 +1,246 @@
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import File
+from django.core.management.base import BaseCommand, CommandError
+
+from properties.models import PropertyImage, PropertyVideo
+from properties.storage import BACKENDS, LOCAL_BACKEND, open_file, parse_file_url, upload_file
+
+User = get_user_model()
+
+# (model, URL field, default bucket, large) for every place a media URL is
+# stored; large objects are copied by their own, smaller pool of workers
+MEDIA_SOURCES = [
+    (PropertyImage, 'image_url', 'property-images', False),
+    (PropertyVideo, 'video_url', 'property-videos', True),
+    (User, 'avatar', 'property-images', False),
+    (User, 'cover_photo', 'property-images', False),
+]
+
+# Objects are streamed in chunks of this size, and spill from memory to a
+# temporary file above COPY_SPOOL_SIZE
+COPY_CHUNK_SIZE = 1024 * 1024
+COPY_SPOOL_SIZE = 8 * 1024 * 1024
+
+
+def _read_chunks(url, destination=None):
+    """
+    Stream a stored object, writing it to `destination` if given.
+
+    Returns:
+        tuple: (sha256 hex digest, size in bytes)
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with open_file(url) as source:
+        for chunk in iter(lambda: source.read(COPY_CHUNK_SIZE), b''):
+            digest.update(chunk)
+            size += len(chunk)
+            if destination is not None:
+                destination.write(chunk)
+    return digest.hexdigest(), size
+
+
+def _copy_object(url, backend, bucket_name, verify):
+    """
+    Copy one stored object to the target backend.
+    Runs in a worker thread and never touches the database.
+
+    The object is streamed through a spooled temporary file, so small ones
+    stay in memory and large ones go to disk; the Supabase client still
+    takes each upload's body at once, hence the separate pool for videos.
+
+    Returns:
+        tuple: (new_url, size in bytes)
+    """
+    _, _, key = parse_file_url(url)
+    folder, filename = posixpath.split(key)
+
+    with tempfile.SpooledTemporaryFile(max_size=COPY_SPOOL_SIZE) as spool:
+        checksum, size = _read_chunks(url, spool)
+        spool.seek(0)
+
+        upload = File(spool, name=filename)
+        upload.content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        new_url = upload_file(upload, bucket_name, folder=folder, filename=filename, backend=backend)
+
+    if verify:
+        copied_checksum, _ = _read_chunks(new_url)
+        if copied_checksum != checksum:
+            raise ValueError(f"Checksum mismatch after copy ({checksum} != {copied_checksum})")
+
+    return new_url, size
+
+
+class Command(BaseCommand):
+    help = 'Copy stored media to another storage backend and rewrite the URLs saved in the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--to',
+            dest='backend',
+            choices=BACKENDS,
+            required=True,
+            help='Target storage backend'
+        )
+        parser.add_argument(
+            '--bucket',
+            help='Target bucket for every object (defaults to the bucket each media type uses)'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=8,
+            help='Number of concurrent copy workers'
+        )
+        parser.add_argument(
+            '--video-workers',
+            type=int,
+            default=2,
+            help='Number of concurrent copy workers for videos'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=200,
+            help='Number of rows rewritten per bulk_update call'
+        )
+        parser.add_argument(
+            '--checkpoint',
+            default='media_migration.checkpoint',
+            help='File recording migrated rows so an interrupted run can resume'
+        )
+        parser.add_argument(
+            '--no-verify',
+            action='store_true',
+            help='Skip reading back each copy to compare checksums'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='List what would be copied without copying anything'
+        )
+
+    def handle(self, *args, **options):
+        if min(options['workers'], options['video_workers'], options['chunk_size']) < 1:
+            raise CommandError('--workers, --video-workers and --chunk-size must be positive')
+
+        self.backend = options['backend']
+        self.bucket = options['bucket']
+        self.chunk_size = options['chunk_size']
+        self.verify = not options['no_verify']
+        self.checkpoint_path = options['checkpoint']
+        self.done = self._load_checkpoint()
+
+        self.copied = 0
+        self.failed = 0
+        self.bytes_copied = 0
+        self.started = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool, \
+                ThreadPoolExecutor(max_workers=options['video_workers']) as large_pool:
+            for model, field, default_bucket, large in MEDIA_SOURCES:
+                rows = self._pending_rows(model, field)
+                label = f"{model._meta.label}.{field}"
+                self.stdout.write(f"{label}: {len(rows)} objects to migrate")
+                if options['dry_run'] or not rows:
+                    continue
+                self._migrate(large_pool if large else pool, model, field, self.bucket or default_bucket, rows)
+
+        elapsed = time.monotonic() - self.started
+        self.stdout.write(self.style.SUCCESS(
+            f"Copied {self.copied} objects ({self.failed} failed) in {elapsed:.1f}s - "
+            f"{self._throughput()}"
+        ))
+
+    def _pending_rows(self, model, field):
+        """Rows whose URL is not yet on the target backend and not checkpointed"""
+        label = f"{model._meta.label}.{field}"
+        rows = []
+        queryset = (
+            model.objects.exclude(**{f'{field}__isnull': True})
+            .exclude(**{field: ''})
+            .order_by('pk')
+            .values_list('pk', field)
+        )
+        for pk, url in queryset.iterator():
+            if f"{label}:{pk}" in self.done:
+                continue
+            backend, bucket_name, _ = parse_file_url(url)
+            if backend is None:
+                self.stderr.write(f"Skipping {label} {pk}: unrecognised URL {url}")
+                continue
+            # Local storage has no buckets, so any local file is on a local target
+            if backend == self.backend and (
+                self.backend == LOCAL_BACKEND or self.bucket is None or bucket_name == self.bucket
+            ):
+                continue
+            rows.append((pk, url))
+        return rows
+
+    def _migrate(self, pool, model, field, bucket_name, rows):
+        label = f"{model._meta.label}.{field}"
+        for start in range(0, len(rows), self.chunk_size):
+            chunk = rows[start:start + self.chunk_size]
+            futures = {
+                pool.submit(_copy_object, url, self.backend, bucket_name, self.verify): pk
+                for pk, url in chunk
+            }
+
+            new_urls = {}
+            for future in as_completed(futures):
+                pk = futures[future]
+                try:
+                    new_url, size = future.result()
+                except Exception as e:
+                    self.failed += 1
+                    self.stderr.write(f"Failed to copy {label} {pk}: {e}")
+                    continue
+                new_urls[pk] = new_url
+                self.bytes_copied += size
+
+            if new_urls:
+                objects = list(model.objects.filter(pk__in=new_urls).only('pk', field))
+                for obj in objects:
+                    setattr(obj, field, new_urls[obj.pk])
+                model.objects.bulk_update(objects, [field])
+                self._save_checkpoint(label, new_urls)
+                self.copied += len(new_urls)
+
+            self.stdout.write(
+                f"  {label}: {min(start + self.chunk_size, len(rows))}/{len(rows)} - {self._throughput()}"
+            )
+
+    def _throughput(self):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        return (
+            f"{self.copied / elapsed:.1f} objects/s, "
+            f"{self.bytes_copied / elapsed / (1024 * 1024):.2f} MiB/s"
+        )
+
+    def _load_checkpoint(self):
+        done = set()
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        entry = json.loads(line)
+                        done.add(f"{entry['source']}:{entry['pk']}")
+            self.stdout.write(f"Resuming: {len(done)} objects already migrated")
+        return done
+
+    def _save_checkpoint(self, label, new_urls):
+        """Append rows only after their URLs have been committed"""
+        with open(self.checkpoint_path, 'a') as f:
+            for pk, url in new_urls.items():
+                f.write(json.dumps({'source': label, 'pk': pk, 'url': url}) + '\n')
+                self.done.add(f"{label}:{pk}")
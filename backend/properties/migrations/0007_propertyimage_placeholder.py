@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-18 22:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0006_propertyview'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='propertyimage',
+            name='placeholder',
+            field=models.TextField(blank=True, default='', help_text='Tiny base64 data URI shown while the full image loads'),
+        ),
+    ]
@@ -6,6 +6,19 @@ import json
 User = get_user_model()
 
 
+class PropertyQuerySet(models.QuerySet):
+    
+    def with_cover_image(self):
+        """
+        Annotate each property with `cover_image_url`: the cover image,
+        or the first image if no cover is set.
+        """
+        cover = PropertyImage.objects.filter(
+            property=models.OuterRef('pk')
+        ).order_by('-is_cover', 'order', 'uploaded_at').values('image_url')[:1]
+        return self.annotate(cover_image_url=models.Subquery(cover))
+
+
 class Property(models.Model):
     """
     Property listing model with support for Nigerian property types.
@@ -90,6 +103,8 @@ class Property(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = PropertyQuerySet.as_manager()
+    
     def increment_views(self):
         """Increment view count"""
         self.view_count += 1
@@ -143,6 +158,11 @@ class PropertyImage(models.Model):
         max_length=500,
         help_text="Supabase Storage public URL"
     )
+    placeholder = models.TextField(
+        blank=True,
+        default='',
+        help_text="Tiny base64 data URI shown while the full image loads"
+    )
     is_cover = models.BooleanField(
         default=False,
         help_text="Mark as cover/primary image"
@@ -0,0 +1,127 @@
+"""
+Low-quality image placeholders (LQIP) for property images.
+A tiny blurred JPEG thumbnail is generated once at upload time and stored
+inline as a base64 data URI, so listing cards can render instantly.
+
+Images uploaded straight to storage are not in the request, so their
+placeholders are filled in afterwards (fill_placeholders_later), from the
+stored files, the same way backfill_image_placeholders does for old images.
+"""
+import base64
+import io
+import logging
+import threading
+
+from django.db import connection, transaction
+from PIL import Image, ImageFilter, UnidentifiedImageError
+
+# Longest side of the placeholder thumbnail in pixels
+PLACEHOLDER_SIZE = 16
+PLACEHOLDER_QUALITY = 40
+
+logger = logging.getLogger(__name__)
+
+
+def generate_placeholder(file):
+    """
+    Build a base64 data URI placeholder for an image file.
+    
+    Args:
+        file: File-like object (Django UploadedFile, BytesIO, open file)
+    
+    Returns:
+        str: ``data:image/jpeg;base64,...`` string, or '' if the file
+        is not a readable image
+    """
+    try:
+        if hasattr(file, 'seek'):
+            file.seek(0)
+        with Image.open(file) as img:
+            img.draft('RGB', (PLACEHOLDER_SIZE * 4, PLACEHOLDER_SIZE * 4))
+            thumb = img.convert('RGB')
+            thumb.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+            thumb = thumb.filter(ImageFilter.GaussianBlur(radius=1))
+            
+            buffer = io.BytesIO()
+            thumb.save(buffer, format='JPEG', quality=PLACEHOLDER_QUALITY, optimize=True)
+    except (UnidentifiedImageError, OSError, ValueError):
+        return ''
+    finally:
+        # Leave the file ready for the real upload
+        if hasattr(file, 'seek'):
+            file.seek(0)
+    
+    encoded = base64.b64encode(buffer.getvalue()).decode('ascii')
+    return f"data:image/jpeg;base64,{encoded}"
+
+
+def fill_placeholders(images, batch_size=100, on_failure=None):
+    """
+    Generate and store the placeholders of PropertyImage rows from their
+    files in storage.
+    
+    Args:
+        images: PropertyImage queryset (only id, image_url and placeholder are needed)
+        batch_size: Number of images to update per bulk_update call
+        on_failure: Called with (image, reason) for each image that fails
+    
+    Returns:
+        tuple: (updated, failed)
+    """
+    from .models import PropertyImage
+    from .storage import read_file
+    
+    updated = 0
+    failed = 0
+    batch = []
+    for image in images.iterator(chunk_size=batch_size):
+        try:
+            content = read_file(image.image_url)
+        except Exception as e:
+            failed += 1
+            if on_failure:
+                on_failure(image, f"Could not read image {image.id}: {e}")
+            continue
+        
+        placeholder = generate_placeholder(io.BytesIO(content))
+        if not placeholder:
+            failed += 1
+            if on_failure:
+                on_failure(image, f"Image {image.id} is not a readable image")
+            continue
+        
+        image.placeholder = placeholder
+        batch.append(image)
+        if len(batch) >= batch_size:
+            PropertyImage.objects.bulk_update(batch, ['placeholder'])
+            updated += len(batch)
+            batch = []
+    
+    if batch:
+        PropertyImage.objects.bulk_update(batch, ['placeholder'])
+        updated += len(batch)
+    return updated, failed
+
+
+def fill_placeholders_later(image_ids):
+    """
+    Fill in the placeholders of new images in a background thread once the
+    current transaction commits, so the request does not wait for their
+    files to be downloaded. Images still without one can be retried with
+    backfill_image_placeholders.
+    """
+    from .models import PropertyImage
+    
+    def fill():
+        try:
+            fill_placeholders(
+                PropertyImage.objects.filter(pk__in=image_ids, placeholder='').only('id', 'image_url', 'placeholder'),
+                on_failure=lambda image, reason: logger.warning(reason)
+            )
+        except Exception:
+            logger.exception("Could not fill image placeholders")
+        finally:
+            connection.close()
+    
+    if image_ids:
+        transaction.on_commit(lambda: threading.Thread(target=fill, daemon=True).start())
@@ -1,6 +1,8 @@
 from rest_framework import serializers
 from django.db import models
+from django.db.models.functions import Coalesce
 from .models import Property, PropertyImage, PropertyVideo, SavedProperty
+from .uploads import UPLOAD_KINDS, confirm_upload, confirmed_url
 from accounts.serializers import UserSerializer
 import json
 
@@ -10,7 +12,7 @@ class PropertyImageSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = PropertyImage
-        fields = ['id', 'image_url', 'is_cover', 'order', 'uploaded_at']
+        fields = ['id', 'image_url', 'placeholder', 'is_cover', 'order', 'uploaded_at']
 class PropertyVideoSerializer(serializers.ModelSerializer):
     """Serializer for property videos"""
     
@@ -22,11 +24,66 @@ class PropertyVideoSerializer(serializers.ModelSerializer):
 
 
 
+class PropertyGalleryUpdateSerializer(serializers.Serializer):
+    """
+    Serializer for bulk gallery changes: ordering, cover choice and deletions.
+    Image ids are checked against the property's gallery in validate().
+    """
+    
+    order = serializers.ListField(
+        child=serializers.IntegerField(),
+        required=False,
+        help_text="Image ids in the desired display order (all remaining images)"
+    )
+    cover = serializers.IntegerField(
+        required=False,
+        help_text="Id of the image to use as cover"
+    )
+    delete = serializers.ListField(
+        child=serializers.IntegerField(),
+        required=False,
+        allow_empty=True,
+        help_text="Image ids to delete"
+    )
+    
+    def validate(self, attrs):
+        gallery_ids = set(self.context['image_ids'])
+        delete_ids = set(attrs.get('delete', []))
+        remaining_ids = gallery_ids - delete_ids
+        
+        unknown = delete_ids - gallery_ids
+        if unknown:
+            raise serializers.ValidationError({"delete": f"Images not in this gallery: {sorted(unknown)}"})
+        
+        if 'order' in attrs:
+            order = attrs['order']
+            if len(order) != len(set(order)):
+                raise serializers.ValidationError({"order": "Image ids must not repeat."})
+            if set(order) != remaining_ids:
+                raise serializers.ValidationError({"order": "Order must list every remaining image exactly once."})
+        
+        cover = attrs.get('cover')
+        if cover is not None and cover not in remaining_ids:
+            raise serializers.ValidationError({"cover": "Cover must be one of the remaining images."})
+        
+        return attrs
+
+
+class DirectUploadSerializer(serializers.Serializer):
+    """A request for a signed URL to upload one file directly to storage"""
+    
+    kind = serializers.ChoiceField(choices=list(UPLOAD_KINDS))
+    content_type = serializers.CharField(max_length=100)
+    size = serializers.IntegerField(min_value=1, help_text="File size in bytes")
+
+
 class PropertyListSerializer(serializers.ModelSerializer):
     """Condensed property serializer for list/search views"""
     
     landlord_name = serializers.SerializerMethodField()
-    cover_image = serializers.SerializerMethodField()        
+    landlord_response_stats = serializers.SerializerMethodField()
+    cover_image = serializers.SerializerMethodField()
+    cover_placeholder = serializers.SerializerMethodField()
     amenities_list = serializers.SerializerMethodField()
     is_saved = serializers.SerializerMethodField()
     review_count = serializers.SerializerMethodField()
@@ -37,7 +94,7 @@ class PropertyListSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'title', 'price', 'location', 'state', 'city', 'property_type',
             'num_bedrooms', 'num_bathrooms', 'num_toilets', 'is_premium',
-            'cover_image', 'landlord_name', 'amenities_list',
+            'cover_image', 'cover_placeholder', 'landlord_name', 'landlord_response_stats', 'amenities_list',
             'view_count', 'save_count', 'is_saved', 'review_count', 'average_rating', 'created_at'
         ]
     
@@ -51,13 +108,28 @@ class PropertyListSerializer(serializers.ModelSerializer):
     def get_landlord_name(self, obj):
         return f"{obj.landlord.first_name} {obj.landlord.last_name}".strip() or obj.landlord.username
     
+    def get_landlord_response_stats(self, obj):
+        # Stored on the landlord row listings already join (chat.response_stats)
+        return obj.landlord.response_stats()
+    
+    def _get_cover(self, obj):
+        """
+        Resolve the cover image from the (usually prefetched) image set.
+        Falls back to the first image if no cover is set.
+        """
+        if not hasattr(obj, '_cover_image'):
+            images = list(obj.images.all())
+            cover = next((img for img in images if img.is_cover), None)
+            obj._cover_image = cover or (images[0] if images else None)
+        return obj._cover_image
+    
     def get_cover_image(self, obj):
-        cover = obj.images.filter(is_cover=True).first()
-        if cover:
-            return cover.image_url
-        # Return first image if no cover set
-        first_image = obj.images.first()
-        return first_image.image_url if first_image else None
+        cover = self._get_cover(obj)
+        return cover.image_url if cover else None
+    
+    def get_cover_placeholder(self, obj):
+        cover = self._get_cover(obj)
+        return cover.placeholder if cover and cover.placeholder else None
     
     def get_amenities_list(self, obj):
         return obj.get_amenities_list()
@@ -149,13 +221,26 @@ class PropertyCreateUpdateSerializer(serializers.ModelSerializer):
         write_only=True,
         help_text="List of video files to upload (min 1)"
     )
+    image_keys = serializers.ListField(
+        child=serializers.CharField(max_length=255),
+        required=False,
+        write_only=True,
+        help_text="Keys of images uploaded directly to storage (count toward the minimum)"
+    )
+    video_keys = serializers.ListField(
+        child=serializers.CharField(max_length=255),
+        required=False,
+        write_only=True,
+        help_text="Keys of videos uploaded directly to storage (count toward the minimum)"
+    )
     
     class Meta:
         model = Property
         fields = [
             'id', 'title', 'description', 'price', 'location', 'state', 'city', 'zip_code',
             'latitude', 'longitude', 'property_type', 'num_bedrooms',
-            'num_bathrooms', 'num_toilets', 'amenities_list', 'is_premium', 'image_files', 'video_files'
+            'num_bathrooms', 'num_toilets', 'amenities_list', 'is_premium', 'image_files', 'video_files',
+            'image_keys', 'video_keys'
         ]
         read_only_fields = ['id']
         
@@ -166,22 +251,62 @@ class PropertyCreateUpdateSerializer(serializers.ModelSerializer):
         """
         # Check if this is a create operation (no instance)
         if self.instance is None:
-            image_files = attrs.get('image_files', [])
-            video_files = attrs.get('video_files', [])
+            image_count = len(attrs.get('image_files', [])) + len(attrs.get('image_keys', []))
+            video_count = len(attrs.get('video_files', [])) + len(attrs.get('video_keys', []))
             
-            if len(image_files) < 5:
+            if image_count < 5:
                 raise serializers.ValidationError({"image_files": "At least 5 images are required."})
-            if len(video_files) < 1:
+            if video_count < 1:
                 raise serializers.ValidationError({"video_files": "At least 1 video is required."})
         
         return attrs
     
+    def _validate_keys(self, keys, kind_name, model, url_field):
+        """Confirm direct uploads against storage metadata; returns their public URLs"""
+        user = self.context['request'].user
+        if len(keys) != len(set(keys)):
+            raise serializers.ValidationError("Upload keys must not repeat.")
+        urls = []
+        for key in keys:
+            confirm_upload(user, kind_name, key)
+            urls.append(confirmed_url(kind_name, key))
+        if model.objects.filter(**{f'{url_field}__in': urls}).exists():
+            raise serializers.ValidationError("An upload can only be attached once.")
+        return urls
+    
+    def validate_image_keys(self, keys):
+        return self._validate_keys(keys, 'property_image', PropertyImage, 'image_url')
+    
+    def validate_video_keys(self, keys):
+        return self._validate_keys(keys, 'property_video', PropertyVideo, 'video_url')
+    
+    def _add_uploaded_images(self, property_obj, image_urls, first_order, needs_cover):
+        """
+        PropertyImage rows for images already in storage. Their placeholders
+        are generated from the stored files after the request.
+        """
+        from .placeholders import fill_placeholders_later
+        
+        images = PropertyImage.objects.bulk_create([
+            PropertyImage(
+                property=property_obj,
+                image_url=url,
+                is_cover=(needs_cover and idx == 0),
+                order=first_order + idx
+            )
+            for idx, url in enumerate(image_urls)
+        ])
+        fill_placeholders_later([image.pk for image in images])
+    
     def create(self, validated_data):
         from .storage import upload_file
+        from .placeholders import generate_placeholder
         
         amenities_list = validated_data.pop('amenities_list', [])
         image_files = validated_data.pop('image_files', [])
         video_files = validated_data.pop('video_files', [])
+        image_urls = validated_data.pop('image_keys', [])
+        video_urls = validated_data.pop('video_keys', [])
         
         # Set landlord to current user
         validated_data['landlord'] = self.context['request'].user
@@ -195,12 +320,15 @@ class PropertyCreateUpdateSerializer(serializers.ModelSerializer):
         # Process Image Uploads
         for idx, file in enumerate(image_files):
             try:
+                placeholder = generate_placeholder(file)
+                
                 # Upload to Supabase
                 url = upload_file(file, 'property-images', folder=f"properties/{property_obj.id}/images")
                 
                 PropertyImage.objects.create(
                     property=property_obj,
                     image_url=url,
+                    placeholder=placeholder,
                     is_cover=(idx == 0),  # First image is cover
                     order=idx
                 )
@@ -221,14 +349,26 @@ class PropertyCreateUpdateSerializer(serializers.ModelSerializer):
             except Exception as e:
                 print(f"Error uploading video {idx}: {str(e)}")
         
+        # Direct uploads follow any files posted with the request
+        self._add_uploaded_images(
+            property_obj, image_urls,
+            first_order=len(image_files),
+            needs_cover=not property_obj.images.filter(is_cover=True).exists()
+        )
+        for url in video_urls:
+            PropertyVideo.objects.create(property=property_obj, video_url=url)
+        
         return property_obj
     
     def update(self, instance, validated_data):
         from .storage import upload_file
+        from .placeholders import generate_placeholder
         
         amenities_list = validated_data.pop('amenities_list', None)
         image_files = validated_data.pop('image_files', None)
         video_files = validated_data.pop('video_files', None)
+        image_urls = validated_data.pop('image_keys', [])
+        video_urls = validated_data.pop('video_keys', [])
         
         # Update amenities if provided
         if amenities_list is not None:
@@ -243,15 +383,17 @@ class PropertyCreateUpdateSerializer(serializers.ModelSerializer):
         if image_files is not None and len(image_files) > 0:
             # Get the current max order to continue from
             existing_images = instance.images.all()
-            max_order = existing_images.aggregate(models.Max('order'))['order__max'] or -1
+            max_order = existing_images.aggregate(max_order=Coalesce(models.Max('order'), -1))['max_order']
             has_cover = existing_images.filter(is_cover=True).exists()
             
             for idx, file in enumerate(image_files):
                 try:
+                    placeholder = generate_placeholder(file)
                     url = upload_file(file, 'property-images', folder=f"properties/{instance.id}/images")
                     PropertyImage.objects.create(
                         property=instance,
                         image_url=url,
+                        placeholder=placeholder,
                         is_cover=(not has_cover and idx == 0),  # Only set cover if none exists
                         order=max_order + 1 + idx
                     )
@@ -270,6 +412,17 @@ class PropertyCreateUpdateSerializer(serializers.ModelSerializer):
                 except Exception as e:
                     print(f"Error uploading video {idx}: {str(e)}")
         
+        if image_urls:
+            existing_images = instance.images.all()
+            max_order = existing_images.aggregate(max_order=Coalesce(models.Max('order'), -1))['max_order']
+            self._add_uploaded_images(
+                instance, image_urls,
+                first_order=max_order + 1,
+                needs_cover=not existing_images.filter(is_cover=True).exists()
+            )
+        for url in video_urls:
+            PropertyVideo.objects.create(property=instance, video_url=url)
+        
         return instance
 
 
@@ -1,14 +1,32 @@
+import logging
+import threading
+
+from django.db import connection, transaction
+from django.db.models import Q
 from django.db.models.signals import pre_save, post_save
 from django.dispatch import receiver
 from .models import Property, SavedProperty
+from notifications.fanout import Audience, fan_out
 from notifications.models import Notification
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
+logger = logging.getLogger(__name__)
+
+# Saves that only bump these (Property.increment_*) are not property activity
+COUNTER_FIELDS = {'view_count', 'save_count'}
+
+
+def _is_counter_update(kwargs):
+    update_fields = kwargs.get('update_fields')
+    return bool(update_fields) and set(update_fields) <= COUNTER_FIELDS
+
 
 @receiver(pre_save, sender=Property)
 def capture_old_price(sender, instance, **kwargs):
     """Capture the old price before saving changes."""
+    if _is_counter_update(kwargs):
+        return
     if instance.pk:
         try:
             old_instance = Property.objects.get(pk=instance.pk)
@@ -19,92 +37,81 @@ def capture_old_price(sender, instance, **kwargs):
         instance._old_price = None
 
 @receiver(post_save, sender=Property)
-def notify_price_change(sender, instance, created, **kwargs):
+def notify_property_activity(sender, instance, created, **kwargs):
     """
-    Check if price changed and notify tenants who saved this property.
+    Notify the tenants who saved the property and the landlord's followers
+    that it was listed or updated. The fan-out runs in a background thread
+    once the save has committed, so the landlord's request does not wait
+    for it.
     """
-    if created:
+    if _is_counter_update(kwargs):
         return
+    old_price = getattr(instance, '_old_price', None)
+    transaction.on_commit(lambda: threading.Thread(
+        target=_fan_out_in_background, args=(instance, created, old_price), daemon=True
+    ).start())
 
-    # Check if we captured an old price
-    if not hasattr(instance, '_old_price') or instance._old_price is None:
-        return
 
-    if instance.price != instance._old_price:
-        # Find all tenants who saved this property
-        saved_properties = SavedProperty.objects.filter(property=instance).select_related('tenant')
-        
-        notifications = []
-        # Delete obsolete notifications first for users who are about to receive a new one
-        # Because this is a list of users, we can proactively clear their notifications for this property
-        tenant_ids = [sp.tenant.id for sp in saved_properties]
-        Notification.objects.filter(
-            user_id__in=tenant_ids,
-            type=Notification.NotificationType.PROPERTY_UPDATE,
-            related_property_id=instance.id
-        ).delete()
-
-        for sp in saved_properties:
-            notifications.append(
-                Notification(
-                    user=sp.tenant,
-                    type=Notification.NotificationType.PROPERTY_UPDATE,
-                    title="Price Update Alert",
-                    message=f"The price for '{instance.title}' has changed from ₦{instance._old_price:,.2f} to ₦{instance.price:,.2f}.",
-                    related_property_id=instance.id
-                )
-            )
-        
-        # Bulk create for efficiency
-        if notifications:
-            Notification.objects.bulk_create(notifications)
+def _fan_out_in_background(instance, created, old_price):
+    try:
+        fan_out_property_activity(instance, created, old_price)
+    except Exception:
+        logger.exception('Could not notify about activity on property %s', instance.id)
+    finally:
+        # The thread's own connection
+        connection.close()
 
 
-@receiver(post_save, sender=Property)
-def notify_followers_on_property_activity(sender, instance, created, **kwargs):
+def fan_out_property_activity(instance, created, old_price=None):
     """
-    Notify landlord's followers when they upload a new property or update an existing one.
+    One PROPERTY_UPDATE notification per saver or follower, replacing the
+    ones they have for the property. Savers are told about a price change
+    when there was one. Returns the notifications.fanout.FanoutResult.
     """
     from accounts.models import Follow
 
     landlord = instance.landlord
-    followers = Follow.objects.filter(following=landlord).select_related('follower')
-    
-    if not followers.exists():
-        return
+    landlord_name = f"{landlord.first_name} {landlord.last_name}"
+    audiences = []
+
+    if not created:
+        savers = SavedProperty.objects.filter(property=instance).values_list('tenant_id', flat=True)
+        if old_price is not None and instance.price != old_price:
+            audiences.append(Audience(
+                savers,
+                "Price Update Alert",
+                f"The price for '{instance.title}' has changed from ₦{old_price:,.2f} to ₦{instance.price:,.2f}."
+            ))
+        else:
+            audiences.append(Audience(
+                savers,
+                'Property Updated',
+                f'A property you saved has been updated: {instance.title}'
+            ))
 
-    notifications = []
-    
+    followers = Follow.objects.filter(following=landlord).values_list('follower_id', flat=True)
     if created:
-        # New Property Notification
-        title = "New Property Alert"
-        message = f"{landlord.first_name} {landlord.last_name} has uploaded a new property: '{instance.title}'."
+        audiences.append(Audience(
+            followers,
+            "New Property Alert",
+            f"{landlord_name} has uploaded a new property: '{instance.title}'."
+        ))
     else:
-        # Property Edited Notification
-        # Avoid duplicate notifications if price change already triggered one? 
-        # Ideally price change is specific to SAVED users. This is for FOLLOWERS.
-        # A follower might not have saved this property yet.
-        title = "Property Updated"
-        message = f"{landlord.first_name} {landlord.last_name} has updated the property: '{instance.title}'."
-
-    # Delete obsolete notifications first for followers
-    follower_ids = [f.follower.id for f in followers]
-    Notification.objects.filter(
-        user_id__in=follower_ids,
-        type=Notification.NotificationType.PROPERTY_UPDATE,
+        audiences.append(Audience(
+            followers,
+            "Property Updated",
+            f"{landlord_name} has updated the property: '{instance.title}'."
+        ))
+
+    result = fan_out(
+        audiences,
+        Notification.NotificationType.PROPERTY_UPDATE,
+        sender=landlord,
+        replaces=Q(type=Notification.NotificationType.PROPERTY_UPDATE, related_property_id=instance.id),
         related_property_id=instance.id
-    ).delete()
-
-    for follow in followers:
-        notifications.append(
-            Notification(
-                user=follow.follower,
-                type=Notification.NotificationType.PROPERTY_UPDATE, # Or create a new type if needed, but this works
-                title=title,
-                message=message,
-                related_property_id=instance.id
-            )
-        )
-    
-    if notifications:
-        Notification.objects.bulk_create(notifications)
+    )
+    logger.info(
+        'Property %s %s: notified %s of %s recipients',
+        instance.id, 'created' if created else 'updated', result.notified, result.recipients
+    )
+    return result
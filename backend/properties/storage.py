@@ -3,8 +3,21 @@ Storage module for file uploads.
 Uses local storage in DEBUG mode, Supabase Storage in production.
 """
 from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+from urllib.parse import urlparse
 import uuid
 import mimetypes
+import posixpath
+
+LOCAL_BACKEND = 'local'
+SUPABASE_BACKEND = 'supabase'
+BACKENDS = (LOCAL_BACKEND, SUPABASE_BACKEND)
+
+
+def get_default_backend():
+    """Storage backend used for new uploads: local in DEBUG, Supabase otherwise"""
+    return LOCAL_BACKEND if settings.DEBUG else SUPABASE_BACKEND
 
 
 def get_supabase_client():
@@ -14,7 +27,7 @@ def get_supabase_client():
 
 
 
-def upload_file(file, bucket_name, folder="properties", filename=None):
+def upload_file(file, bucket_name, folder="properties", filename=None, backend=None):
     """
     Upload a file to storage.
     
@@ -26,6 +39,7 @@ def upload_file(file, bucket_name, folder="properties", filename=None):
         bucket_name: Name of the bucket (used for Supabase; ignored for local)
         folder: Folder path within the storage
         filename: Optional custom filename
+        backend: Optional explicit backend ('local' or 'supabase')
     
     Returns:
         str: Public URL of uploaded file
@@ -33,10 +47,12 @@ def upload_file(file, bucket_name, folder="properties", filename=None):
     Raises:
         Exception: If upload fails
     """
+    backend = backend or get_default_backend()
+    
     # Use local storage for development
-    if settings.DEBUG:
+    if backend == LOCAL_BACKEND:
         from .local_storage import upload_file_local
-        return upload_file_local(file, folder=folder)
+        return upload_file_local(file, folder=folder, filename=filename)
     
     # Production: Use Supabase
     try:
@@ -110,3 +126,195 @@ def delete_file(file_url, bucket_name):
     except Exception as e:
         print(f"Failed to delete from Supabase: {str(e)}")
         return False
+
+
+def read_file(file_url, timeout=30):
+    """
+    Read a stored file's content using its public URL.
+    
+    Local media is read straight from disk; anything else is fetched over HTTP.
+    
+    Returns:
+        bytes: File content
+    
+    Raises:
+        Exception: If the file cannot be read
+    """
+    from .local_storage import read_file_local
+    
+    content = read_file_local(file_url)
+    if content is not None:
+        return content
+    
+    from urllib.request import urlopen
+    with urlopen(file_url, timeout=timeout) as response:
+        return response.read()
+
+
+def open_file(file_url, timeout=30):
+    """
+    Open a stored file for reading in chunks, using its public URL.
+    
+    Local media is opened straight from disk; anything else is streamed over HTTP.
+    
+    Returns:
+        A binary file object, to be used as a context manager
+    
+    Raises:
+        Exception: If the file cannot be opened
+    """
+    import os
+    from .local_storage import local_path_from_url
+    
+    file_path = local_path_from_url(file_url)
+    if file_path is not None and os.path.exists(file_path):
+        return open(file_path, 'rb')
+    
+    from urllib.request import urlopen
+    return urlopen(file_url, timeout=timeout)
+
+
+def parse_file_url(file_url):
+    """
+    Split a stored file's public URL into its backend, bucket and object key.
+    
+    Returns:
+        tuple: (backend, bucket_name, key); bucket_name is None for local files.
+        Returns (None, None, None) if the URL is not recognised.
+    """
+    if not file_url:
+        return None, None, None
+    
+    # Supabase format: .../storage/v1/object/public/<bucket_name>/<path>
+    marker = '/storage/v1/object/public/'
+    path = urlparse(file_url).path
+    if marker in path:
+        bucket_name, _, key = path.split(marker, 1)[1].partition('/')
+        if bucket_name and key:
+            return SUPABASE_BACKEND, bucket_name, key
+    
+    from .local_storage import local_path_from_url
+    if local_path_from_url(file_url) is not None:
+        return LOCAL_BACKEND, None, file_url.split(settings.MEDIA_URL)[-1]
+    
+    return None, None, None
+
+
+# Direct uploads: clients PUT files straight to storage with a short-lived
+# signed URL, so file bodies never pass through a web worker.
+
+UPLOAD_URL_TTL = getattr(settings, 'UPLOAD_URL_TTL', 15 * 60)
+
+
+def create_upload_url(bucket_name, key, content_type, max_size, backend=None):
+    """
+    Issue a short-lived signed URL for uploading one object.
+    
+    Supabase signed upload URLs cannot limit size or type themselves;
+    both are checked against the stored object's metadata afterwards
+    (see stat_file). The local stand-in enforces them while receiving.
+    
+    Returns:
+        dict: url, method and headers for the upload request
+    """
+    backend = backend or get_default_backend()
+    headers = {'Content-Type': content_type}
+    
+    if backend == LOCAL_BACKEND:
+        from .local_storage import create_upload_url_local
+        url = create_upload_url_local(key, content_type, max_size, UPLOAD_URL_TTL)
+        return {'url': url, 'method': 'PUT', 'headers': headers}
+    
+    signed = get_supabase_client().storage.from_(bucket_name).create_signed_upload_url(key)
+    return {'url': signed['signed_url'], 'method': 'PUT', 'headers': headers}
+
+
+def stat_file(bucket_name, key, backend=None):
+    """
+    Size and content type of a stored object, from storage metadata.
+    
+    Returns:
+        tuple: (size in bytes, content type), or None if there is no such object
+    """
+    backend = backend or get_default_backend()
+    
+    if backend == LOCAL_BACKEND:
+        from .local_storage import stat_file_local
+        return stat_file_local(key)
+    
+    folder, name = posixpath.split(key)
+    entries = get_supabase_client().storage.from_(bucket_name).list(folder, {'search': name, 'limit': 1})
+    for entry in entries:
+        if entry.get('name') == name and entry.get('metadata'):
+            metadata = entry['metadata']
+            return int(metadata.get('size') or 0), metadata.get('mimetype') or 'application/octet-stream'
+    return None
+
+
+def public_url(bucket_name, key, backend=None):
+    """Public URL of a stored object"""
+    backend = backend or get_default_backend()
+    if backend == LOCAL_BACKEND:
+        from .local_storage import local_url
+        return local_url(key)
+    return get_supabase_client().storage.from_(bucket_name).get_public_url(key)
+
+
+def delete_object(bucket_name, key, backend=None):
+    """Delete a stored object by its key"""
+    backend = backend or get_default_backend()
+    if backend == LOCAL_BACKEND:
+        from .local_storage import delete_key_local
+        delete_key_local(key)
+    else:
+        get_supabase_client().storage.from_(bucket_name).remove([key])
+
+
+@deconstructible(path='properties.storage.MediaStorage')
+class MediaStorage(FileSystemStorage):
+    """
+    FileField storage following the same rule as upload_file: MEDIA_ROOT
+    with the local backend, `bucket_name` on Supabase otherwise. Files
+    saved under MEDIA_ROOT before a switch to Supabase keep being served
+    from there.
+    """
+    
+    def __init__(self, bucket_name, backend=None, **kwargs):
+        super().__init__(**kwargs)
+        self.bucket_name = bucket_name
+        self._backend = backend
+    
+    @property
+    def backend(self):
+        return self._backend or get_default_backend()
+    
+    def _save(self, name, content):
+        if self.backend == LOCAL_BACKEND:
+            return super()._save(name, content)
+        content.seek(0)
+        get_supabase_client().storage.from_(self.bucket_name).upload(
+            name,
+            content.read(),
+            file_options={'content-type': mimetypes.guess_type(name)[0] or 'application/octet-stream'}
+        )
+        return name
+    
+    def exists(self, name):
+        if self.backend == LOCAL_BACKEND or super().exists(name):
+            return super().exists(name)
+        return stat_file(self.bucket_name, name, self.backend) is not None
+    
+    def size(self, name):
+        if self.backend == LOCAL_BACKEND or super().exists(name):
+            return super().size(name)
+        return stat_file(self.bucket_name, name, self.backend)[0]
+    
+    def delete(self, name):
+        if self.backend == LOCAL_BACKEND or super().exists(name):
+            return super().delete(name)
+        delete_object(self.bucket_name, name, self.backend)
+    
+    def url(self, name):
+        if self.backend == LOCAL_BACKEND or super().exists(name):
+            return super().url(name)
+        return public_url(self.bucket_name, name, self.backend)
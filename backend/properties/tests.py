@@ -1,3 +1,151 @@
+import io
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.test import APIClient
+
+from .models import Property, PropertyImage
+
+User = get_user_model()
+
+
+def png_file(name='photo.png'):
+    content = io.BytesIO()
+    Image.new('RGB', (40, 30), 'red').save(content, 'PNG')
+    return SimpleUploadedFile(name, content.getvalue(), content_type='image/png')
+
+
+class PropertyImageTestCase(TestCase):
+
+    def setUp(self):
+        self.landlord = User.objects.create_user(
+            email='landlord@example.com', username='landlord', password='x', role='LANDLORD'
+        )
+        self.property = Property.objects.create(
+            landlord=self.landlord, title='Flat', description='d', price=1000, location='l',
+            state='Lagos', city='Ikeja', property_type='APARTMENT', num_bedrooms=1, num_bathrooms=1, num_toilets=1
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.landlord)
+
+    def add_image(self, order, is_cover=False):
+        return PropertyImage.objects.create(
+            property=self.property, image_url=f'https://cdn.example.com/{order}.png', order=order, is_cover=is_cover
+        )
+
+    def gallery(self):
+        return list(self.property.images.order_by('order').values_list('order', 'is_cover'))
+
+
+class PropertyImageUploadTests(PropertyImageTestCase):
+    """Images posted with a property update are appended to its gallery"""
+
+    @mock.patch('properties.storage.upload_file', return_value='https://cdn.example.com/new.png')
+    def test_uploads_follow_an_image_at_order_zero(self, upload_file):
+        self.add_image(0, is_cover=True)
+
+        response = self.client.patch(
+            f'/api/properties/{self.property.pk}/', {'image_files': [png_file()]}, format='multipart'
+        )
+
+        self.assertEqual(response.status_code, 200)
+        upload_file.assert_called_once()
+        self.assertEqual(self.gallery(), [(0, True), (1, False)])
+
+
+class ManagePropertyImagesTests(PropertyImageTestCase):
+    """Reordering, cover changes and deletions in one gallery request"""
+
+    def setUp(self):
+        super().setUp()
+        self.images = [self.add_image(order, is_cover=order == 0) for order in range(3)]
+        self.url = f'/api/properties/{self.property.pk}/images/'
+
+    def ids(self, *positions):
+        return [self.images[position].pk for position in positions]
+
+    def covers(self):
+        return list(self.property.images.filter(is_cover=True).values_list('pk', flat=True))
+
+    def test_reorder_and_change_cover(self):
+        order = self.ids(2, 0, 1)
+        response = self.client.patch(self.url, {'order': order, 'cover': order[1]}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([image['id'] for image in response.data], order)
+        self.assertEqual(list(self.property.images.order_by('order').values_list('pk', flat=True)), order)
+        self.assertEqual(self.covers(), [order[1]])
+
+    def test_deleting_the_cover_promotes_the_first_remaining_image(self):
+        response = self.client.patch(self.url, {'delete': self.ids(0)}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.gallery(), [(0, True), (1, False)])
+        self.assertEqual(self.covers(), self.ids(1))
+
+    def test_invalid_galleries_are_rejected(self):
+        stranger = Property.objects.create(
+            landlord=self.landlord, title='Other', description='d', price=1000, location='l',
+            state='Lagos', city='Ikeja', property_type='APARTMENT', num_bedrooms=1, num_bathrooms=1, num_toilets=1
+        )
+        foreign = PropertyImage.objects.create(property=stranger, image_url='https://cdn.example.com/x.png')
+        cases = {
+            'delete': {'delete': [foreign.pk]},
+            'order': [
+                {'order': self.ids(0, 1)},
+                {'order': self.ids(0, 1, 1, 2)},
+                {'order': self.ids(0, 1, 2) + [foreign.pk]},
+                {'order': self.ids(0, 1, 2), 'delete': self.ids(2)},
+            ],
+            'cover': [{'cover': foreign.pk}, {'cover': self.images[1].pk, 'delete': self.ids(1)}],
+        }
+        for field, bodies in cases.items():
+            for body in bodies if isinstance(bodies, list) else [bodies]:
+                with self.subTest(body=body):
+                    response = self.client.patch(self.url, body, format='json')
+                    self.assertEqual(response.status_code, 400)
+                    self.assertIn(field, response.data)
+
+        # Nothing was changed
+        self.assertEqual(self.gallery(), [(0, True), (1, False), (2, False)])
+        self.assertTrue(PropertyImage.objects.filter(pk=foreign.pk).exists())
+
+    def test_gallery_is_locked_and_written_in_one_update(self):
+        select_for_update = PropertyImage.objects.select_for_update
+        depths = []
+
+        def locked(*args, **kwargs):
+            depths.append(len(connection.atomic_blocks))
+            return select_for_update(*args, **kwargs)
+
+        outer = len(connection.atomic_blocks)
+        with mock.patch.object(PropertyImage.objects, 'select_for_update', side_effect=locked), \
+                CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(self.url, {'order': self.ids(1, 2, 0)}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        # Read inside the view's own transaction, not just the test's
+        self.assertEqual(len(depths), 1)
+        self.assertGreater(depths[0], outer)
+        updates = [query for query in queries.captured_queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        # The cover moves with its image
+        self.assertEqual(self.gallery(), [(0, False), (1, False), (2, True)])
+        self.assertEqual(self.covers(), self.ids(0))
+
+    def test_only_the_owner_can_manage_images(self):
+        other = User.objects.create_user(
+            email='other@example.com', username='other', password='x', role='LANDLORD'
+        )
+        self.client.force_authenticate(other)
+        response = self.client.patch(self.url, {'delete': self.ids(0)}, format='json')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.property.images.count(), 3)
 
-# Create your tests here.
+        response = self.client.patch('/api/properties/0/images/', {'delete': []}, format='json')
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,109 @@
+"""
+Direct-to-storage uploads.
+
+Instead of posting file bodies through the API, clients:
+1. POST /api/properties/uploads/ with the kind of upload, its content type
+   and size, and get back a short-lived signed URL and an object key;
+2. PUT the file to that URL (Supabase Storage, or homehive.media locally);
+3. send the key with the property or chat message it belongs to.
+
+Step 3 confirms the upload: the key must be one issued to the same user
+for the same kind of upload, and the stored object's size and content type
+(read from storage metadata, not trusted from the client) must be within
+the kind's limits. Objects that fail the check are deleted.
+"""
+import mimetypes
+import re
+import uuid
+from collections import namedtuple
+
+from rest_framework import serializers
+
+from .storage import create_upload_url, delete_object, public_url, stat_file
+
+MB = 1024 * 1024
+
+IMAGE_TYPES = ('image/jpeg', 'image/png', 'image/gif', 'image/webp')
+VIDEO_TYPES = ('video/mp4', 'video/webm', 'video/quicktime')
+DOCUMENT_TYPES = ('application/pdf',)
+
+UploadKind = namedtuple('UploadKind', ['bucket_name', 'folder', 'content_types', 'max_size', 'landlord_only'])
+
+UPLOAD_KINDS = {
+    'property_image': UploadKind('property-images', 'uploads/images', IMAGE_TYPES, 10 * MB, True),
+    'property_video': UploadKind('property-videos', 'uploads/videos', VIDEO_TYPES, 200 * MB, True),
+    'chat_attachment': UploadKind('chat-attachments', 'chat_attachments', IMAGE_TYPES + VIDEO_TYPES + DOCUMENT_TYPES, 50 * MB, False),
+}
+
+# Extensions mimetypes would guess poorly for the allowed types
+EXTENSIONS = {'image/jpeg': '.jpg', 'video/quicktime': '.mov'}
+
+
+def _key_pattern(kind, user):
+    """Keys issued to `user` for `kind`: <folder>/<user id>/<uuid4><extension>"""
+    return re.compile(
+        rf'^{re.escape(kind.folder)}/{user.id}/'
+        r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\.[A-Za-z0-9]+$'
+    )
+
+
+def get_kind(user, kind_name):
+    kind = UPLOAD_KINDS.get(kind_name)
+    if kind is None:
+        raise serializers.ValidationError({'kind': f"Must be one of: {', '.join(UPLOAD_KINDS)}."})
+    if kind.landlord_only and not user.is_landlord():
+        raise serializers.ValidationError({'kind': 'Only landlords can upload property media.'})
+    return kind
+
+
+def start_upload(user, kind_name, content_type, size):
+    """
+    Issue a signed upload URL for one file.
+
+    Returns:
+        dict: the object key plus the url, method and headers to upload with
+
+    Raises:
+        ValidationError: if the kind, type or size is not allowed
+    """
+    kind = get_kind(user, kind_name)
+    if content_type not in kind.content_types:
+        raise serializers.ValidationError({'content_type': f"Must be one of: {', '.join(kind.content_types)}."})
+    if size > kind.max_size:
+        raise serializers.ValidationError({'size': f"Must be at most {kind.max_size // MB} MB."})
+
+    extension = EXTENSIONS.get(content_type) or mimetypes.guess_extension(content_type) or '.bin'
+    key = f"{kind.folder}/{user.id}/{uuid.uuid4()}{extension}"
+    upload = create_upload_url(kind.bucket_name, key, content_type, kind.max_size)
+    return {'key': key, **upload}
+
+
+def confirm_upload(user, kind_name, key):
+    """
+    Check an uploaded object before it is attached to anything.
+
+    Returns:
+        tuple: (size, content type) from storage metadata
+
+    Raises:
+        ValidationError: if the key was not issued to `user` for this kind,
+        nothing was uploaded, or the stored object breaks the kind's limits
+    """
+    kind = UPLOAD_KINDS[kind_name]
+    if not _key_pattern(kind, user).match(key or ''):
+        raise serializers.ValidationError(f"Unknown upload: {key}")
+
+    stored = stat_file(kind.bucket_name, key)
+    if stored is None:
+        raise serializers.ValidationError(f"Nothing has been uploaded to {key}")
+    size, content_type = stored
+
+    if content_type not in kind.content_types or size > kind.max_size:
+        delete_object(kind.bucket_name, key)
+        raise serializers.ValidationError(f"Upload {key} is not an allowed file type or is too large")
+    return size, content_type
+
+
+def confirmed_url(kind_name, key):
+    """Public URL of a confirmed upload"""
+    return public_url(UPLOAD_KINDS[kind_name].bucket_name, key)
@@ -9,8 +9,10 @@ from .views import (
     unsave_property,
     landlord_analytics,
     similar_properties,
+    manage_property_images,
     DeletePropertyImageView,
-    DeletePropertyVideoView
+    DeletePropertyVideoView,
+    create_upload
 )
 
 app_name = 'properties'
@@ -19,10 +21,14 @@ urlpatterns = [
     # Property CRUD
     path('', PropertyListCreateView.as_view(), name='property-list-create'),
     path('<int:pk>/', PropertyDetailView.as_view(), name='property-detail'),
+    path('<int:pk>/images/', manage_property_images, name='manage-property-images'),
     path('images/<int:pk>/delete/', DeletePropertyImageView.as_view(), name='delete-property-image'),
     path('videos/<int:pk>/delete/', DeletePropertyVideoView.as_view(), name='delete-property-video'),
     path('<int:pk>/similar/', similar_properties, name='similar-properties'),
     
+    # Direct-to-storage uploads
+    path('uploads/', create_upload, name='create-upload'),
+    
     # Featured/Premium
     path('featured/', FeaturedPropertiesView.as_view(), name='featured-properties'),
     
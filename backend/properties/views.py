@@ -2,15 +2,20 @@ from rest_framework import generics, status, filters
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
+from django.db import transaction
 from django.db.models import Q
 from .models import Property, SavedProperty, PropertyImage, PropertyVideo, PropertyView
 from .serializers import (
     PropertyListSerializer,
     PropertyDetailSerializer,
     PropertyCreateUpdateSerializer,
-    SavedPropertySerializer
+    PropertyGalleryUpdateSerializer,
+    PropertyImageSerializer,
+    SavedPropertySerializer,
+    DirectUploadSerializer
 )
 from .permissions import IsLandlordOrReadOnly, IsPropertyOwner
+from .uploads import start_upload
 
 # ... (existing imports)
 
@@ -38,6 +43,100 @@ class DeletePropertyVideoView(generics.DestroyAPIView):
         return PropertyVideo.objects.filter(property__landlord=self.request.user)
 
 
+@api_view(['PATCH'])
+@permission_classes([IsAuthenticated])
+def manage_property_images(request, pk):
+    """
+    Apply gallery changes for a property in one request.
+    
+    Body:
+    - order: list of image ids in the desired display order
+    - cover: id of the new cover image
+    - delete: list of image ids to remove
+    
+    Everything is applied in a single transaction and the updated gallery is returned.
+    Only the landlord who owns the property can manage its images.
+    """
+    try:
+        property_obj = Property.objects.get(pk=pk)
+    except Property.DoesNotExist:
+        return Response({'error': 'Property not found'}, status=status.HTTP_404_NOT_FOUND)
+    
+    if property_obj.landlord_id != request.user.id:
+        return Response(
+            {'error': 'Only the property owner can manage its images'},
+            status=status.HTTP_403_FORBIDDEN
+        )
+    
+    with transaction.atomic():
+        images = {
+            img.id: img
+            for img in PropertyImage.objects.select_for_update().filter(property=property_obj)
+        }
+        
+        serializer = PropertyGalleryUpdateSerializer(
+            data=request.data,
+            context={'image_ids': list(images)}
+        )
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        
+        delete_ids = set(data.get('delete', []))
+        if delete_ids:
+            PropertyImage.objects.filter(property=property_obj, id__in=delete_ids).delete()
+        
+        remaining = [img for img_id, img in images.items() if img_id not in delete_ids]
+        if 'order' in data:
+            position = {img_id: idx for idx, img_id in enumerate(data['order'])}
+            remaining.sort(key=lambda img: position[img.id])
+        else:
+            remaining.sort(key=lambda img: (img.order, img.uploaded_at))
+        
+        # Keep the current cover unless a new one is chosen or it was deleted
+        cover_id = data.get('cover')
+        if cover_id is None:
+            cover_id = next((img.id for img in remaining if img.is_cover), None)
+        if cover_id is None and remaining:
+            cover_id = remaining[0].id
+        
+        changed = []
+        for idx, img in enumerate(remaining):
+            is_cover = img.id == cover_id
+            if img.order != idx or img.is_cover != is_cover:
+                img.order = idx
+                img.is_cover = is_cover
+                changed.append(img)
+        
+        # bulk_update bypasses PropertyImage.save, so the single-cover rule
+        # is enforced by the loop above rather than one UPDATE per image
+        if changed:
+            PropertyImage.objects.bulk_update(changed, ['order', 'is_cover'])
+    
+    return Response(PropertyImageSerializer(remaining, many=True).data)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def create_upload(request):
+    """
+    Issue a short-lived signed URL for uploading one file directly to storage.
+    
+    Body:
+    - kind: property_image, property_video or chat_attachment
+    - content_type: MIME type the file will be uploaded with
+    - size: file size in bytes
+    
+    Returns the object key plus the url, method and headers to upload with.
+    After uploading, send the key as one of a property's image_keys/video_keys
+    or as a message's attachment_key.
+    """
+    serializer = DirectUploadSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    data = serializer.validated_data
+    upload = start_upload(request.user, data['kind'], data['content_type'], data['size'])
+    return Response(upload, status=status.HTTP_201_CREATED)
+
+
 class PropertyListCreateView(generics.ListCreateAPIView):
     """
     List all properties with search/filtering or create new property (landlords only).
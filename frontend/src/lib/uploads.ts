@@ -0,0 +1,44 @@
+const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
+
+export type UploadKind = 'property_image' | 'property_video' | 'chat_attachment';
+
+interface SignedUpload {
+    key: string;
+    url: string;
+    method: string;
+    headers: Record<string, string>;
+}
+
+/**
+ * Upload a file straight to storage with a signed URL from the API.
+ * Returns the object key to send with the property or message it belongs to.
+ */
+export async function uploadDirect(file: File, kind: UploadKind, token: string | null): Promise<string> {
+    const response = await fetch(`${API_URL}/api/properties/uploads/`, {
+        method: 'POST',
+        headers: {
+            'Authorization': `Bearer ${token}`,
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({
+            kind,
+            content_type: file.type || 'application/octet-stream',
+            size: file.size,
+        }),
+    });
+    if (!response.ok) {
+        const errData = await response.json().catch(() => ({}));
+        throw new Error(errData.detail || JSON.stringify(errData));
+    }
+    const upload: SignedUpload = await response.json();
+
+    const uploadResponse = await fetch(upload.url, {
+        method: upload.method,
+        headers: upload.headers,
+        body: file,
+    });
+    if (!uploadResponse.ok) {
+        throw new Error(`Failed to upload ${file.name}`);
+    }
+    return upload.key;
+}
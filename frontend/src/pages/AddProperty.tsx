@@ -12,6 +12,7 @@ import { useToast } from '@/hooks/use-toast';
 import { Loader2, Upload, X, Car, Shield, Droplets, Wifi, Zap, Wind, Tv } from 'lucide-react';
 import { NIGERIAN_STATES } from '@/constants/locations';
 import { useAuth } from '@/context/AuthContext';
+import { uploadDirect } from '@/lib/uploads';
 
 interface MediaFile {
     file: File;
@@ -190,14 +191,11 @@ export default function AddProperty() {
                 data.append('amenities_list', amenity);
             });
 
-            // Append files
-            images.forEach(img => {
-                data.append('image_files', img.file);
-            });
-
-            videos.forEach(vid => {
-                data.append('video_files', vid.file);
-            });
+            // Upload media straight to storage, then send only the keys
+            const imageKeys = await Promise.all(images.map(img => uploadDirect(img.file, 'property_image', token)));
+            const videoKeys = await Promise.all(videos.map(vid => uploadDirect(vid.file, 'property_video', token)));
+            imageKeys.forEach(key => data.append('image_keys', key));
+            videoKeys.forEach(key => data.append('video_keys', key));
 
             const response = await fetch(`${import.meta.env.VITE_API_URL}/api/properties/`, {
                 method: 'POST',
@@ -218,7 +216,7 @@ export default function AddProperty() {
 
             toast({
                 title: "Success",
-                description: "Property listed successfully! Media is being uploaded.",
+                description: "Property listed successfully!",
             });
 
             navigate(`/property/${resData.id}`);
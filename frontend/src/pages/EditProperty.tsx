@@ -13,6 +13,7 @@ import { useToast } from '@/hooks/use-toast';
 import { Loader2, Upload, X, Car, Shield, Droplets, Wifi, Zap, Wind, Tv, Plus } from 'lucide-react';
 import { NIGERIAN_STATES } from '@/constants/locations';
 import { useAuth } from '@/context/AuthContext';
+import { uploadDirect } from '@/lib/uploads';
 
 interface MediaFile {
     file?: File;
@@ -330,19 +331,14 @@ export default function EditProperty() {
             // AND I will show a warning/note to user: "Uploading new images will replace existing ones".
             // This is a known limitation I will accept for this iteration.
 
-            const newImages = images.filter(img => !img.isExisting);
-            if (newImages.length > 0) {
-                newImages.forEach(img => {
-                    if (img.file) data.append('image_files', img.file);
-                });
-            }
+            // New media is uploaded straight to storage; only the keys are sent
+            const newImageFiles = images.filter(img => !img.isExisting && img.file).map(img => img.file as File);
+            const imageKeys = await Promise.all(newImageFiles.map(file => uploadDirect(file, 'property_image', token)));
+            imageKeys.forEach(key => data.append('image_keys', key));
 
-            const newVideos = videos.filter(vid => !vid.isExisting);
-            if (newVideos.length > 0) {
-                newVideos.forEach(vid => {
-                    if (vid.file) data.append('video_files', vid.file);
-                });
-            }
+            const newVideoFiles = videos.filter(vid => !vid.isExisting && vid.file).map(vid => vid.file as File);
+            const videoKeys = await Promise.all(newVideoFiles.map(file => uploadDirect(file, 'property_video', token)));
+            videoKeys.forEach(key => data.append('video_keys', key));
 
             // Note: If user deleted existing images but added none, we currently can't sync that deletion easily via this serializer.
             // Ideally we'd have a 'retain_image_ids' field.
@@ -21,6 +21,7 @@ import {
 import { useAuth } from '@/context/AuthContext';
 import { useToast } from '@/hooks/use-toast';
 import { cn } from '@/lib/utils';
+import { uploadDirect } from '@/lib/uploads';
 import { format } from 'date-fns';
 
 interface User {
@@ -39,6 +40,7 @@ interface Message {
   content: string;
   is_read: boolean;
   timestamp: string;
+  edited_at?: string | null;
   reply_to?: number;
   reply_to_info?: {
     id: number;
@@ -52,6 +54,7 @@ interface Message {
     title: string;
     cover_image: string | null;
   };
+  client_id?: string | null;
 }
 
 interface ChatRoom {
@@ -68,6 +71,15 @@ interface ChatRoom {
   updated_at: string;
 }
 
+interface Presence {
+  online: boolean;
+  last_seen: string | null;
+}
+
+// Typing indicators expire unless refreshed; resend while the user keeps typing
+const TYPING_RESEND_MS = 3000;
+const TYPING_EXPIRE_MS = 8000;
+
 export default function Messages() {
   const { user, token } = useAuth();
   const { toast } = useToast();
@@ -81,6 +93,9 @@ export default function Messages() {
   const [isSending, setIsSending] = useState(false);
   const [searchQuery, setSearchQuery] = useState('');
   const scrollRef = useRef<HTMLDivElement>(null);
+  const keepScrollRef = useRef(false);
+  const [hasOlderMessages, setHasOlderMessages] = useState(false);
+  const [isLoadingOlder, setIsLoadingOlder] = useState(false);
   const socketRef = useRef<WebSocket | null>(null);
   const reconnectTimeoutRef = useRef<NodeJS.Timeout>();
   const [editingMessage, setEditingMessage] = useState<Message | null>(null);
@@ -88,6 +103,12 @@ export default function Messages() {
   const [selectedFile, setSelectedFile] = useState<File | null>(null);
   const [contextPropertyId, setContextPropertyId] = useState<number | null>(null);
   const fileInputRef = useRef<HTMLInputElement>(null);
+  const [presence, setPresence] = useState<Record<number, Presence>>({});
+  const [typingRooms, setTypingRooms] = useState<Record<number, boolean>>({});
+  const typingTimeoutsRef = useRef<Record<number, NodeJS.Timeout>>({});
+  const lastTypingSentRef = useRef(0);
+  // Sent message frames the server has not acked yet, by client_id; resent after a reconnect
+  const unackedRef = useRef<Record<string, object>>({});
 
   const handleEditMessage = (message: Message) => {
     setNewMessage(message.content);
@@ -115,10 +136,8 @@ export default function Messages() {
   };
 
   useEffect(() => {
+    // Conversation list changes arrive over the per-user socket, no polling needed
     fetchConversations();
-    // Poll for new conversations every 30s
-    const interval = setInterval(fetchConversations, 30000);
-    return () => clearInterval(interval);
   }, [token]);
 
   // Handle conversation selection from location state
@@ -146,53 +165,146 @@ export default function Messages() {
     }
   }, [location.state, conversations]);
 
+  const selectedChatRef = useRef<ChatRoom | null>(null);
+  selectedChatRef.current = selectedChat;
+  const conversationsRef = useRef<ChatRoom[]>([]);
+  conversationsRef.current = conversations;
+  const messagesRef = useRef<Message[]>([]);
+  messagesRef.current = messages;
+  const hasConnectedRef = useRef(false);
+
+  // `since` asks the server to replay whatever was missed after that message
+  const subscribeToRoom = (roomId: number, since?: number) => {
+    if (socketRef.current && socketRef.current.readyState === WebSocket.OPEN) {
+      socketRef.current.send(JSON.stringify({ action: 'subscribe', room_id: roomId, since }));
+    }
+  };
+
   const connectWebSocket = () => {
-    if (!selectedChat || !token) return;
+    if (!token) return;
 
     // Close existing connection if any
     if (socketRef.current) {
       socketRef.current.close();
     }
 
-    const wsUrl = `${import.meta.env.VITE_WS_URL || 'ws://localhost:8000'}/ws/chat/${selectedChat.id}/?token=${token}`;
+    // One socket per user carries events for every conversation
+    const wsUrl = `${import.meta.env.VITE_WS_URL || 'ws://localhost:8000'}/ws/chat/?token=${token}`;
     const socket = new WebSocket(wsUrl);
 
     socket.onopen = () => {
-      console.log("Connected to chat", selectedChat.id);
+      console.log("Connected to chat");
+      const isReconnect = hasConnectedRef.current;
+      hasConnectedRef.current = true;
+      if (isReconnect) {
+        // Conversation summaries may have moved while we were away
+        fetchConversations();
+      }
+      if (selectedChatRef.current) {
+        const loaded = messagesRef.current;
+        const lastId = isReconnect && loaded.length > 0 ? loaded[loaded.length - 1].id : undefined;
+        subscribeToRoom(selectedChatRef.current.id, lastId);
+      }
+      // The server answers resends of messages it already has with the original
+      Object.values(unackedRef.current).forEach(frame => socket.send(JSON.stringify(frame)));
     };
 
     socket.onmessage = (event) => {
       const data = JSON.parse(event.data);
-      if (data.type === 'message') {
+      if (data.type === 'ping') {
+        // Heartbeat: unanswered pings get the socket closed
+        socket.send(JSON.stringify({ action: 'pong' }));
+      } else if (data.type === 'message') {
         const incomingMsg = data.message;
-        setMessages((prev) => {
-          // Prevent duplicates
-          if (prev.some(m => m.id === incomingMsg.id)) return prev;
-          return [...prev, incomingMsg];
-        });
+        const isActiveRoom = selectedChatRef.current?.id === data.room_id;
+        if (incomingMsg.sender !== user?.id) {
+          setTypingRooms(prev => ({ ...prev, [data.room_id]: false }));
+        }
+
+        if (isActiveRoom) {
+          setMessages((prev) => {
+            // Prevent duplicates
+            if (prev.some(m => m.id === incomingMsg.id)) return prev;
+            return [...prev, incomingMsg];
+          });
+        }
 
         // Update conversation list with new last message
+        if (!conversationsRef.current.some(c => c.id === data.room_id)) {
+          fetchConversations();
+          return;
+        }
         setConversations(prev => prev.map(c => {
-          if (c.id === selectedChat.id) {
+          if (c.id === data.room_id) {
+            const isIncoming = incomingMsg.sender !== user?.id;
             return {
               ...c,
               last_message: incomingMsg,
-              updated_at: incomingMsg.timestamp
+              updated_at: data.updated_at,
+              unread_count: !isActiveRoom && isIncoming ? c.unread_count + 1 : c.unread_count
             };
           }
           return c;
         }).sort((a, b) => new Date(b.updated_at).getTime() - new Date(a.updated_at).getTime()));
+      } else if (data.type === 'read') {
+        if (data.reader_id === user?.id) {
+          setConversations(prev => prev.map(c => c.id === data.room_id ? { ...c, unread_count: 0 } : c));
+        } else if (selectedChatRef.current?.id === data.room_id) {
+          // The other participant's read watermark moved: tick our messages up to it
+          setMessages(prev => prev.map(m =>
+            m.sender === user?.id && m.id <= data.last_read_id ? { ...m, is_read: true } : m
+          ));
+        }
+      } else if (data.type === 'room') {
+        fetchConversations();
+      } else if (data.type === 'edited') {
+        if (selectedChatRef.current?.id === data.room_id) {
+          setMessages(prev => prev.map(m => m.id === data.message.id ? data.message : m));
+        }
+      } else if (data.type === 'deleted') {
+        if (selectedChatRef.current?.id === data.room_id) {
+          setMessages(prev => prev.filter(m => m.id !== data.id));
+        }
+      } else if (data.type === 'resync_complete') {
+        // Too much was missed to replay; reload the latest page instead
+        if (data.truncated && selectedChatRef.current?.id === data.room_id) {
+          fetchMessages(data.room_id);
+        }
+      } else if (data.type === 'typing') {
+        clearTimeout(typingTimeoutsRef.current[data.room_id]);
+        setTypingRooms(prev => ({ ...prev, [data.room_id]: data.typing }));
+        if (data.typing) {
+          typingTimeoutsRef.current[data.room_id] = setTimeout(() => {
+            setTypingRooms(prev => ({ ...prev, [data.room_id]: false }));
+          }, TYPING_EXPIRE_MS);
+        }
+      } else if (data.type === 'presence') {
+        setPresence(prev => ({ ...prev, [data.user_id]: { online: data.online, last_seen: data.last_seen } }));
+      } else if (data.type === 'failed') {
+        // Write-behind mode: these messages were broadcast but could not be stored
+        const failedIds = new Set(data.messages.map((m: { id: number }) => m.id));
+        setMessages(prev => prev.filter(m => !failedIds.has(m.id)));
+        toast({ title: "Some messages could not be sent", variant: "destructive" });
+      } else if (data.type === 'ack') {
+        delete unackedRef.current[data.client_id];
+      } else if (data.type === 'throttled' && data.room_id) {
+        // Rate limited: the message was not sent
+        delete unackedRef.current[data.client_id];
+        toast({ title: "You're sending messages too quickly", variant: "destructive" });
       }
     };
 
-    socket.onclose = () => {
+    socket.onclose = (event) => {
       console.log("Disconnected from chat");
-      // Attempt reconnect if still on the same chat
+      if (event.code === 4009) {
+        // Too many chat tabs open; the server refuses further sockets
+        toast({ title: "Chat is open in too many tabs", variant: "destructive" });
+        return;
+      }
+      // Attempt reconnect while the page is still mounted
       reconnectTimeoutRef.current = setTimeout(() => {
-        if (selectedChat.id === selectedChat.id) { // naive check, better to rely on ref or just depend on useEffect
-          // rely on useEffect re-triggering? No, simpler to just let user or deps handle it
-          // But for robustness, we can try to reconnect.
-          // However, if we just close, we might want to flag it.
+        if (socketRef.current === socket) {
+          connectWebSocket();
         }
       }, 3000);
     };
@@ -201,14 +313,27 @@ export default function Messages() {
   };
 
   // WebSocket Connection
+  useEffect(() => {
+    if (!token) return;
+    connectWebSocket();
+
+    return () => {
+      if (reconnectTimeoutRef.current) {
+        clearTimeout(reconnectTimeoutRef.current);
+      }
+      if (socketRef.current) {
+        const socket = socketRef.current;
+        socketRef.current = null;
+        socket.close();
+      }
+    };
+  }, [token]);
+
+  // Active conversation
   useEffect(() => {
     if (selectedChat && token) {
       fetchMessages(selectedChat.id);
-      connectWebSocket();
-
-      // Dispatch event to refresh nav notifications immediately
-      // This assumes the backend handles mark-read logic or we call it explicitly
-      // Ideally we should call mark-read endpoint here if not already done by fetchMessages (which is GET)
+      subscribeToRoom(selectedChat.id);
 
       // Call mark-as-read
       fetch(`${import.meta.env.VITE_API_URL}/api/chat/rooms/${selectedChat.id}/mark-read/`, {
@@ -218,20 +343,15 @@ export default function Messages() {
         // Dispatch custom event for Navbar to pick up
         window.dispatchEvent(new CustomEvent('refresh-notifications'));
       }).catch(err => console.error("Failed to mark read", err));
-
-
-      return () => {
-        if (socketRef.current) {
-          socketRef.current.close();
-        }
-        if (reconnectTimeoutRef.current) {
-          clearTimeout(reconnectTimeoutRef.current);
-        }
-      };
     }
-  }, [selectedChat, token]);
+  }, [selectedChat?.id, token]);
 
   useEffect(() => {
+    // Keep the reader's position when older history is prepended
+    if (keepScrollRef.current) {
+      keepScrollRef.current = false;
+      return;
+    }
     if (scrollRef.current) {
       scrollRef.current.scrollIntoView({ behavior: 'smooth' });
     }
@@ -247,6 +367,7 @@ export default function Messages() {
         // Handle DRF pagination
         const conversationList = Array.isArray(data) ? data : (data.results || []);
         setConversations(conversationList);
+        fetchPresence(conversationList);
       }
     } catch (error) {
       console.error('Error fetching conversations', error);
@@ -255,6 +376,30 @@ export default function Messages() {
     }
   };
 
+  const fetchPresence = async (conversationList: ChatRoom[]) => {
+    const userIds = [...new Set(conversationList.map(c => getOtherUser(c).id))];
+    if (userIds.length === 0) return;
+    try {
+      const response = await fetch(`${import.meta.env.VITE_API_URL}/api/chat/presence/?user_ids=${userIds.join(',')}`, {
+        headers: { 'Authorization': `Bearer ${token}` },
+      });
+      if (response.ok) {
+        const data = await response.json();
+        setPresence(prev => ({ ...prev, ...data }));
+      }
+    } catch (error) {
+      console.error('Error fetching presence', error);
+    }
+  };
+
+  const sendTyping = (typing: boolean) => {
+    if (!selectedChat || !socketRef.current || socketRef.current.readyState !== WebSocket.OPEN) return;
+    const now = Date.now();
+    if (typing && now - lastTypingSentRef.current < TYPING_RESEND_MS) return;
+    lastTypingSentRef.current = typing ? now : 0;
+    socketRef.current.send(JSON.stringify({ action: 'typing', room_id: selectedChat.id, typing }));
+  };
+
   const fetchMessages = async (chatId: number) => {
     try {
       const response = await fetch(`${import.meta.env.VITE_API_URL}/api/chat/rooms/${chatId}/messages/`, {
@@ -262,15 +407,37 @@ export default function Messages() {
       });
       if (response.ok) {
         const data = await response.json();
-        // Handle DRF pagination
+        // Newest page first; older history is loaded on demand
         const messageList = Array.isArray(data) ? data : (data.results || []);
         setMessages(messageList);
+        setHasOlderMessages(Boolean(data.has_older));
       }
     } catch (error) {
       console.error('Error fetching messages', error);
     }
   };
 
+  const fetchOlderMessages = async () => {
+    if (!selectedChat || messages.length === 0 || isLoadingOlder) return;
+    setIsLoadingOlder(true);
+    try {
+      const response = await fetch(
+        `${import.meta.env.VITE_API_URL}/api/chat/rooms/${selectedChat.id}/messages/?before=${messages[0].id}`,
+        { headers: { 'Authorization': `Bearer ${token}` } }
+      );
+      if (response.ok) {
+        const data = await response.json();
+        keepScrollRef.current = true;
+        setMessages(prev => [...(data.results || []), ...prev]);
+        setHasOlderMessages(Boolean(data.has_older));
+      }
+    } catch (error) {
+      console.error('Error fetching older messages', error);
+    } finally {
+      setIsLoadingOlder(false);
+    }
+  };
+
   const handleSendMessage = async (e: React.FormEvent) => {
     e.preventDefault();
     if (!newMessage.trim() || !selectedChat) return;
@@ -287,11 +454,18 @@ export default function Messages() {
 
     // Let's use WebSocket for sending if connected (only for text-only, non-edit messages)
     if (!selectedFile && !editingMessage && socketRef.current && socketRef.current.readyState === WebSocket.OPEN) {
-      socketRef.current.send(JSON.stringify({
+      const frame = {
+        action: 'message',
+        room_id: selectedChat.id,
         message: newMessage,
         reply_to: replyingTo?.id,
-        property: contextPropertyId
-      }));
+        property: contextPropertyId,
+        client_id: crypto.randomUUID()
+      };
+      unackedRef.current[frame.client_id] = frame;
+      socketRef.current.send(JSON.stringify(frame));
+      // The server clears our typing indicator when the message arrives
+      lastTypingSentRef.current = 0;
       setNewMessage('');
       setReplyingTo(null);
       setContextPropertyId(null);
@@ -309,25 +483,21 @@ export default function Messages() {
         method = 'PATCH';
       }
 
-      let body: any;
-      let headers: any = { 'Authorization': `Bearer ${token}` };
-
-      if (selectedFile) {
-        const formData = new FormData();
-        formData.append('content', newMessage);
-        formData.append('attachment', selectedFile);
-        if (replyingTo) formData.append('reply_to', replyingTo.id.toString());
-        if (contextPropertyId) formData.append('property', contextPropertyId.toString());
-        body = formData;
-        // Don't set Content-Type, browser will set it with boundary for FormData
-      } else {
-        body = JSON.stringify({
-          content: newMessage,
-          reply_to: replyingTo?.id,
-          property: contextPropertyId
-        });
-        headers['Content-Type'] = 'application/json';
-      }
+      // Attachments go straight to storage; the message only carries the key
+      const attachmentKey = selectedFile
+        ? await uploadDirect(selectedFile, 'chat_attachment', token)
+        : undefined;
+
+      const body = JSON.stringify({
+        content: newMessage,
+        reply_to: replyingTo?.id,
+        property: contextPropertyId,
+        attachment_key: attachmentKey
+      });
+      const headers = {
+        'Authorization': `Bearer ${token}`,
+        'Content-Type': 'application/json'
+      };
 
       const response = await fetch(url, {
         method: method,
@@ -441,6 +611,9 @@ export default function Messages() {
                         <AvatarImage src={otherUser?.avatar || undefined} className="object-cover" />
                         <AvatarFallback>{otherUser?.first_name?.[0]}</AvatarFallback>
                       </Avatar>
+                      {presence[otherUser.id]?.online && (
+                        <span className="-ml-5 mt-7 w-3 h-3 rounded-full bg-green-500 border-2 border-background shrink-0" />
+                      )}
                       <div className="flex-1 min-w-0">
                         <div className="flex justify-between items-start mb-1">
                           <span className="font-semibold truncate">
@@ -455,7 +628,9 @@ export default function Messages() {
                         <p className="text-xs text-primary mb-1 truncate">{conversation.property?.title}</p>
                         <div className="flex justify-between items-center">
                           <p className="text-sm text-muted-foreground truncate max-w-[180px]">
-                            {conversation.last_message?.content || 'No messages yet'}
+                            {typingRooms[conversation.id]
+                              ? <span className="italic text-primary">typing...</span>
+                              : conversation.last_message?.content || 'No messages yet'}
                           </p>
                           {conversation.unread_count > 0 && (
                             <Badge className="bg-primary hover:bg-primary h-5 min-w-5 flex items-center justify-center rounded-full px-1">
@@ -508,6 +683,15 @@ export default function Messages() {
                     <Badge variant="outline" className="text-xs font-normal mt-0.5 border-primary/20 bg-primary/5 text-primary">
                       {selectedChat.property?.title}
                     </Badge>
+                    <p className="text-xs text-muted-foreground">
+                      {typingRooms[selectedChat.id]
+                        ? 'typing...'
+                        : presence[getOtherUser(selectedChat).id]?.online
+                          ? 'Online'
+                          : presence[getOtherUser(selectedChat).id]?.last_seen
+                            ? `Last seen ${format(new Date(presence[getOtherUser(selectedChat).id].last_seen!), 'MMM d, h:mm a')}`
+                            : null}
+                    </p>
                   </div>
                 </div>
               </div>
@@ -527,6 +711,13 @@ export default function Messages() {
             {/* Messages */}
             <ScrollArea className="flex-1 p-6">
               <div className="space-y-4 max-w-3xl mx-auto">
+                {hasOlderMessages && (
+                  <div className="flex justify-center">
+                    <Button variant="ghost" size="sm" onClick={fetchOlderMessages} disabled={isLoadingOlder}>
+                      {isLoadingOlder ? <Loader2 className="w-4 h-4 animate-spin" /> : 'Load older messages'}
+                    </Button>
+                  </div>
+                )}
                 {messages.map((message) => {
                   const isOwn = message.sender === user?.id;
                   return (
@@ -644,7 +835,7 @@ export default function Messages() {
                         <div className="flex flex-col gap-1 group/bubble min-w-[120px]">
                           <span className="break-words leading-relaxed">{message.content}</span>
                           <div className={cn("flex items-center gap-1 justify-end text-[10px] opacity-70 ml-auto leading-none", isOwn ? "text-primary-foreground" : "text-muted-foreground")}>
-                            <span>{format(new Date(message.timestamp), 'h:mm a')}</span>
+                            <span>{format(new Date(message.timestamp), 'h:mm a')}{message.edited_at && ' (edited)'}</span>
                             {isOwn && (
                               message.is_read ? <CheckCheck className="w-3 h-3" /> : <Check className="w-3 h-3" />
                             )}
@@ -718,7 +909,10 @@ export default function Messages() {
                   </Button>
                   <Input
                     value={newMessage}
-                    onChange={(e) => setNewMessage(e.target.value)}
+                    onChange={(e) => {
+                      setNewMessage(e.target.value);
+                      sendTyping(e.target.value.trim().length > 0);
+                    }}
                     placeholder={editingMessage ? "Edit your message..." : "Type a message..."}
                     onKeyDown={(e) => {
                       if (e.key === 'Escape' && editingMessage) {